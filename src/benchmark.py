@@ -0,0 +1,294 @@
+"""End-to-end benchmark: capture -> preview -> record, without a camera or a display.
+
+Each case captures from synthetic sources (sources.py) or replays a recording through a
+CaptureSession, renders the live preview offscreen at the preview rate as the application
+does, and records every stream with the chosen codec. It reports sustained capture and
+recording fps, dropped frames, per-stage latency percentiles, CPU use and peak RSS:
+
+    python src/benchmark.py --resolutions 640x480,1280x720,1920x1080 --streams 1,2,4 --json bench.json
+    python src/benchmark.py --replay videos/take20240101120000.avi --streams 1,2 --json bench.json
+    python src/benchmark.py --json new.json --compare bench.json
+
+Every case runs in a fresh process, so its CPU time and peak RSS are its own. With
+--compare, cases that record slower, drop frames they did not drop before or use more
+memory than the baseline (beyond --tolerance) are listed and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+
+import cv2
+
+from encoders import DEFAULT_ENCODER, ENCODER_NAMES
+from metrics import StageHistogram
+from preview import MosaicComposer, PreviewRenderer
+from session import CaptureSession
+from sources import REPLAY_SCHEME, synthetic_source
+
+try:
+    import resource
+except ImportError:
+    # Windows: peak RSS is not reported
+    resource = None
+
+# One benchmark run: `streams` copies of `source` recorded with `codec` for `seconds`,
+# after `warmup_seconds` of capture and preview only
+BenchmarkCase = namedtuple("BenchmarkCase", ["source", "streams", "codec", "seconds", "warmup_seconds", "preview_fps"],
+                           defaults=(1, DEFAULT_ENCODER, 10.0, 2.0, 15))
+
+DEFAULT_RESOLUTIONS = "640x480,1280x720,1920x1080"
+DEFAULT_STREAMS = "1,2"
+DEFAULT_TOLERANCE = 0.1
+
+# Size of the preview label the offscreen preview renders into
+PREVIEW_SIZE = (960, 540)
+
+
+class OffscreenLabel:
+    """Stands in for the Tk video label: it has a fixed size and ignores config()."""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+    def winfo_width(self):
+        return self.width
+
+    def winfo_height(self):
+        return self.height
+
+    def config(self, **options):
+        pass
+
+
+class OffscreenPhoto:
+    """Stands in for ImageTk.PhotoImage; paste() copies the pixels out, as Tk's does."""
+
+    def __init__(self, image):
+        self.size = image.size
+        self.data = None
+
+    def paste(self, image):
+        self.data = image.tobytes()
+
+
+def run_case(case, out_dir=None):
+    """Runs one case in this process and returns its results as a dict."""
+    session = CaptureSession([case.source] * case.streams)
+    session.start()
+    try:
+        consumers = session.preview_consumers()
+        mosaic = MosaicComposer(len(consumers)) if len(consumers) > 1 else None
+        renderer = PreviewRenderer(OffscreenLabel(*PREVIEW_SIZE), case.preview_fps, photo_factory=OffscreenPhoto)
+        # Age of each frame when the preview shows it, while recording
+        preview_latency = StageHistogram(window=100000)
+
+        with tempfile.TemporaryDirectory(dir=out_dir) as temp_dir:
+            _drive_preview(consumers, mosaic, renderer, StageHistogram(), case.warmup_seconds)
+            session.start_recording(temp_dir, "benchmark", codec=case.codec)
+            recorders = list(session.recorders)
+            reads_before = [engine.read_times.count for engine in session.engines]
+            renders_before = renderer.render_times.count
+            cpu_before = _cpu_seconds()
+            start = time.monotonic()
+
+            _drive_preview(consumers, mosaic, renderer, preview_latency, case.seconds)
+
+            elapsed = time.monotonic() - start
+            cpu = _cpu_seconds() - cpu_before
+            reads = [engine.read_times.count - before for engine, before in zip(session.engines, reads_before)]
+            # Frames still queued for the encoder at this point are flushed by stop_recording and not counted
+            written = [recorder.frames_written for recorder in recorders]
+            renders = renderer.render_times.count - renders_before
+            session.stop_recording()
+    finally:
+        session.stop()
+
+    per_stream = []
+    for engine, recorder, captured, encoded in zip(session.engines, recorders, reads, written):
+        per_stream.append({
+            "width": engine.width,
+            "height": engine.height,
+            "nominal_fps": engine.fps,
+            "capture_fps": round(captured / elapsed, 2),
+            "record_fps": round(encoded / elapsed, 2),
+            "frames_written": recorder.frames_written,
+            "frames_dropped_capture": recorder.consumer.dropped,
+            "frames_dropped_writer": recorder.writer.dropped,
+            "read": engine.read_times.snapshot(),
+            "encode": recorder.writer.encode_times.snapshot(),
+        })
+
+    return {
+        "source": case.source,
+        "streams": case.streams,
+        "codec": case.codec,
+        "seconds": round(elapsed, 3),
+        "width": per_stream[0]["width"],
+        "height": per_stream[0]["height"],
+        "capture_fps": min(stream["capture_fps"] for stream in per_stream),
+        "record_fps": min(stream["record_fps"] for stream in per_stream),
+        "frames_dropped": sum(stream["frames_dropped_capture"] + stream["frames_dropped_writer"]
+                              for stream in per_stream),
+        "preview_fps": round(renders / elapsed, 2),
+        "preview_render": renderer.render_times.snapshot(),
+        "preview_latency": preview_latency.snapshot(),
+        "cpu_percent": round(100 * cpu / elapsed, 1),
+        "peak_rss_mb": _peak_rss_mb(),
+        "per_stream": per_stream,
+    }
+
+
+def _drive_preview(consumers, mosaic, renderer, latency, seconds):
+    # The application's update_video_feed() loop, with sleeps in place of Tk's after()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame, captured_at = None, None
+        if mosaic is None:
+            captured = consumers[0].read(timeout=0)
+            if captured is not None:
+                frame, captured_at = captured.image, captured.timestamp
+        else:
+            for index, consumer in enumerate(consumers):
+                captured = consumer.read(timeout=0)
+                if captured is not None:
+                    mosaic.update(index, captured.image)
+                    frame = mosaic.mosaic
+                    captured_at = min(captured_at or captured.timestamp, captured.timestamp)
+        if frame is not None:
+            renderer.render(frame)
+            latency.observe(time.monotonic() - captured_at)
+        time.sleep(min(renderer.interval_ms / 1000, max(0.0, deadline - time.monotonic())))
+
+
+def _cpu_seconds():
+    times = os.times()
+    return times.user + times.system
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_isolated(case, out_dir=None):
+    """Runs one case in a freshly started process, so CPU time and peak RSS are the case's alone."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(run_case, case, out_dir).result()
+
+
+def build_cases(resolutions, fps, streams, codec, seconds, warmup_seconds, preview_fps, replay=None):
+    """Every combination of source and stream count, smallest first."""
+    if replay:
+        sources = [f"{REPLAY_SCHEME}://{replay}"]
+    else:
+        sources = []
+        for resolution in resolutions:
+            width, _, height = resolution.lower().partition("x")
+            sources.append(synthetic_source(int(width), int(height), fps))
+    return [BenchmarkCase(source, count, codec, seconds, warmup_seconds, preview_fps)
+            for source in sources for count in streams]
+
+
+def case_key(result):
+    return result["source"], result["streams"], result["codec"]
+
+
+def compare(baseline, results, tolerance=DEFAULT_TOLERANCE):
+    """Lists the regressions of `results` against the `baseline` results, one line each."""
+    previous = {case_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(case_key(result))
+        if before is None:
+            continue
+        name = describe_case(result)
+        if result["record_fps"] < before["record_fps"] * (1 - tolerance):
+            regressions.append(f"{name}: record fps {before['record_fps']:.1f} -> {result['record_fps']:.1f}")
+        if result["frames_dropped"] and not before["frames_dropped"]:
+            regressions.append(f"{name}: {result['frames_dropped']} frames dropped, none before")
+        if result["peak_rss_mb"] and before.get("peak_rss_mb") and \
+                result["peak_rss_mb"] > before["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{name}: peak RSS {before['peak_rss_mb']:.0f} -> {result['peak_rss_mb']:.0f} MB")
+    return regressions
+
+
+def describe_case(result):
+    return f"{result['width']}x{result['height']} x{result['streams']} {result['codec']}"
+
+
+def environment():
+    """What the results depend on besides the code."""
+    return {"created": datetime.now().isoformat(timespec="seconds"), "platform": platform.platform(),
+            "machine": platform.machine(), "cpu_count": os.cpu_count(), "python": platform.python_version(),
+            "opencv": cv2.__version__}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark capture, preview and recording without a camera.")
+    parser.add_argument("--resolutions", default=DEFAULT_RESOLUTIONS, help="Synthetic frame sizes, comma-separated.")
+    parser.add_argument("--fps", type=float, default=30, help="Synthetic source rate (0: as fast as possible).")
+    parser.add_argument("--replay", help="Replay this recording instead of synthetic frames.")
+    parser.add_argument("--streams", default=DEFAULT_STREAMS, help="Stream counts to run, comma-separated.")
+    parser.add_argument("--codec", choices=ENCODER_NAMES, default=DEFAULT_ENCODER)
+    parser.add_argument("--seconds", type=float, default=10.0, help="Recording time per case.")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Capture time before recording starts.")
+    parser.add_argument("--preview-fps", type=int, default=15)
+    parser.add_argument("--out", help="Where recordings are written while a case runs (default: temp dir).")
+    parser.add_argument("--json", help="Write the results to this file.")
+    parser.add_argument("--compare", help="Results file of an earlier run to check for regressions.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Fraction fps may fall or memory grow before it counts as a regression.")
+    args = parser.parse_args(argv)
+
+    try:
+        streams = [int(count) for count in args.streams.split(",") if count.strip()]
+        cases = build_cases([resolution for resolution in args.resolutions.split(",") if resolution.strip()],
+                            args.fps, streams, args.codec, args.seconds, args.warmup, args.preview_fps, args.replay)
+    except ValueError:
+        parser.error("--resolutions takes sizes like 1280x720 and --streams whole numbers")
+
+    print(f"{'case':<24} {'capture':>8} {'record':>8} {'dropped':>8} {'read p95':>9} {'encode p95':>11} "
+          f"{'preview p95':>12} {'cpu':>6} {'rss':>8}")
+    results = []
+    for case in cases:
+        try:
+            result = run_isolated(case, args.out)
+        except Exception as e:
+            print(f"{case.source} x{case.streams}: failed: {e}", file=sys.stderr)
+            continue
+        results.append(result)
+        stream = result["per_stream"][0]
+        rss = f"{result['peak_rss_mb']:.0f}MB" if result["peak_rss_mb"] else "-"
+        print(f"{describe_case(result):<24} {result['capture_fps']:>8.1f} {result['record_fps']:>8.1f} "
+              f"{result['frames_dropped']:>8} {stream['read']['p95_ms']:>7.1f}ms {stream['encode']['p95_ms']:>9.1f}ms "
+              f"{result['preview_latency']['p95_ms']:>10.1f}ms {result['cpu_percent']:>5.0f}% {rss:>8}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(dict(environment(), cases=results), f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f)["cases"], results, args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.compare}.")
+    return 0 if len(results) == len(cases) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,438 @@
+import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+from encoders import is_jpeg
+from metrics import StageHistogram
+from sources import is_virtual_source, open_virtual_capture
+
+# A captured frame: its sequence number, monotonic capture time and pixel data, plus the
+# seconds of missing signal before it when it is the first frame after a reconnect
+Frame = namedtuple("Frame", ["seq", "timestamp", "image", "gap"], defaults=(0.0,))
+
+
+class FrameRing:
+    """A fixed-size ring of preallocated frame buffers shared by one producer and many consumers.
+
+    The producer writes straight into the slot after the newest frame and then publishes it.
+    Consumers copy frames out while holding the lock, so a slot is never overwritten mid-read.
+    """
+
+    def __init__(self, capacity, shape, dtype=np.uint8):
+        self.capacity = capacity
+        self.buffers = [np.zeros(shape, dtype=dtype) for _ in range(capacity)]
+        self.timestamps = [0.0] * capacity
+        self.gaps = [0.0] * capacity
+        self.next_seq = 0    # Sequence number the next published frame will get
+        self.oldest_seq = 0  # Oldest sequence number still held in the ring
+        self.dropped = 0     # Frames overwritten before some consumer could read them
+        self.closed = False
+        self.compressed = False  # Slots hold the source's JPEG buffers rather than decoded images
+        self.cond = threading.Condition()
+
+    def claim(self):
+        """Returns the buffer the next frame should be read into, retiring the oldest frame if the ring is full."""
+        with self.cond:
+            self.oldest_seq = max(self.oldest_seq, self.next_seq - self.capacity + 1)
+            return self.buffers[self.next_seq % self.capacity]
+
+    def publish(self, image, timestamp, gap=0.0):
+        """Makes the frame in the claimed slot visible to consumers."""
+        with self.cond:
+            slot = self.next_seq % self.capacity
+            if image is not self.buffers[slot]:
+                # The source handed back a new array (e.g. it changed resolution); adopt it
+                self.buffers[slot] = image
+            self.timestamps[slot] = timestamp
+            self.gaps[slot] = gap
+            self.next_seq += 1
+            self.cond.notify_all()
+
+    def close(self):
+        """Wakes up all consumers; no more frames will be published."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def consumer(self, latest_only=False, decode=True):
+        """Creates a consumer that starts at the next published frame."""
+        return RingConsumer(self, latest_only, decode)
+
+
+class RingConsumer:
+    """An independent read cursor into a FrameRing.
+
+    A regular consumer sees every frame and counts the ones it fell too far behind to read.
+    A latest_only consumer (e.g. the preview) always jumps to the newest frame instead.
+    On a compressed ring, frames are decoded after leaving the lock unless `decode` is
+    False (e.g. a recorder storing the JPEG buffers as they are).
+    """
+
+    def __init__(self, ring, latest_only=False, decode=True):
+        self.ring = ring
+        self.latest_only = latest_only
+        self.decode = decode
+        self.cursor = ring.next_seq
+        self.dropped = 0
+        self.undecodable = 0  # Compressed frames skipped because they could not be decoded
+        self._out = None
+        self._packet = None  # Copy of the JPEG buffer being decoded
+
+    def read(self, timeout=None, out=None):
+        """Copies the next frame out of the ring.
+
+        Returns a Frame, or None if no frame arrived within the timeout or the ring is closed.
+        The image is written into `out` if given (and it matches the frame), otherwise into a
+        buffer owned by this consumer that is reused on the next call. Decoded images are
+        new arrays unless `out` matches them. A JPEG that cannot be decoded is skipped and
+        counted in `undecodable`.
+        """
+        ring = self.ring
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with ring.cond:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                if not ring.cond.wait_for(lambda: ring.next_seq > self.cursor or ring.closed, remaining):
+                    return None
+                if ring.next_seq <= self.cursor:
+                    return None
+
+                if self.latest_only:
+                    self.cursor = ring.next_seq - 1
+                elif self.cursor < ring.oldest_seq:
+                    missed = ring.oldest_seq - self.cursor
+                    self.dropped += missed
+                    ring.dropped += missed
+                    self.cursor = ring.oldest_seq
+
+                slot = self.cursor % ring.capacity
+                src = ring.buffers[slot]
+                seq, timestamp, gap = self.cursor, ring.timestamps[slot], ring.gaps[slot]
+                self.cursor += 1
+                if ring.compressed and self.decode:
+                    packet = self._copy_packet(src)
+                else:
+                    if out is None:
+                        if self._out is None or self._out.shape != src.shape:
+                            self._out = np.empty_like(src)
+                        out = self._out
+                    elif out.shape != src.shape or out.dtype != src.dtype:
+                        # The caller's buffer no longer matches the source; hand back a fresh one
+                        out = np.empty_like(src)
+                    np.copyto(out, src)
+                    return Frame(seq, timestamp, out, gap)
+
+            # Decode outside the lock so the capture thread is never held up by it
+            image = cv2.imdecode(packet, cv2.IMREAD_COLOR)
+            if image is not None:
+                break
+            # A corrupt packet; returning None would read as "no frame" and end a drain early
+            self.undecodable += 1
+
+        if out is not None and out.shape == image.shape:
+            np.copyto(out, image)
+            image = out
+        return Frame(seq, timestamp, image, gap)
+
+    def wait(self, timeout=None):
+        """Waits until read() has a frame to return. False on timeout or once the ring is closed."""
+        ring = self.ring
+        with ring.cond:
+            return ring.cond.wait_for(lambda: ring.next_seq > self.cursor or ring.closed, timeout) and \
+                ring.next_seq > self.cursor
+
+    def seek(self, seq):
+        """Moves the cursor so the next read returns frame `seq`, or the oldest one still held."""
+        with self.ring.cond:
+            self.cursor = seq
+
+    def _copy_packet(self, src):
+        # JPEG sizes vary from frame to frame, so keep one buffer with headroom
+        if self._packet is None or self._packet.size < src.size:
+            self._packet = np.empty(src.size * 2, dtype=np.uint8)
+        packet = self._packet[:src.size]
+        np.copyto(packet, src)
+        return packet
+
+
+# Network stream settings: OpenCV buffer size (0 = backend default), FFmpeg low-delay flags,
+# skipping frames that were already buffered, open/read timeout, and the longest wait
+# between reconnect attempts
+StreamOptions = namedtuple("StreamOptions", ["buffer_size", "low_latency", "grab_latest", "timeout_ms",
+                                             "reconnect_max_seconds"], defaults=(1, True, True, 5000, 10.0))
+
+NETWORK_SCHEMES = ("rtsp", "rtsps", "rtmp", "http", "https", "udp", "tcp", "srt")
+
+# FFmpeg demuxer options for low latency; RTSP over TCP so lost packets do not corrupt frames
+LOW_LATENCY_FFMPEG_OPTIONS = "rtsp_transport;tcp|fflags;nobuffer|flags;low_delay"
+
+# OPENCV_FFMPEG_CAPTURE_OPTIONS is process-wide: it is set while any low-latency open
+# is in progress, so several streams can connect at once, and removed after the last one
+_ffmpeg_options_lock = threading.Lock()
+_ffmpeg_options_users = 0
+_ffmpeg_options_set = False
+
+
+def is_network_source(source):
+    """True for stream URLs such as rtsp://camera/stream, as opposed to USB indices and files."""
+    return isinstance(source, str) and source.split("://", 1)[0].lower() in NETWORK_SCHEMES and "://" in source
+
+
+def stream_options_from_settings(settings):
+    """Builds StreamOptions from the stream_* keys of a config_manager settings section."""
+    return StreamOptions(settings.getint("stream_buffer_size"), settings.getboolean("stream_low_latency"),
+                         settings.getboolean("stream_grab_latest"), settings.getint("stream_timeout_ms"),
+                         settings.getfloat("stream_reconnect_max_seconds"))
+
+
+def open_capture(source, stream_options=None, params=None):
+    """Creates a cv2.VideoCapture for `source`; network streams get stream_options' timeouts and flags.
+
+    Extra `params` (cv2.VideoCapture open parameters) select the FFmpeg backend. synthetic://
+    and replay:// sources (see sources.py) get a stand-in with the same read interface.
+    """
+    if is_virtual_source(source):
+        return open_virtual_capture(source)
+    if not is_network_source(source):
+        if params:
+            return cv2.VideoCapture(source, cv2.CAP_FFMPEG, params)
+        return cv2.VideoCapture(source)
+
+    options = stream_options or StreamOptions()
+    params = list(params or []) + [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, options.timeout_ms,
+                                   cv2.CAP_PROP_READ_TIMEOUT_MSEC, options.timeout_ms]
+    if options.low_latency:
+        with _low_latency_ffmpeg_options():
+            cap = cv2.VideoCapture(source, cv2.CAP_FFMPEG, params)
+    else:
+        cap = cv2.VideoCapture(source, cv2.CAP_FFMPEG, params)
+    if options.buffer_size:
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, options.buffer_size)
+    return cap
+
+
+@contextmanager
+def _low_latency_ffmpeg_options():
+    global _ffmpeg_options_users, _ffmpeg_options_set
+    with _ffmpeg_options_lock:
+        # Options the user set in the environment take precedence
+        if _ffmpeg_options_users == 0 and "OPENCV_FFMPEG_CAPTURE_OPTIONS" not in os.environ:
+            os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = LOW_LATENCY_FFMPEG_OPTIONS
+            _ffmpeg_options_set = True
+        _ffmpeg_options_users += 1
+    try:
+        yield
+    finally:
+        with _ffmpeg_options_lock:
+            _ffmpeg_options_users -= 1
+            if _ffmpeg_options_users == 0 and _ffmpeg_options_set:
+                del os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"]
+                _ffmpeg_options_set = False
+
+
+class CaptureEngine:
+    """Reads frames from a cv2.VideoCapture on a dedicated thread into a FrameRing.
+
+    With `passthrough`, an MJPEG source's JPEG frames go into the ring undecoded; consumers
+    decode only the frames they use. Sources that cannot deliver JPEG fall back to decoding.
+
+    Network streams are opened with timeouts so a stalled connection fails instead of
+    blocking, and are reopened with exponential backoff when they drop. The ring stays
+    open meanwhile, so recordings carry on in the same file; the first frame after an
+    outage carries the length of the gap.
+    """
+
+    # Stalled reads in a row after which a network stream is reopened
+    MAX_READ_FAILURES = 3
+
+    def __init__(self, source, width=1280, height=720, ring_size=8, passthrough=False, stream_options=None):
+        self.source = source
+        self.requested_size = (width, height)
+        self.ring_size = ring_size
+        self.passthrough = passthrough
+        self.stream_options = stream_options or StreamOptions()
+        self.is_network = is_network_source(source)
+
+        self.cap = None
+        self.ring = None
+        self.width = 0
+        self.height = 0
+        self.fps = 0.0
+        self.read_failures = 0
+        # Time spent in each successful read; its rate is the fps the source really delivers
+        self.read_times = StageHistogram()
+
+        self.connected = False
+        self.reconnects = 0
+        self.stale_skipped = 0  # Buffered frames skipped to stay on the newest one
+        self.gaps = []          # (start, end) monotonic times of every outage
+
+        self.is_running = False
+        self._thread = None
+        self._wake = threading.Event()  # Cuts a reconnect backoff short when stopping
+
+    def open(self):
+        """Opens the source and sizes the ring from the first frame it delivers."""
+        frame = self._open_source()
+        self.ring = FrameRing(self.ring_size, frame.shape, frame.dtype)
+        self.ring.compressed = self.passthrough
+        buf = self.ring.claim()
+        if not self.passthrough:
+            np.copyto(buf, frame)
+            frame = buf
+        self.ring.publish(frame, time.monotonic())
+
+    def _open_source(self):
+        """Opens self.cap and returns its first frame (a JPEG buffer in passthrough mode)."""
+        packet = self._open_passthrough() if self.passthrough else None
+        if packet is None:
+            self.passthrough = False
+            self.cap = open_capture(self.source, self.stream_options)
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.requested_size[0])
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.requested_size[1])
+
+            if not self.cap.isOpened():
+                raise IOError("Cannot open camera source.")
+
+            ret, frame = self.cap.read()
+            if not ret:
+                self.cap.release()
+                raise IOError("Cannot read from camera source.")
+            self.height, self.width = frame.shape[:2]
+        else:
+            frame = packet
+            image = cv2.imdecode(packet, cv2.IMREAD_COLOR)
+            if image is None:
+                self.cap.release()
+                raise IOError("Cannot decode the camera's JPEG frames.")
+            self.height, self.width = image.shape[:2]
+
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.connected = True
+        return frame
+
+    def _open_passthrough(self):
+        """Opens the source so it delivers its JPEG frames undecoded. Returns the first one, or None."""
+        if isinstance(self.source, int):
+            # USB cameras: ask V4L2/DirectShow for MJPEG and skip the conversion to BGR
+            cap = cv2.VideoCapture(self.source)
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.requested_size[0])
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.requested_size[1])
+            cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+        else:
+            # Streams and files: read the compressed packets through FFmpeg
+            cap = open_capture(self.source, self.stream_options, [cv2.CAP_PROP_FORMAT, -1])
+
+        ret, packet = cap.read() if cap.isOpened() else (False, None)
+        if ret and is_jpeg(packet.reshape(-1)):
+            self.cap = cap
+            return packet.reshape(-1)
+        cap.release()
+        return None
+
+    def start(self):
+        """Opens the source if needed and starts the capture thread."""
+        if self.cap is None:
+            self.open()
+        self.is_running = True
+        self._wake.clear()
+        self._thread = threading.Thread(target=self._capture_loop, name="capture", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the capture thread, releases the source and closes the ring."""
+        self.is_running = False
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self.cap:
+            self.cap.release()
+            self.cap = None
+        self.connected = False
+        if self.ring:
+            self.ring.close()
+
+    def consumer(self, latest_only=False, decode=True):
+        return self.ring.consumer(latest_only, decode)
+
+    @property
+    def dropped(self):
+        return self.ring.dropped if self.ring else 0
+
+    def _capture_loop(self):
+        failures = 0
+        last_frame_time = time.monotonic()
+        gap = 0.0
+        while self.is_running:
+            # Decode straight into the ring slot so no per-frame allocation is needed
+            buf = self.ring.claim()
+            read_start = time.monotonic()
+            ret, frame = self._read(buf)
+            timestamp = time.monotonic()
+            if not ret:
+                self.read_failures += 1
+                failures += 1
+                if self.is_network and (failures >= self.MAX_READ_FAILURES or
+                                        timestamp - last_frame_time >= self.stream_options.timeout_ms / 1000):
+                    frame = self._reconnect()
+                    if frame is None:
+                        continue
+                    timestamp = time.monotonic()
+                    gap = timestamp - last_frame_time
+                    self.gaps.append((last_frame_time, timestamp))
+                else:
+                    time.sleep(0.01)
+                    continue
+            else:
+                self.read_times.observe(timestamp - read_start, timestamp)
+            failures = 0
+            last_frame_time = timestamp
+            self.ring.publish(frame.reshape(-1) if self.passthrough else frame, timestamp, gap)
+            gap = 0.0
+
+    def _read(self, buf):
+        if not (self.is_network and self.stream_options.grab_latest):
+            # JPEG sizes vary, so in passthrough each frame's buffer is adopted by the ring as is
+            return self.cap.read() if self.passthrough else self.cap.read(buf)
+
+        # Frames that were already buffered come back at once; keep grabbing until one had to
+        # be waited for, which is live. The skip limit stops a source that never waits (a
+        # file, or a stream faster than we can decode) from starving the reader.
+        live_after = 0.25 / (self.fps or 30)
+        for _ in range(self.ring_size * 4):
+            start = time.monotonic()
+            if not self.cap.grab():
+                return False, None
+            if time.monotonic() - start >= live_after:
+                break
+            self.stale_skipped += 1
+        else:
+            self.stale_skipped -= 1  # The last grab is kept after all
+        return self.cap.retrieve() if self.passthrough else self.cap.retrieve(buf)
+
+    def _reconnect(self):
+        """Reopens a dropped network stream with exponential backoff. Returns its first frame,
+        or None if the engine was stopped first."""
+        self.connected = False
+        self.cap.release()
+        delay = 0.5
+        while self.is_running:
+            try:
+                frame = self._open_source()
+            except IOError:
+                self._wake.wait(delay)
+                delay = min(delay * 2, self.stream_options.reconnect_max_seconds)
+                continue
+            self.reconnects += 1
+            if self.passthrough != self.ring.compressed:
+                # The stream came back in a different format; consumers follow the ring's flag
+                self.ring.compressed = self.passthrough
+            return frame
+        return None
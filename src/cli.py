@@ -0,0 +1,237 @@
+"""Headless capture for edge boxes and scripts.
+
+Records from one or more camera sources without Tk. Only OpenCV and NumPy are imported,
+so this starts faster and uses less memory than the GUI. Examples:
+
+    python src/cli.py --name "left door" --duration 600
+    python src/cli.py --source "0, rtsp://cam2/stream" --name bay --frames 9000 --segment-seconds 300
+    python src/cli.py --name overnight --segment-mb 500
+    python src/cli.py --name labels --codec ffv1 --duration 60
+    python src/cli.py --name yard --trigger motion --preroll 3
+    python src/cli.py --name overnight --checkpoint-seconds 2
+    python src/cli.py --name bench --frame-bus tvc     # framebus.FrameBusClient("tvc") reads the frames
+    python src/cli.py --name nas --output-dir /mnt/nas/videos --secondary-dir /data/videos
+"""
+import argparse
+import signal
+import sys
+import threading
+import time
+
+import config_manager
+import recovery
+from capture import stream_options_from_settings
+from dataset_export import EXPORT_FORMATS
+from encoders import ENCODER_NAMES
+from recorder import FRAME_TIMINGS
+from metrics import MetricsServer, prometheus_text
+from session import CaptureSession, parse_sources
+from storage import format_rate, measure_write_rate, storage_options_from_settings
+from trigger import TRIGGER_MODES, trigger_options_from_settings
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Record camera sources without the GUI. Defaults come from config.ini.")
+    parser.add_argument("--config", default=config_manager.default_settings_file(), help="Path to config.ini.")
+    parser.add_argument("--source", help="Camera source(s): USB index or stream URL, comma-separated for several.")
+    parser.add_argument("--output-dir", help="Directory recordings are written to.")
+    parser.add_argument("--secondary-dir", help="Directory recordings continue in when the output directory fills up.")
+    parser.add_argument("--name", required=True, help="Video name; the file is {name}{timestamp}.avi (or .mkv/.mp4).")
+    parser.add_argument("--duration", type=float, help="Stop after this many seconds.")
+    parser.add_argument("--frames", type=int, help="Stop after this many frames per source (per recording with --trigger).")
+    parser.add_argument("--segment-seconds", type=float, help="Start a new file every this many seconds (0 = off).")
+    parser.add_argument("--segment-mb", type=float, help="Start a new file once the current one reaches this many MB (0 = off).")
+    parser.add_argument("--checkpoint-seconds", type=float,
+                        help="Flush the recording to disk this often so a crash loses at most that much (0 = off).")
+    parser.add_argument("--codec", choices=ENCODER_NAMES, help="Recording codec; mjpeg stores MJPEG cameras' frames as is.")
+    parser.add_argument("--frame-timing", choices=FRAME_TIMINGS,
+                        help="File frame rate: measured arrival rate, the source's nominal rate, or resample to --target-fps.")
+    parser.add_argument("--target-fps", type=float, help="Constant rate for --frame-timing resample (0 = nominal rate).")
+    parser.add_argument("--trigger", choices=TRIGGER_MODES,
+                        help="Record only while there is motion or a scene change, one file per event, until stopped "
+                             "(default: trigger_mode when auto_record is on).")
+    parser.add_argument("--preroll", type=float, help="Start recordings this many seconds before they were started or triggered.")
+    parser.add_argument("--export-dir", help="Also export sampled frames as a dataset into this directory.")
+    parser.add_argument("--export-every", type=int, help="Export every Nth frame.")
+    parser.add_argument("--export-fps", type=float, help="Export frames at about this rate.")
+    parser.add_argument("--export-format", choices=EXPORT_FORMATS, default="jpg", help="Image files or packed .npy shards.")
+    parser.add_argument("--frame-bus", help="Share the live frames with other processes under this shared-memory name.")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on 127.0.0.1 at this port (0 = off).")
+    parser.add_argument("--width", type=int, default=1280, help="Requested capture width.")
+    parser.add_argument("--height", type=int, default=720, help="Requested capture height.")
+    return parser.parse_args(argv)
+
+
+def record(session, args, settings, stop_event):
+    """Records until the duration or frame limit is reached or stop_event is set."""
+    deadline = time.monotonic() + args.duration if args.duration else float("inf")
+    start_recording(session, args, settings)
+    if args.export_dir:
+        session.start_export(args.export_dir, args.name, every_n=args.export_every,
+                             target_fps=args.export_fps, fmt=args.export_format)
+
+    reported = ""
+    while not stop_event.is_set() and not session.is_finished and time.monotonic() < deadline:
+        reported = report_storage(session, reported)
+        stop_event.wait(0.1)
+
+    finish_recording(session)
+    if args.export_dir:
+        print(f"Exported {session.stop_export()} frames to {args.export_dir}")
+
+
+def record_triggered(session, args, settings, stop_event):
+    """Records every motion or scene-change event until the duration is up or stop_event is set."""
+    deadline = time.monotonic() + args.duration if args.duration else float("inf")
+    session.start_trigger(trigger_options_from_settings(settings)._replace(mode=args.trigger))
+    print(f"Waiting for {args.trigger}...")
+
+    reported = ""
+    while not stop_event.is_set() and time.monotonic() < deadline:
+        reported = report_storage(session, reported)
+        if session.is_recording:
+            # A frame-limited recording ends early; if the event goes on, a new file starts
+            if not session.trigger.active or session.is_finished:
+                finish_recording(session)
+        elif session.trigger.active:
+            start_recording(session, args, settings)
+        stop_event.wait(0.1)
+
+    if session.is_recording:
+        finish_recording(session)
+
+
+def start_recording(session, args, settings):
+    segment_seconds = settings.getfloat("segment_seconds") if args.segment_seconds is None else args.segment_seconds
+    segment_mb = settings.getfloat("segment_mb") if args.segment_mb is None else args.segment_mb
+
+    paths = session.start_recording(
+        args.output_dir or settings.get("output_dir"), args.name,
+        settings.getint("writer_queue_size"), settings.get("writer_drop_policy"),
+        max_frames=args.frames, segment_seconds=segment_seconds, segment_mb=segment_mb,
+        codec=args.codec, frame_timing=args.frame_timing or settings.get("frame_timing"),
+        target_fps=settings.getfloat("target_fps") if args.target_fps is None else args.target_fps,
+        checkpoint_seconds=settings.getfloat("checkpoint_seconds") if args.checkpoint_seconds is None
+        else args.checkpoint_seconds, storage=storage_options(args, settings), planned_seconds=args.duration or 0)
+    for path in paths:
+        print(f"Recording to {path}")
+    for problem in session.storage_check.problems:
+        print(f"Warning: {problem}", file=sys.stderr)
+
+
+def storage_options(args, settings):
+    options = storage_options_from_settings(settings)
+    return options._replace(secondary_dir=options.secondary_dir if args.secondary_dir is None else args.secondary_dir)
+
+
+def report_storage(session, reported):
+    """Prints the storage guard's warning when it changes. Returns the message now shown."""
+    status = session.storage_status
+    message = status.message if status else ""
+    if message and message != reported:
+        print(f"Storage: {message}", file=sys.stderr)
+    return message
+
+
+def finish_recording(session):
+    output_paths = session.output_paths
+    timestamp_paths = [timestamp_log.path for timestamp_log in session.timestamp_logs]
+    stats = session.stop_recording()
+    print(f"Saved {stats.frames_written} frames in {len(output_paths)} file(s), dropped {stats.frames_dropped}")
+    for path in session.stats_paths:
+        print(f"Stats written to {path}")
+    for index in session.unmeasured_streams:
+        print(f"Warning: too few frames to measure the frame rate of {session.engines[index].source}, "
+              "recorded at its nominal rate instead", file=sys.stderr)
+    for path in timestamp_paths:
+        print(f"Frame timestamps written to {path}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    settings = config_manager.load_settings(args.config)
+
+    sources = parse_sources(args.source or settings.get("camera_source"))
+    if not sources:
+        print("No camera source specified.", file=sys.stderr)
+        return 2
+
+    interrupted = recovery.find_interrupted(args.output_dir or settings.get("output_dir"))
+    if interrupted:
+        print(f"{len(interrupted)} interrupted recording(s) can be repaired with: python src/recovery.py "
+              f"\"{args.output_dir or settings.get('output_dir')}\"", file=sys.stderr)
+
+    args.trigger = args.trigger or (settings.get("trigger_mode") if settings.getboolean("auto_record") else "off")
+    if args.trigger != "off" and args.export_dir:
+        print("Dataset export is not available with a recording trigger.", file=sys.stderr)
+        return 2
+
+    # Ctrl-C or a service manager stopping us finishes the current file cleanly
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+
+    args.codec = args.codec or settings.get("video_codec")
+    session = CaptureSession(sources, width=args.width, height=args.height, mjpeg_passthrough=args.codec == "mjpeg",
+                             stream_options=stream_options_from_settings(settings))
+
+    try:
+        session.start()
+    except Exception as e:
+        print(f"Failed to start camera feed: {e}", file=sys.stderr)
+        return 1
+
+    metrics_server = None
+    try:
+        metrics_port = settings.getint("metrics_port") if args.metrics_port is None else args.metrics_port
+        if metrics_port:
+            try:
+                metrics_server = MetricsServer(metrics_port, lambda: prometheus_text(session.metrics_series()))
+            except OSError as e:
+                print(f"Could not serve metrics on port {metrics_port}: {e}", file=sys.stderr)
+                return 1
+            metrics_server.start()
+            print(f"Serving metrics on http://127.0.0.1:{metrics_server.port}/metrics")
+
+        output_dir = args.output_dir or settings.get("output_dir")
+        test_mb = storage_options(args, settings).test_mb
+        if test_mb:
+            # Measured before recording so the first file's preflight check knows the disk's speed
+            try:
+                print(f"{output_dir} writes {format_rate(measure_write_rate(output_dir, test_mb))}")
+            except OSError as e:
+                print(f"Could not measure the write speed of {output_dir}: {e}", file=sys.stderr)
+
+        frame_bus = settings.get("frame_bus_name") if args.frame_bus is None else args.frame_bus
+        if frame_bus:
+            try:
+                session.start_frame_bus(frame_bus, settings.getint("frame_bus_slots"))
+            except OSError as e:
+                print(f"Could not create frame bus {frame_bus}: {e}", file=sys.stderr)
+                return 1
+            print(f"Publishing frames on frame bus {frame_bus}")
+
+        preroll_seconds = settings.getfloat("preroll_seconds") if args.preroll is None else args.preroll
+        if preroll_seconds:
+            session.start_preroll(preroll_seconds, settings.getfloat("preroll_max_mb"),
+                                  settings.getint("preroll_quality"))
+
+        if args.trigger != "off":
+            record_triggered(session, args, settings, stop_event)
+        else:
+            record(session, args, settings, stop_event)
+    except ValueError as e:
+        print(f"Invalid recording settings: {e}", file=sys.stderr)
+        return 2
+    except IOError as e:
+        print(f"Could not create the video file: {e}", file=sys.stderr)
+        return 1
+    finally:
+        session.stop()
+        if metrics_server:
+            metrics_server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+import configparser
+import os
+import sys
+
+SECTION = "Settings"
+
+
+def get_base_dir():
+    """Returns the directory of the running script, or of the executable in a PyInstaller bundle."""
+    if getattr(sys, 'frozen', False):
+        # We are running in a bundled executable
+        return os.path.dirname(sys.executable)
+    # We are running in a regular Python environment
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def default_settings_file():
+    """The config.ini kept outside the bundle so users can edit it."""
+    return os.path.join(get_base_dir(), "..", "config", "config.ini")
+
+
+def default_settings():
+    """Every setting the application understands, with its default value."""
+    return {
+        'camera_source': "0",
+        'output_dir': os.path.join(os.getcwd(), "videos"),
+        'writer_queue_size': "64",
+        'writer_drop_policy': "block",
+        'preview_fps': "15",
+        'segment_seconds': "0",
+        'segment_mb': "0",
+        'checkpoint_seconds': "0",
+        'storage_min_free_mb': "1024",
+        'storage_warn_minutes': "30",
+        'secondary_output_dir': "",
+        'storage_test_mb': "16",
+        'write_behind_mb': "64",
+        'write_behind_sync_mb': "32",
+        'video_codec': "xvid",
+        'metrics_port': "0",
+        'frame_timing': "measured",
+        'target_fps': "0",
+        'stream_buffer_size': "1",
+        'stream_low_latency': "yes",
+        'stream_grab_latest': "yes",
+        'stream_timeout_ms': "5000",
+        'stream_reconnect_max_seconds': "10",
+        'preroll_seconds': "0",
+        'preroll_max_mb': "256",
+        'preroll_quality': "90",
+        'auto_record': "no",
+        'trigger_mode': "motion",
+        'motion_threshold': "0.01",
+        'scene_threshold': "20",
+        'trigger_hang_seconds': "5",
+        'trigger_fps': "10",
+        'probe_timeout_seconds': "5",
+        'scan_indices': "8",
+        'scan_urls': "",
+        'postprocess_chain': "dedupe=4",
+        'frame_bus_name': "",
+        'frame_bus_slots': "4",
+    }
+
+
+def load_settings(settings_file):
+    """Reads the [Settings] section, falling back to the defaults for missing keys or a missing file.
+
+    Returns a configparser section proxy, so callers can use get(), getint() and friends.
+    """
+    config = configparser.ConfigParser()
+    config.read_dict({SECTION: default_settings()})
+    config.read(settings_file)
+    return config[SECTION]
+
+
+def save_settings(settings_file, values):
+    """Writes `values` into the [Settings] section, keeping any sections and keys it does not mention."""
+    config = configparser.ConfigParser()
+    config.read(settings_file)
+    if not config.has_section(SECTION):
+        config.add_section(SECTION)
+    config[SECTION].update({key: str(value) for key, value in values.items()})
+
+    # Ensure the directory exists before saving the file
+    os.makedirs(os.path.dirname(settings_file), exist_ok=True)
+
+    with open(settings_file, 'w') as configfile:
+        config.write(configfile)
@@ -0,0 +1,294 @@
+"""Exports sampled frames as training datasets, live from the capture ring or from recordings.
+
+Frames are written into numbered shards with an index.csv per source: either image files
+(JPEG/PNG) or packed .npy arrays that np.load(..., mmap_mode="r") maps without reading.
+Batch export decodes and encodes each recording in its own worker process:
+
+    python src/dataset_export.py videos/*.avi --out dataset --every 10
+    python src/dataset_export.py videos/*.avi --out dataset --fps 2 --format npy
+"""
+import argparse
+import csv
+import os
+import sys
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+import cv2
+import numpy as np
+
+EXPORT_FORMATS = ("jpg", "png", "npy")
+
+
+class FrameSampler:
+    """Decides which frames to keep: every Nth frame, or frames spaced for a target fps."""
+
+    def __init__(self, every_n=None, target_fps=None):
+        if every_n and target_fps:
+            raise ValueError("Choose either every Nth frame or a target fps, not both.")
+        self.every_n = every_n or 1
+        self.interval = 1.0 / target_fps if target_fps else None
+        self._next_time = None
+
+    def keep(self, frame_index, timestamp):
+        if self.interval is None:
+            return frame_index % self.every_n == 0
+
+        if self._next_time is None or timestamp >= self._next_time:
+            # Stay on the ideal time grid unless we fell more than a whole interval behind
+            if self._next_time is None or timestamp - self._next_time > self.interval:
+                self._next_time = timestamp
+            self._next_time += self.interval
+            return True
+        return False
+
+
+def npy_header(dtype, shape, size=None):
+    """The .npy (version 1.0) header of a C-ordered array, padded to `size` bytes.
+
+    By default the size is rounded up to a multiple of 64 as np.save does. A header for
+    fewer frames is shorter, so it can overwrite a larger one in place at the same size.
+    """
+    text = repr({"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False,
+                 "shape": tuple(shape)})
+    if size is None:
+        size = -(-(len(np.lib.format.MAGIC_PREFIX) + 4 + len(text) + 1) // 64) * 64
+    length = size - len(np.lib.format.MAGIC_PREFIX) - 4
+    return (np.lib.format.MAGIC_PREFIX + bytes([1, 0]) + length.to_bytes(2, "little")
+            + (text.ljust(length - 1) + "\n").encode("latin1"))
+
+
+class ShardWriter:
+    """Writes frames into numbered shards under out_dir, plus an index.csv row per frame.
+
+    Image formats write shard_NNNNN/ directories of files named after the frame index;
+    "npy" packs each shard into one shard_NNNNN.npy array of shape (frames, height, width, 3);
+    frames are appended to shard_NNNNN.partial.npy as they come, so a shard is never held in
+    memory, and its header gets the final frame count when the shard is done.
+    """
+
+    INDEX_FIELDS = ["shard", "item", "source", "frame_index", "timestamp"]
+
+    def __init__(self, out_dir, fmt="jpg", shard_size=1000, jpeg_quality=95, source=""):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format '{fmt}', expected one of {', '.join(EXPORT_FORMATS)}.")
+
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.shard_size = shard_size
+        self.source = source
+        self.count = 0
+
+        if fmt == "jpg":
+            self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+        else:
+            self.encode_params = []
+
+        self._shard = 0
+        self._item = 0
+        self._packed = None  # (file, header size, dtype, frame shape) of the current npy shard
+
+        os.makedirs(out_dir, exist_ok=True)
+        self._index_file = open(os.path.join(out_dir, "index.csv"), "w", newline="")
+        self._index = csv.writer(self._index_file)
+        self._index.writerow(self.INDEX_FIELDS)
+
+    def add(self, frame_index, timestamp, image):
+        if self.fmt == "npy":
+            if self._packed is not None and self._packed[2:] != (image.dtype, image.shape):
+                # The source changed resolution; arrays in a shard must share a shape
+                self._next_shard()
+            if self._packed is None:
+                header = npy_header(image.dtype, (self.shard_size,) + image.shape)
+                f = open(self._shard_path(".partial.npy"), "wb")
+                f.write(header)
+                self._packed = (f, len(header), image.dtype, image.shape)
+            self._packed[0].write(np.ascontiguousarray(image))
+            item = self._item
+        else:
+            shard_dir = os.path.join(self.out_dir, f"shard_{self._shard:05d}")
+            if self._item == 0:
+                os.makedirs(shard_dir, exist_ok=True)
+            item = f"{frame_index:08d}.{self.fmt}"
+            cv2.imwrite(os.path.join(shard_dir, item), image, self.encode_params)
+
+        self._index.writerow([self._shard, item, self.source, frame_index, f"{timestamp:.6f}"])
+        self.count += 1
+        self._item += 1
+        if self._item == self.shard_size:
+            self._next_shard()
+
+    def close(self):
+        """Writes the last, partly filled shard and closes the index."""
+        if self._item:
+            self._next_shard()
+        self._index_file.close()
+
+    def _next_shard(self):
+        if self.fmt == "npy" and self._packed is not None:
+            f, header_size, dtype, shape = self._packed
+            with f:
+                if self._item != self.shard_size:
+                    f.seek(0)
+                    f.write(npy_header(dtype, (self._item,) + shape, header_size))
+            os.replace(f.name, self._shard_path(".npy"))
+            self._packed = None
+        self._shard += 1
+        self._item = 0
+
+    def _shard_path(self, extension):
+        return os.path.join(self.out_dir, f"shard_{self._shard:05d}{extension}")
+
+
+class LiveExporter:
+    """Samples frames from a ring consumer on its own thread and writes them with a ShardWriter.
+
+    JPEG/PNG encoding in OpenCV releases the GIL, so at sampled rates a thread keeps up
+    without competing with capture; the process pool is reserved for batch export.
+    """
+
+    def __init__(self, consumer, out_dir, every_n=None, target_fps=None, fmt="jpg", shard_size=1000,
+                 jpeg_quality=95, source=""):
+        self.consumer = consumer
+        self.sampler = FrameSampler(every_n, target_fps)
+        self.writer = ShardWriter(out_dir, fmt, shard_size, jpeg_quality, source)
+
+        self._first = None  # (seq, timestamp) of the first frame, so the index starts at zero
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._export_loop, name="exporter", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.writer.close()
+
+    @property
+    def exported(self):
+        return self.writer.count
+
+    def _export_loop(self):
+        while not self._stop_event.is_set() and not self.consumer.ring.closed:
+            frame = self.consumer.read(timeout=0.1)
+            if frame is None:
+                continue
+            if self._first is None:
+                self._first = (frame.seq, frame.timestamp)
+            frame_index = frame.seq - self._first[0]
+            timestamp = frame.timestamp - self._first[1]
+            if self.sampler.keep(frame_index, timestamp):
+                self.writer.add(frame_index, timestamp, frame.image)
+
+
+def dataset_names(video_paths):
+    """The subdirectory each recording is exported into, by path.
+
+    That is the recording's name, {name}_{extension} when recordings of several formats
+    share the name, and {name}_{extension}_{folder} when recordings in several folders do,
+    so no two recordings write into the same directory.
+    """
+    def candidates(path):
+        stem, extension = os.path.splitext(os.path.basename(path))
+        folder = os.path.basename(os.path.dirname(os.path.abspath(path)))
+        return [stem, f"{stem}_{extension[1:]}", f"{stem}_{extension[1:]}_{folder}"]
+
+    paths = list(dict.fromkeys(video_paths))
+    counts = [Counter(candidates(path)[level] for path in paths) for level in range(3)]
+    names, taken = {}, set()
+    for path in paths:
+        name = next((name for level, name in enumerate(candidates(path)) if counts[level][name] == 1),
+                    candidates(path)[-1])
+        # e.g. cam/a.avi and other/cam/a.avi, or a_avi.avi next to a.avi and a.mkv
+        unique, number = name, 2
+        while unique in taken:
+            unique, number = f"{name}_{number}", number + 1
+        names[path] = unique
+        taken.add(unique)
+    return names
+
+
+def export_video(video_path, out_dir, every_n=None, target_fps=None, fmt="jpg", shard_size=1000, jpeg_quality=95,
+                 name=None):
+    """Exports the sampled frames of one recording into out_dir/<name>/ (default: the video's
+    name). Returns the frame count."""
+    # Each recording already gets its own process, so keep OpenCV to one thread per process
+    cv2.setNumThreads(1)
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video file {video_path}.")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+
+    name = name or os.path.splitext(os.path.basename(video_path))[0]
+    sampler = FrameSampler(every_n, target_fps)
+    writer = ShardWriter(os.path.join(out_dir, name), fmt, shard_size, jpeg_quality, os.path.basename(video_path))
+    try:
+        frame_index = 0
+        while True:
+            timestamp = frame_index / fps
+            if sampler.keep(frame_index, timestamp):
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                writer.add(frame_index, timestamp, frame)
+            elif not cap.grab():
+                # Skipped frames are demuxed and decoded but never converted to BGR
+                break
+            frame_index += 1
+    finally:
+        writer.close()
+        cap.release()
+    return writer.count
+
+
+def export_recordings(video_paths, out_dir, workers=None, **options):
+    """Exports many recordings in parallel, one worker process per recording, each into
+    its dataset_names() subdirectory.
+
+    Yields (video_path, frames_exported, error) as each recording finishes.
+    """
+    names = dataset_names(video_paths)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+        futures = {pool.submit(export_video, path, out_dir, name=names[path], **options): path
+                   for path in names}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], 0, e
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export sampled frames from recordings as a training dataset.")
+    parser.add_argument("videos", nargs="+", help="Recordings to export.")
+    parser.add_argument("--out", required=True, help="Dataset directory; each recording gets a subdirectory.")
+    sampling = parser.add_mutually_exclusive_group()
+    sampling.add_argument("--every", type=int, help="Keep every Nth frame.")
+    sampling.add_argument("--fps", type=float, help="Keep frames at about this rate.")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="jpg", help="Image files or packed .npy shards.")
+    parser.add_argument("--shard-size", type=int, default=1000, help="Frames per shard.")
+    parser.add_argument("--jpeg-quality", type=int, default=95)
+    parser.add_argument("--workers", type=int, help="Worker processes (default: one per core).")
+    args = parser.parse_args(argv)
+
+    failures = 0
+    results = export_recordings(args.videos, args.out, args.workers, every_n=args.every, target_fps=args.fps,
+                                fmt=args.format, shard_size=args.shard_size, jpeg_quality=args.jpeg_quality)
+    for done, (path, count, error) in enumerate(results, start=1):
+        if error:
+            failures += 1
+            print(f"[{done}/{len(args.videos)}] {path}: failed: {error}", file=sys.stderr)
+        else:
+            print(f"[{done}/{len(args.videos)}] {path}: {count} frames")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
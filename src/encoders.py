@@ -0,0 +1,295 @@
+"""Video encoder backends for recordings, selected by the video_codec setting.
+
+    xvid   MPEG-4 Part 2 in .avi (the original format)
+    mjpeg  Motion JPEG in .avi; stores a camera's own JPEG frames without re-encoding them
+    ffv1   FFV1 in .mkv, lossless, for labeling-grade footage
+    png    PNG frames in .mkv, lossless and decodable frame by frame
+    mp4    H.264 in .mp4 when the OpenCV/FFmpeg build has an encoder, otherwise MPEG-4 Part 2
+
+Running this module benchmarks every backend on a recording or on synthetic frames:
+
+    python src/encoders.py videos/take20240101120000.avi --frames 300
+"""
+import argparse
+import os
+import struct
+import sys
+import tempfile
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from storage import WriteBehindFile
+
+# How a backend writes files: FourCCs are tried in order until OpenCV opens a writer.
+# max_mb caps a file's size for containers with 32-bit offsets (0 = no limit).
+Encoder = namedtuple("Encoder", ["name", "extension", "fourccs", "lossless", "accepts_jpeg", "max_mb"])
+
+ENCODERS = {
+    "xvid": Encoder("xvid", ".avi", ("XVID",), False, False, 0),
+    "mjpeg": Encoder("mjpeg", ".avi", ("MJPG",), False, True, 2000),
+    "ffv1": Encoder("ffv1", ".mkv", ("FFV1",), True, False, 0),
+    "png": Encoder("png", ".mkv", ("png ",), True, False, 0),
+    "mp4": Encoder("mp4", ".mp4", ("avc1", "H264", "mp4v"), False, False, 0),
+}
+ENCODER_NAMES = tuple(ENCODERS)
+DEFAULT_ENCODER = "xvid"
+
+MJPEG_QUALITY = 90
+
+# FourCC that worked for each backend, so later files skip the ones this build lacks
+_working_fourccs = {}
+
+
+def get_encoder(name):
+    """Looks up a backend by its video_codec name."""
+    try:
+        return ENCODERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown video codec '{name}', expected one of {', '.join(ENCODER_NAMES)}.") from None
+
+
+def is_jpeg(data):
+    """True for a flat buffer holding a JPEG image (as delivered by MJPEG cameras and streams)."""
+    return data.ndim == 1 and data.size > 2 and data[0] == 0xFF and data[1] == 0xD8
+
+
+def jpeg_size(data):
+    """(width, height) from a JPEG buffer's frame header, or None if it has none."""
+    head = data[:65536].tobytes()
+    i = 2
+    while i + 9 <= len(head) and head[i] == 0xFF:
+        marker = head[i + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            i += 1
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            # Start of frame: length, precision, height, width
+            return int.from_bytes(head[i + 7:i + 9], "big"), int.from_bytes(head[i + 5:i + 7], "big")
+        i += 2 + int.from_bytes(head[i + 2:i + 4], "big")
+    return None
+
+
+def fit_frame(image, frame_size):
+    """`image` (BGR or JPEG) as it can be written to a file of frame_size (width, height).
+
+    Frames of another size are decoded if need be and scaled; video writers silently skip
+    frames that do not match the size they were opened with.
+    """
+    if is_jpeg(image):
+        if jpeg_size(image) in (frame_size, None):
+            return image
+        decoded = cv2.imdecode(image, cv2.IMREAD_COLOR)
+        if decoded is None:
+            return image
+        image = decoded
+    elif image.shape[1::-1] == frame_size:
+        return image
+    return cv2.resize(image, frame_size, interpolation=cv2.INTER_AREA)
+
+
+def open_writer(encoder, path, fps, frame_size, write_behind_mb=0, sync_mb=0):
+    """Opens a writer for `path` with the given backend; it has the cv2.VideoWriter write/release interface.
+
+    With write_behind_mb, containers written here queue up to that much encoded data for a
+    thread to write out (storage.WriteBehindFile); OpenCV's writers do their own file I/O.
+    """
+    if encoder.accepts_jpeg:
+        return MjpegAviWriter(path, fps, frame_size, write_behind_mb=write_behind_mb, sync_mb=sync_mb)
+
+    fourccs = [_working_fourccs[encoder.name]] if encoder.name in _working_fourccs else encoder.fourccs
+    for fourcc in fourccs:
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, frame_size)
+        if writer.isOpened():
+            _working_fourccs[encoder.name] = fourcc
+            return writer
+        writer.release()
+    raise IOError(f"This OpenCV build cannot write {encoder.name} video to {path}.")
+
+
+class MjpegAviWriter:
+    """Writes JPEG frames into an AVI file without decoding or re-encoding them.
+
+    write() takes either a JPEG buffer, stored as is, or a BGR image, which is encoded
+    first. The headers are written up front and patched with the final counts on release().
+    AVI 1.0 uses 32-bit offsets, so callers should keep files under Encoder.max_mb.
+    """
+
+    AVIF_HASINDEX = 0x10
+    AVIIF_KEYFRAME = 0x10
+
+    def __init__(self, path, fps, frame_size, quality=MJPEG_QUALITY, write_behind_mb=0, sync_mb=0):
+        self.path = path
+        self.fps = fps
+        self.width, self.height = frame_size
+        self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        self.frames = 0
+
+        self._index = []         # (offset within movi, size) of every frame
+        self._max_frame_size = 0
+        if write_behind_mb:
+            self._file = WriteBehindFile(path, int(write_behind_mb * 1024 * 1024), int(sync_mb * 1024 * 1024))
+        else:
+            self._file = open(path, "wb")
+        self._write_headers()
+
+    def isOpened(self):
+        return self._file is not None
+
+    def write(self, image):
+        if is_jpeg(image):
+            data = image
+        else:
+            ok, data = cv2.imencode(".jpg", image, self.encode_params)
+            if not ok:
+                return
+
+        size = data.size
+        self._index.append((self._file.tell() - self._movi_start, size))
+        self._file.write(b"00dc" + struct.pack("<I", size))
+        self._file.write(data.data)
+        if size % 2:
+            # RIFF chunks are word aligned
+            self._file.write(b"\0")
+        self.frames += 1
+        self._max_frame_size = max(self._max_frame_size, size)
+
+    def tell(self):
+        """Bytes in the file so far, including any still waiting to be written out."""
+        return self._file.tell()
+
+    def flush(self):
+        """Hands every frame written so far to the operating system."""
+        self._file.flush()
+
+    def release(self):
+        if self._file is None:
+            return
+        f = self._file
+        movi_end = f.tell()
+
+        f.write(b"idx1" + struct.pack("<I", 16 * len(self._index)))
+        f.write(b"".join(struct.pack("<4sIII", b"00dc", self.AVIIF_KEYFRAME, offset, size)
+                         for offset, size in self._index))
+        file_end = f.tell()
+
+        f.seek(4)
+        f.write(struct.pack("<I", file_end - 8))
+        f.seek(self._movi_start - 4)
+        f.write(struct.pack("<I", movi_end - self._movi_start))
+        f.seek(0)
+        f.write(self._headers())
+        f.close()
+        self._file = None
+
+    def _write_headers(self):
+        self._file.write(self._headers())
+        self._file.write(b"LIST" + struct.pack("<I", 4) + b"movi")
+        self._movi_start = self._file.tell() - 4  # idx1 offsets count from the "movi" FourCC
+
+    def _headers(self):
+        # RIFF header, then hdrl with one video stream; sizes are placeholders until release()
+        scale, rate = 1000, int(round(self.fps * 1000))
+        avih = struct.pack("<IIIIIIIIII4I", int(round(1e6 / self.fps)), 0, 0, self.AVIF_HASINDEX, self.frames,
+                           0, 1, self._max_frame_size, self.width, self.height, 0, 0, 0, 0)
+        strh = struct.pack("<4s4sIHHIIIIIIIIhhhh", b"vids", b"MJPG", 0, 0, 0, 0, scale, rate, 0, self.frames,
+                           self._max_frame_size, 0xFFFFFFFF, 0, 0, 0, self.width, self.height)
+        strf = struct.pack("<IiiHH4sIiiII", 40, self.width, self.height, 1, 24, b"MJPG",
+                           self.width * self.height * 3, 0, 0, 0, 0)
+        strl = b"strl" + _chunk(b"strh", strh) + _chunk(b"strf", strf)
+        hdrl = b"hdrl" + _chunk(b"avih", avih) + _chunk(b"LIST", strl)
+        return b"RIFF" + struct.pack("<I", 0) + b"AVI " + _chunk(b"LIST", hdrl)
+
+
+def _chunk(fourcc, data):
+    return fourcc + struct.pack("<I", len(data)) + data
+
+
+def synthetic_frames(count, width=1280, height=720):
+    """Moving gradients with sensor-like noise, compressible roughly like camera footage."""
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    for i in range(count):
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        frame[..., 0] = (x + 2 * i) % 256
+        frame[..., 1] = (y + i) % 256
+        frame[..., 2] = ((x + y) / 2 + 3 * i) % 256
+        frame += rng.integers(0, 8, frame.shape, dtype=np.uint8)
+        yield frame
+
+
+def read_frames(video_path, count):
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video file {video_path}.")
+    try:
+        while count:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            count -= 1
+            yield frame
+    finally:
+        cap.release()
+
+
+def benchmark(frames, fps=30.0, out_dir=None):
+    """Encodes the same frames with every backend.
+
+    Yields (label, fourcc, encode fps, bytes per frame). "mjpeg passthrough" times
+    writing frames that are already JPEG, as they arrive from an MJPEG camera.
+    """
+    height, width = frames[0].shape[:2]
+    jpegs = [cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, MJPEG_QUALITY])[1] for frame in frames]
+    runs = [(name, name, frames) for name in ENCODER_NAMES] + [("mjpeg passthrough", "mjpeg", jpegs)]
+
+    with tempfile.TemporaryDirectory(dir=out_dir) as temp_dir:
+        for label, name, inputs in runs:
+            encoder = get_encoder(name)
+            path = os.path.join(temp_dir, label.replace(" ", "_") + encoder.extension)
+            try:
+                start = time.perf_counter()
+                writer = open_writer(encoder, path, fps, (width, height))
+                for frame in inputs:
+                    writer.write(frame)
+                writer.release()
+                elapsed = time.perf_counter() - start
+            except IOError:
+                yield label, None, 0.0, 0
+                continue
+            fourcc = "MJPG" if encoder.accepts_jpeg else _working_fourccs[name]
+            yield label, fourcc, len(inputs) / elapsed, os.path.getsize(path) / len(inputs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the recording encoders: encode fps and bytes per frame.")
+    parser.add_argument("video", nargs="?", help="Recording to take frames from (default: synthetic 1280x720 frames).")
+    parser.add_argument("--frames", type=int, default=300, help="Frames to encode with each backend.")
+    args = parser.parse_args(argv)
+
+    # Decode up front so only encoding is timed
+    if args.video:
+        frames = list(read_frames(args.video, args.frames))
+    else:
+        frames = list(synthetic_frames(args.frames))
+    if not frames:
+        print("No frames to encode.", file=sys.stderr)
+        return 1
+
+    height, width = frames[0].shape[:2]
+    print(f"{len(frames)} frames at {width}x{height}")
+    print(f"{'backend':<18} {'fourcc':<6} {'fps':>8} {'KB/frame':>9}")
+    for label, fourcc, fps, frame_bytes in benchmark(frames):
+        if fourcc is None:
+            print(f"{label:<18} {'-':<6} {'unavailable':>18}")
+        else:
+            print(f"{label:<18} {fourcc:<6} {fps:>8.1f} {frame_bytes / 1024:>9.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+import os
+
+import cv2
+import numpy as np
+
+# Bump when the cached index layout changes so old caches are rebuilt
+INDEX_VERSION = 1
+
+
+def index_path_for(video_path):
+    """The index is cached next to the recording, e.g. take20240101120000.avi.idx.npz."""
+    return video_path + ".idx.npz"
+
+
+class FrameIndex:
+    """Per-frame timestamps, packet sizes and keyframe flags for one video file.
+
+    Built by reading the compressed packets without decoding them, which takes milliseconds
+    even for long recordings, and cached next to the file until the file changes.
+    """
+
+    def __init__(self, timestamps_ms, packet_sizes, keyframes, fps):
+        self.timestamps_ms = timestamps_ms  # Presentation time of each frame
+        self.packet_sizes = packet_sizes    # Compressed size of each frame in bytes
+        # Byte offset of each frame's packet within the video stream (not the container file)
+        self.stream_offsets = np.concatenate(([0], np.cumsum(packet_sizes[:-1]))) if len(packet_sizes) else packet_sizes
+        self.keyframes = keyframes          # Frame numbers of keyframes, ascending
+        self.fps = fps
+
+    @property
+    def frame_count(self):
+        return len(self.timestamps_ms)
+
+    @property
+    def duration(self):
+        """Length of the video in seconds."""
+        if not self.frame_count:
+            return 0.0
+        return (self.timestamps_ms[-1] / 1000.0) + 1.0 / self.fps
+
+    def keyframe_before(self, frame_number):
+        """The last keyframe at or before frame_number, where decoding has to start."""
+        position = np.searchsorted(self.keyframes, frame_number, side="right") - 1
+        return int(self.keyframes[position]) if position >= 0 else 0
+
+    def frame_at_time(self, seconds):
+        """The frame shown at the given time."""
+        position = np.searchsorted(self.timestamps_ms, seconds * 1000.0, side="right") - 1
+        return int(min(max(position, 0), self.frame_count - 1))
+
+    @classmethod
+    def build(cls, video_path):
+        """Scans the video's packets without decoding them."""
+        cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+        if not cap.isOpened():
+            raise IOError(f"Cannot open video file {video_path}.")
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+
+        timestamps, sizes, keyframes = [], [], []
+        try:
+            while True:
+                ret, packet = cap.read()
+                if not ret:
+                    break
+                if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                    keyframes.append(len(timestamps))
+                timestamps.append(cap.get(cv2.CAP_PROP_POS_MSEC))
+                sizes.append(packet.size)
+        finally:
+            cap.release()
+
+        if not keyframes:
+            # Without keyframe information every seek decodes from the start, which is still correct
+            keyframes = [0]
+        return cls(np.array(timestamps, dtype=np.float64), np.array(sizes, dtype=np.int64),
+                   np.array(keyframes, dtype=np.int64), fps)
+
+    @classmethod
+    def load(cls, video_path):
+        """Returns the cached index, building and caching it if it is missing or out of date."""
+        stat = os.stat(video_path)
+        index_path = index_path_for(video_path)
+        try:
+            with np.load(index_path) as cached:
+                if (int(cached["version"]) == INDEX_VERSION and int(cached["source_size"]) == stat.st_size
+                        and float(cached["source_mtime"]) == stat.st_mtime):
+                    return cls(cached["timestamps_ms"], cached["packet_sizes"], cached["keyframes"],
+                               float(cached["fps"]))
+        except (OSError, KeyError, ValueError):
+            pass
+
+        index = cls.build(video_path)
+        try:
+            # Write under a temporary name first so a half-written cache is never picked up
+            temp_path = index_path + ".tmp.npz"
+            np.savez(temp_path, version=INDEX_VERSION, source_size=stat.st_size, source_mtime=stat.st_mtime,
+                     timestamps_ms=index.timestamps_ms, packet_sizes=index.packet_sizes,
+                     keyframes=index.keyframes, fps=index.fps)
+            os.replace(temp_path, index_path)
+        except OSError:
+            # A read-only share still gets a working (uncached) index
+            pass
+        return index
+
+
+class FrameSeeker:
+    """Frame-accurate random access into a video using its FrameIndex.
+
+    A seek jumps to the keyframe at or before the target and decodes forward from there,
+    so it costs at most one GOP of decoding however long the video is.
+    """
+
+    def __init__(self, video_path, index=None):
+        self.index = index or FrameIndex.load(video_path)
+        self.cap = cv2.VideoCapture(video_path)
+        if not self.cap.isOpened():
+            raise IOError(f"Cannot open video file {video_path}.")
+        self.position = 0  # Frame number the next read() returns
+
+    @property
+    def frame_count(self):
+        return self.index.frame_count
+
+    @property
+    def fps(self):
+        return self.index.fps
+
+    def read(self, out=None):
+        """Decodes the frame at the current position and advances. Returns None at the end.
+
+        The frame is decoded into `out` when it is given and has the right shape.
+        """
+        ret, frame = self.cap.read(out) if out is not None else self.cap.read()
+        if not ret:
+            return None
+        self.position += 1
+        return frame
+
+    def skip(self):
+        """Advances one frame without converting it to an image. Returns False at the end."""
+        if not self.cap.grab():
+            return False
+        self.position += 1
+        return True
+
+    def seek(self, frame_number):
+        """Moves so the next read() returns exactly frame_number."""
+        frame_number = int(min(max(frame_number, 0), max(self.frame_count - 1, 0)))
+        if frame_number == self.position:
+            return
+
+        # Going forward within the current GOP is cheaper than jumping back to its keyframe
+        keyframe = self.index.keyframe_before(frame_number)
+        if not (self.position < frame_number and self.position >= keyframe):
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+            self.position = keyframe
+
+        while self.position < frame_number:
+            if not self.cap.grab():
+                break
+            self.position += 1
+
+    def frame_at(self, frame_number):
+        """Returns the decoded frame_number, leaving the position just after it."""
+        self.seek(frame_number)
+        return self.read()
+
+    def seek_time(self, seconds):
+        self.seek(self.index.frame_at_time(seconds))
+
+    def release(self):
+        self.cap.release()
@@ -0,0 +1,369 @@
+"""Shares the live camera frames with other processes on this machine through shared memory.
+
+A camera can only be opened by one process. With the frame bus on, every stream's
+newest frames are published as BGR images into a named shared-memory block
+(multiprocessing.shared_memory), which labeling or inference tools attach to and read
+without the camera, a socket or any encoding in between:
+
+    from framebus import FrameBusClient
+
+    with FrameBusClient("tvc") as bus:       # "tvc_cam1" etc. when recording several cameras
+        while True:
+            frame = bus.read(timeout=1.0)    # Every frame in turn, copied out
+            if frame is None:
+                break                        # Timed out, or the capture side stopped
+            run_model(frame.image)
+
+read(copy=False) and latest(copy=False) return a read-only view of the shared memory
+instead of a copy; it stays intact until the publisher has written `slots` more frames,
+which valid(frame) checks. Frame timestamps are time.monotonic() values of the capturing
+process, which other processes on the same machine can compare against their own.
+
+Clients need NumPy, this file and metrics.py, but not OpenCV. `python src/framebus.py tvc`
+attaches to a bus and reports the frame rate and latency it sees.
+
+The block starts with a header (magic, version, slot size, newest frame index, slot
+count, state, nominal fps, publisher's process id) followed by `slots` slots, each a small header (generation,
+frame index, source sequence number, capture time, gap, height, width, channels) and the
+image. Frame indexes count the frames published, so frame i is in slot i % slots; the
+source sequence numbers skip the frames the publisher was too slow for.
+The publisher makes a slot's generation odd while it writes the slot and even again
+when it is done, so readers can tell a torn frame from a complete one.
+"""
+import argparse
+import os
+import struct
+import sys
+import threading
+import time
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from metrics import StageHistogram
+
+MAGIC = b"TVCF"
+VERSION = 2
+DEFAULT_SLOTS = 4
+
+# magic, version, slot data bytes, newest frame index (-1: none yet), slots, state, nominal fps, publisher pid
+_HEADER = struct.Struct("<4sIQqIIdI")
+# generation, frame index, source sequence number, capture time, gap before the frame, height, width, channels
+_SLOT_HEADER = struct.Struct("<QqqddIII")
+_HEADER_SIZE = 64
+_SLOT_HEADER_SIZE = 64
+_NEWEST_OFFSET = 16  # Offset of the newest frame index within the header
+_STATE_OFFSET = 28
+
+STATE_OPEN = 1
+STATE_CLOSED = 2
+
+# Names of the buses this process publishes; its clients must leave their registration alone
+_published = set()
+
+# A frame read from the bus; slot and generation let valid() check a view is still intact
+BusFrame = namedtuple("BusFrame", ["index", "seq", "timestamp", "image", "gap", "slot", "generation"])
+
+
+def stream_bus_name(name, camera_index=None):
+    """The shared-memory name of one stream's bus: `name`, with _cam{N} when there are several cameras."""
+    return name if camera_index is None else f"{name}_cam{camera_index}"
+
+
+class FrameBusPublisher:
+    """Copies the newest frames of a ring consumer into a shared-memory block on its own thread.
+
+    The consumer should be a latest_only one that decodes, so a slow publisher skips frames
+    rather than counting them as dropped, and clients always get BGR images. Each frame is
+    copied from the ring straight into its slot. Frames larger than the slots (after a
+    stream came back at a higher resolution) are skipped and counted in `oversized`.
+
+    Raises FileExistsError when a block of that name is in use: a bus whose publisher is
+    still running, or something other than a frame bus. A bus left behind by a publisher
+    that did not exit cleanly is replaced.
+    """
+
+    def __init__(self, consumer, name, shape, fps=0.0, slots=DEFAULT_SLOTS):
+        self.consumer = consumer
+        self.name = name
+        self.slots = slots
+        self.shape = tuple(shape)  # Shape of the frames the slots are sized for
+        self.slot_bytes = int(np.prod(shape))
+        self.published = 0
+        self.oversized = 0
+        self.publish_times = StageHistogram()  # Time spent copying each frame into shared memory
+
+        size = _HEADER_SIZE + slots * _slot_stride(self.slot_bytes)
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            existing = shared_memory.SharedMemory(name=name)
+            if _in_use(existing):
+                # Attaching registered the block with this process's resource tracker too
+                _untrack(existing)
+                existing.close()
+                raise FileExistsError(f"Shared memory {name} is in use by another frame bus or program.")
+            # Left behind by a publisher that did not exit cleanly
+            existing.close()
+            existing.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        _published.add(name)
+        self.buf = self.shm.buf
+        _HEADER.pack_into(self.buf, 0, MAGIC, VERSION, self.slot_bytes, -1, slots, STATE_OPEN, fps or 0.0,
+                          os.getpid())
+        for slot in range(slots):
+            _SLOT_HEADER.pack_into(self.buf, self._slot_offset(slot), 0, -1, -1, 0.0, 0.0, 0, 0, 0)
+
+        self._generations = [0] * slots
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._publish_loop, name="framebus", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops publishing and removes the block; attached clients see the bus closed."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        struct.pack_into("<I", self.buf, _STATE_OFFSET, STATE_CLOSED)
+        self.buf = None
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+        _published.discard(self.name)
+
+    def _slot_offset(self, slot):
+        return _HEADER_SIZE + slot * _slot_stride(self.slot_bytes)
+
+    def _publish_loop(self):
+        shape = self.shape
+        while not self._stop_event.is_set() and not self.consumer.ring.closed:
+            # Only mark a slot as being written once a frame is ready for it
+            if not self.consumer.wait(timeout=0.1):
+                continue
+            index = self.published
+            slot = index % self.slots
+            offset = self._slot_offset(slot)
+            generation = self._generations[slot]
+            struct.pack_into("<Q", self.buf, offset, generation + 1)
+
+            start = time.perf_counter()
+            data = np.frombuffer(self.buf, np.uint8, self.slot_bytes, offset + _SLOT_HEADER_SIZE)
+            view = data[:int(np.prod(shape))].reshape(shape)
+            # Copied from the ring straight into the slot when the frame has the usual shape
+            frame = self.consumer.read(timeout=0, out=view)
+            if frame is None or frame.image.nbytes > self.slot_bytes:
+                if frame is not None:
+                    self.oversized += 1
+                # Leave the slot as it was
+                struct.pack_into("<Q", self.buf, offset, generation)
+                continue
+            image = frame.image
+            if image is not view:
+                np.copyto(data[:image.nbytes].reshape(image.shape), image)
+                shape = image.shape
+            height, width = image.shape[:2]
+            channels = image.shape[2] if image.ndim == 3 else 1
+            _SLOT_HEADER.pack_into(self.buf, offset, generation + 2, index, frame.seq, frame.timestamp, frame.gap,
+                                   height, width, channels)
+            struct.pack_into("<q", self.buf, _NEWEST_OFFSET, index)
+            self.publish_times.observe(time.perf_counter() - start)
+
+            self._generations[slot] = generation + 2
+            self.published += 1
+
+
+class FrameBusClient:
+    """Attaches to a frame bus by name and reads its frames.
+
+    Raises FileNotFoundError when no bus of that name is published and ValueError when
+    the block is not a frame bus. The client never writes to the block.
+    """
+
+    def __init__(self, name, poll_interval=0.002):
+        self.name = name
+        self.poll_interval = poll_interval
+        self.shm = shared_memory.SharedMemory(name=name)
+        _untrack(self.shm)
+        self.buf = self.shm.buf
+        magic, version, self.slot_bytes, _, self.slots, _, self.fps, _ = _HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{name} is not a version {VERSION} frame bus.")
+        self.last_index = None  # Index of the last frame read() returned
+        self.dropped = 0      # Frames read() skipped because they were overwritten first
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def closed(self):
+        """True once the publisher stopped (or this client was closed)."""
+        return self.buf is None or struct.unpack_from("<I", self.buf, _STATE_OFFSET)[0] != STATE_OPEN
+
+    @property
+    def newest_index(self):
+        """Index of the newest published frame, or -1 before the first one."""
+        return struct.unpack_from("<q", self.buf, _NEWEST_OFFSET)[0]
+
+    def latest(self, copy=True):
+        """The newest frame, or None if there is none yet or it could not be read intact."""
+        for _ in range(self.slots):
+            index = self.newest_index
+            if index < 0:
+                return None
+            frame = self._read_slot(index, copy)
+            if frame is not None:
+                return frame
+        return None
+
+    def read(self, timeout=None, copy=True):
+        """The frame after the one read last (the newest one on the first call).
+
+        Waits up to `timeout` seconds (None: for as long as the bus is open) and returns
+        None when it runs out or the bus closes. A reader that falls more than `slots`
+        frames behind skips ahead to the oldest frame still held and counts the rest in
+        `dropped`.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            newest = self.newest_index
+            if newest >= 0:
+                wanted = newest if self.last_index is None else self.last_index + 1
+                if wanted <= newest:
+                    oldest = newest - self.slots + 1
+                    if wanted < oldest:
+                        self.dropped += oldest - wanted
+                        wanted = oldest
+                    frame = self._read_slot(wanted, copy)
+                    if frame is not None:
+                        self.last_index = frame.index
+                        return frame
+                    # Overwritten while it was read: the reader is too slow for this slot count
+                    self.dropped += 1
+                    self.last_index = wanted
+                    continue
+            if self.closed or (deadline is not None and time.monotonic() >= deadline):
+                return None
+            time.sleep(self.poll_interval)
+
+    def valid(self, frame):
+        """Whether a frame read with copy=False is still intact, i.e. its slot was not reused since."""
+        return self.buf is not None and struct.unpack_from("<Q", self.buf, self._slot_offset(frame.slot))[0] == \
+            frame.generation
+
+    def close(self):
+        """Detaches from the block. Views handed out with copy=False must no longer be used."""
+        if self.buf is None:
+            return
+        self.buf = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # Views from copy=False reads still point into it; the mapping goes with them
+            pass
+
+    def _slot_offset(self, slot):
+        return _HEADER_SIZE + slot * _slot_stride(self.slot_bytes)
+
+    def _read_slot(self, index, copy):
+        slot = index % self.slots
+        offset = self._slot_offset(slot)
+        generation, slot_index, seq, timestamp, gap, height, width, channels = \
+            _SLOT_HEADER.unpack_from(self.buf, offset)
+        if generation % 2 or slot_index != index:
+            return None
+        shape = (height, width, channels) if channels > 1 else (height, width)
+        image = np.frombuffer(self.buf, np.uint8, height * width * channels, offset + _SLOT_HEADER_SIZE).reshape(shape)
+        image.flags.writeable = False
+        if copy:
+            image = image.copy()
+        # A generation that moved on means the publisher wrote the slot meanwhile
+        if struct.unpack_from("<Q", self.buf, offset)[0] != generation:
+            return None
+        return BusFrame(index, seq, timestamp, image, gap, slot, generation)
+
+
+def _slot_stride(slot_bytes):
+    # Slots start on 64-byte boundaries so their headers' fields are aligned
+    return _SLOT_HEADER_SIZE + (slot_bytes + 63) // 64 * 64
+
+
+def _in_use(shm):
+    # Whether an existing block is something other than a frame bus, or one still published
+    try:
+        magic, version, _, _, _, state, _, pid = _HEADER.unpack_from(shm.buf, 0)
+    except struct.error:
+        return True
+    if magic != MAGIC or version != VERSION:
+        return True
+    if state != STATE_OPEN:
+        return False
+    if os.name == "nt":
+        # Windows frees a block with its last handle, so one that exists has a live owner
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _untrack(shm):
+    # Before Python 3.13 every process that attaches registers the block with its resource
+    # tracker, which would remove it from under the publisher when this process exits. The
+    # publisher's own registration is what removes it if the publisher dies, so a client in
+    # the publishing process keeps it.
+    if shm.name.lstrip("/") in _published:
+        return
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except (ImportError, AttributeError, KeyError):
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Attach to a frame bus and report what arrives.")
+    parser.add_argument("name", help="Frame bus name, e.g. tvc or tvc_cam0.")
+    parser.add_argument("--seconds", type=float, default=5.0, help="How long to read.")
+    args = parser.parse_args(argv)
+
+    try:
+        bus = FrameBusClient(args.name)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Cannot attach to frame bus {args.name}: {e}", file=sys.stderr)
+        return 1
+    latency = StageHistogram(window=100000)
+    frames, shape = 0, None
+    with bus:
+        start = time.monotonic()
+        deadline = start + args.seconds
+        while time.monotonic() < deadline:
+            frame = bus.read(timeout=max(0.0, deadline - time.monotonic()), copy=False)
+            if frame is None:
+                break
+            latency.observe(time.monotonic() - frame.timestamp)
+            shape = frame.image.shape
+            frames += 1
+        elapsed = time.monotonic() - start
+        snapshot = latency.snapshot()
+        print(f"{args.name}: {frames} frames of {shape} in {elapsed:.1f} s ({frames / elapsed:.1f} fps, "
+              f"publisher nominal {bus.fps:.1f}), {bus.dropped} skipped, latency p50 {snapshot['p50_ms']:.1f} ms "
+              f"p95 {snapshot['p95_ms']:.1f} ms" + (", bus closed" if bus.closed else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+import hashlib
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from multiprocessing import get_context
+
+import cv2
+import numpy as np
+
+from session import parse_output_name
+
+# Hidden folder inside the output directory holding the index and cached images
+LIBRARY_DIR = ".library"
+VIDEO_EXTENSIONS = (".avi", ".mp4", ".mkv", ".mov")
+
+THUMBNAIL_WIDTH = 160
+CONTACT_SHEET_GRID = (3, 3)  # (columns, rows)
+CONTACT_SHEET_TILE_WIDTH = 240
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    label TEXT,
+    recorded_at TEXT,
+    camera INTEGER,
+    segment INTEGER,
+    frame_count INTEGER,
+    fps REAL,
+    duration REAL,
+    width INTEGER,
+    height INTEGER,
+    thumbnail TEXT,
+    contact_sheet TEXT,
+    error TEXT
+)
+"""
+
+COLUMNS = ("path", "size", "mtime", "label", "recorded_at", "camera", "segment", "frame_count", "fps",
+           "duration", "width", "height", "thumbnail", "contact_sheet", "error")
+
+
+def describe_recording(path, cache_dir):
+    """Reads a recording's properties and renders its thumbnail and contact sheet.
+
+    Runs in a worker process. Frames are fetched by seeking rather than decoding the whole
+    file, so the cost depends on the number of tiles, not the length of the recording.
+    """
+    cv2.setNumThreads(1)
+    stat = os.stat(path)
+    record = {"path": path, "size": stat.st_size, "mtime": stat.st_mtime}
+
+    parsed = parse_output_name(path)
+    if parsed:
+        label, recorded_at, record["camera"], record["segment"] = parsed
+        record["label"] = label
+        record["recorded_at"] = recorded_at.isoformat(sep=" ")
+    else:
+        record["label"] = os.path.splitext(os.path.basename(path))[0]
+        record["recorded_at"] = datetime.fromtimestamp(stat.st_mtime).isoformat(sep=" ", timespec="seconds")
+
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            record["error"] = "Cannot open video file."
+            return record
+
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        record.update(frame_count=frame_count, fps=fps, duration=frame_count / fps,
+                      width=int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), height=int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+        columns, rows = CONTACT_SHEET_GRID
+        positions = np.linspace(0, max(frame_count - 1, 0), columns * rows).astype(int)
+        frames = []
+        for position in positions:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(position))
+            ret, frame = cap.read()
+            if ret:
+                frames.append(frame)
+        if not frames:
+            record["error"] = "No decodable frames."
+            return record
+    finally:
+        cap.release()
+
+    # Cache files are keyed by path, mtime and size so a rewritten file never shows a stale
+    # image, even when it was rewritten within the same second
+    key = f"{hashlib.sha1(path.encode()).hexdigest()[:12]}_{stat.st_mtime_ns}_{stat.st_size}"
+    record["thumbnail"] = os.path.join(cache_dir, f"{key}_thumb.jpg")
+    cv2.imwrite(record["thumbnail"], _fit_width(frames[0], THUMBNAIL_WIDTH))
+    record["contact_sheet"] = os.path.join(cache_dir, f"{key}_sheet.jpg")
+    cv2.imwrite(record["contact_sheet"], _contact_sheet(frames, columns, rows))
+    return record
+
+
+def _fit_width(frame, width):
+    height = max(1, round(frame.shape[0] * width / frame.shape[1]))
+    return cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def _contact_sheet(frames, columns, rows):
+    tiles = [_fit_width(frame, CONTACT_SHEET_TILE_WIDTH) for frame in frames]
+    tile_height = tiles[0].shape[0]
+    sheet = np.zeros((tile_height * rows, CONTACT_SHEET_TILE_WIDTH * columns, 3), dtype=np.uint8)
+    for i, tile in enumerate(tiles):
+        row, col = divmod(i, columns)
+        height = min(tile_height, tile.shape[0])
+        sheet[row * tile_height:row * tile_height + height,
+              col * CONTACT_SHEET_TILE_WIDTH:(col + 1) * CONTACT_SHEET_TILE_WIDTH] = tile[:height]
+    return sheet
+
+
+class RecordingLibrary:
+    """An on-disk index of the recordings in an output directory.
+
+    Metadata lives in a SQLite database and thumbnails/contact sheets in a cache folder,
+    both under output_dir/.library. Listing never touches the videos; refresh() only
+    describes files whose size or mtime changed, using a pool of worker processes.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.library_dir = os.path.join(output_dir, LIBRARY_DIR)
+        self.cache_dir = os.path.join(self.library_dir, "thumbnails")
+        self.db_path = os.path.join(self.library_dir, "library.sqlite")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._connect() as db:
+            db.execute(SCHEMA)
+
+    def recordings(self):
+        """Every indexed recording as a dict, newest first."""
+        with self._connect() as db:
+            db.row_factory = sqlite3.Row
+            rows = db.execute("SELECT * FROM recordings ORDER BY recorded_at DESC, path").fetchall()
+        return [dict(row) for row in rows]
+
+    def refresh(self, workers=None, progress=None):
+        """Brings the index up to date with the directory. Returns the number of recordings (re)described.
+
+        progress, if given, is called with (done, total) after each recording.
+        """
+        on_disk = {}
+        with os.scandir(self.output_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(VIDEO_EXTENSIONS):
+                    stat = entry.stat()
+                    on_disk[entry.path] = (stat.st_size, stat.st_mtime)
+
+        with self._connect() as db:
+            known = {path: (size, mtime) for path, size, mtime in db.execute("SELECT path, size, mtime FROM recordings")}
+            removed = [path for path in known if path not in on_disk]
+            for path in removed:
+                self._forget(db, path)
+
+        stale = [path for path, signature in on_disk.items() if known.get(path) != signature]
+        if not stale:
+            return 0
+
+        # Workers are spawned, not forked: the GUI process has capture and Tk threads running
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+            futures = {pool.submit(describe_recording, path, self.cache_dir): path for path in stale}
+            for done, future in enumerate(as_completed(futures), start=1):
+                path = futures[future]
+                try:
+                    record = future.result()
+                except Exception as e:
+                    size, mtime = on_disk[path]
+                    record = {"path": path, "size": size, "mtime": mtime, "error": str(e),
+                              "label": os.path.splitext(os.path.basename(path))[0]}
+                with self._connect() as db:
+                    self._forget(db, path, keep=(record.get("thumbnail"), record.get("contact_sheet")))
+                    db.execute(f"INSERT INTO recordings ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                               [record.get(column) for column in COLUMNS])
+                if progress:
+                    progress(done, len(stale))
+        return len(stale)
+
+    def _forget(self, db, path, keep=()):
+        # Drop the row and its cached images, except those the new row reuses
+        row = db.execute("SELECT thumbnail, contact_sheet FROM recordings WHERE path = ?", (path,)).fetchone()
+        if row:
+            for image_path in row:
+                if image_path and image_path not in keep and os.path.exists(image_path):
+                    os.remove(image_path)
+        db.execute("DELETE FROM recordings WHERE path = ?", (path,))
+
+    def _connect(self):
+        # A short-lived connection per call, so the library can be used from any thread
+        return _Connection(self.db_path)
+
+
+class _Connection:
+    """sqlite3 connection context manager that also closes the connection."""
+
+    def __init__(self, db_path):
+        self.db = sqlite3.connect(db_path)
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.db.commit()
+        self.db.close()
@@ -0,0 +1,188 @@
+import tkinter as tk
+from tkinter import ttk, messagebox
+
+from PIL import Image, ImageTk
+
+from library import RecordingLibrary
+from postprocess import PostProcessJob, format_chain, summarize
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return ""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+class LibraryWindow(tk.Toplevel):
+    """Lists the recordings in an output directory with a contact sheet of the selected one.
+
+    The list is shown straight from the library index, then refreshed in the background;
+    only new or changed files are decoded, so reopening the window is instant.
+    "Post-process" runs `postprocess_chain` over the recordings not yet processed with it.
+    """
+
+    COLUMNS = (("label", "Name", 160), ("recorded_at", "Recorded", 150), ("duration", "Duration", 70),
+               ("resolution", "Resolution", 90), ("fps", "FPS", 50), ("size", "Size", 80))
+
+    def __init__(self, app, output_dir, on_open, postprocess_chain="", default_codec="xvid"):
+        super().__init__(app)
+        self.app = app
+        self.on_open = on_open
+        self.output_dir = output_dir
+        self.postprocess_chain = postprocess_chain
+        self.default_codec = default_codec
+        self.library = RecordingLibrary(output_dir)
+        self.records = {}  # Tree item id -> recording dict
+        self.progress = (0, 0)  # (done, total) written by the background thread, read by the Tk loop
+        self.activity = "Indexing"  # What the progress counts
+        self.sheet_photo = None  # Keeps the shown contact sheet alive
+        self.scanning = False
+
+        self.title(f"Library - {output_dir}")
+        self.geometry("760x640")
+
+        self.tree = ttk.Treeview(self, columns=[name for name, _, _ in self.COLUMNS], show="headings", height=12)
+        for name, heading, width in self.COLUMNS:
+            self.tree.heading(name, text=heading)
+            self.tree.column(name, width=width, anchor=tk.W)
+        self.tree.pack(fill=tk.X, padx=10, pady=(10, 5))
+        self.tree.bind("<<TreeviewSelect>>", self.on_select)
+        self.tree.bind("<Double-1>", self.on_double_click)
+
+        button_frame = ttk.Frame(self)
+        button_frame.pack(fill=tk.X, padx=10)
+        ttk.Button(button_frame, text="Open", command=self.open_selected).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Refresh", command=self.refresh).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Post-process", command=self.post_process).pack(side=tk.LEFT, padx=5)
+        self.status_label = ttk.Label(button_frame, text="")
+        self.status_label.pack(side=tk.LEFT, padx=10)
+
+        self.sheet_label = ttk.Label(self, anchor=tk.CENTER)
+        self.sheet_label.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        self.populate()
+        self.refresh()
+
+    def populate(self):
+        """Fills the list from the index without touching the video files."""
+        selected = self.selected_record()
+        self.tree.delete(*self.tree.get_children())
+        self.records = {}
+        for record in self.library.recordings():
+            if record["error"]:
+                values = (record["label"], record["recorded_at"] or "", "", record["error"], "", "")
+            else:
+                values = (record["label"], record["recorded_at"], format_duration(record["duration"]),
+                          f"{record['width']}x{record['height']}", f"{record['fps']:.1f}",
+                          f"{record['size'] / (1024 * 1024):.1f} MB")
+            item = self.tree.insert("", tk.END, values=values)
+            self.records[item] = record
+            if selected and record["path"] == selected["path"]:
+                self.tree.selection_set(item)
+
+    def refresh(self):
+        """Re-indexes new or changed recordings in the background."""
+        if self.scanning:
+            return
+        self.scanning = True
+        self.status_label.config(text="Scanning...")
+        self.progress = (0, 0)
+        self.activity = "Indexing"
+
+        def on_progress(done, total):
+            self.progress = (done, total)
+
+        self.app.run_in_background(lambda: self.library.refresh(progress=on_progress),
+                                   self.on_refreshed, self.on_refresh_failed)
+        self.update_progress()
+
+    def update_progress(self):
+        if self.scanning and self.winfo_exists():
+            done, total = self.progress
+            if total:
+                self.status_label.config(text=f"{self.activity} {done}/{total}...")
+            self.after(200, self.update_progress)
+
+    def on_refreshed(self, changed):
+        self.scanning = False
+        if not self.winfo_exists():
+            return
+        self.status_label.config(text=f"{changed} updated" if changed else "Up to date")
+        if changed:
+            self.populate()
+
+    def on_refresh_failed(self, error):
+        self.scanning = False
+        if self.winfo_exists():
+            self.status_label.config(text=f"Refresh failed: {error}")
+
+    def post_process(self):
+        """Runs the post-processing chain in the background; recordings already done are skipped."""
+        if self.scanning:
+            return
+        try:
+            job = PostProcessJob(self.output_dir, self.postprocess_chain, self.default_codec)
+        except ValueError as e:
+            messagebox.showerror("Post-processing Error", f"Invalid postprocess_chain in config.ini.\n\n{e}", parent=self)
+            return
+        if not job.chain:
+            messagebox.showerror("Post-processing Error", "Set postprocess_chain in config.ini first.", parent=self)
+            return
+
+        self.scanning = True
+        self.status_label.config(text=f"Post-processing: {format_chain(job.chain)}")
+        self.progress = (0, 0)
+        self.activity = "Processing"
+
+        def work():
+            paths = job.pending()
+            entries = []
+            for done, (path, entry) in enumerate(job.run(paths=paths), start=1):
+                entries.append(entry)
+                self.progress = (done, len(paths))
+            return entries
+
+        self.app.run_in_background(work, self.on_post_processed, self.on_post_process_failed)
+        self.update_progress()
+
+    def on_post_processed(self, entries):
+        self.scanning = False
+        if self.winfo_exists():
+            self.status_label.config(text=summarize(entries) if entries else "Everything is already processed")
+
+    def on_post_process_failed(self, error):
+        self.scanning = False
+        if self.winfo_exists():
+            self.status_label.config(text=f"Post-processing failed: {error}")
+
+    def selected_record(self):
+        selection = self.tree.selection() if self.records else ()
+        return self.records.get(selection[0]) if selection else None
+
+    def on_select(self, event=None):
+        record = self.selected_record()
+        if not record or not record["contact_sheet"]:
+            self.sheet_label.config(image="", text=record["error"] if record else "")
+            self.sheet_photo = None
+            return
+        try:
+            image = Image.open(record["contact_sheet"])
+        except OSError:
+            self.sheet_label.config(image="", text="Preview not available.")
+            self.sheet_photo = None
+            return
+        # Before the window is first drawn the label reports a size of 1x1
+        image.thumbnail((max(self.sheet_label.winfo_width(), 720), max(self.sheet_label.winfo_height(), 400)))
+        self.sheet_photo = ImageTk.PhotoImage(image)
+        self.sheet_label.config(image=self.sheet_photo, text="")
+
+    def on_double_click(self, event):
+        if self.tree.identify_row(event.y):
+            self.open_selected()
+
+    def open_selected(self):
+        record = self.selected_record()
+        if record and not record["error"]:
+            self.on_open(record["path"])
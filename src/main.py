@@ -2,25 +2,52 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import threading
 import os
-import configparser
-import cv2
-from PIL import Image, ImageTk
-from datetime import datetime
 import time
 import signal
-import sys
+from multiprocessing import freeze_support
+
+import config_manager
+from playback import PlaybackEngine
+from startup import StartupReport, preload
+
+# Modules that load OpenCV, NumPy or Pillow are imported where they are used, so the
+# window shows before they are loaded; startup.preload() loads them in the background.
+
+def format_time(seconds):
+    """Formats seconds as hh:mm:ss."""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+def format_stats(stream_metrics, preview):
+    """One compact line per stream, plus the preview, for the stats overlay."""
+    lines = []
+    for index, metrics in enumerate(stream_metrics):
+        read = metrics["read"]
+        if not metrics["connected"]:
+            lines.append(f"cam{index} reconnecting... ({metrics['reconnects']} reconnects so far)")
+            continue
+        line = f"cam{index} {read['rate']:4.1f}/{metrics['nominal_fps']:.0f} fps  read p95 {read['p95_ms']:5.1f}ms"
+        if metrics["encode"]:
+            line += (f"  enc p95 {metrics['encode']['p95_ms']:5.1f}ms  queue {metrics['writer_queue']}"
+                     f"  dropped {metrics['frames_dropped']}")
+        if metrics["trigger_score"] is not None:
+            line += f"  trigger {metrics['trigger_score']:.3f}/{metrics['trigger_threshold']:g}"
+        if metrics["preroll_seconds"] is not None:
+            line += f"  pre-roll {metrics['preroll_seconds']:.1f}s {metrics['preroll_bytes'] / (1024 * 1024):.0f}MB"
+        lines.append(line)
+    render = preview.render_times.snapshot()
+    lines.append(f"preview {preview.current_fps:4.1f} fps  render p95 {render['p95_ms']:5.1f}ms")
+    return "\n".join(lines)
+
 
 class App(tk.Tk):
     def __init__(self):
         super().__init__()
 
-        # Get the base directory of the running script
-        if getattr(sys, 'frozen', False):
-            # We are running in a bundled executable
-            self.base_dir = os.path.dirname(sys.executable)
-        else:
-            # We are running in a regular Python environment
-            self.base_dir = os.path.dirname(os.path.abspath(__file__))
+        # Get the base directory of the running script (or of the bundled executable)
+        self.base_dir = config_manager.get_base_dir()
 
         # Configure the main window
         self.title("Video Capture Tool for AI Model Training")
@@ -45,20 +72,53 @@ class App(tk.Tk):
         self.main_frame.rowconfigure(0, weight=1)
 
         # Camera and Recording variables
-        self.camera = None
+        self.session = None # CaptureSession with a capture thread (and recorder) per source
+        self.preview_consumers = [] # One ring consumer per source that always sees the newest frame
+        self.mosaic = None # Tiles the sources into one preview frame when there are several
         self.is_camera_on = False
         self.frame_update_id = None
         self.is_recording = False 
-        self.video_writer = None
+        self.recording_by_trigger = False # The current recording was started by the motion trigger
+        self.writer_queue_size = 64 # Frames the encoder may fall behind before the drop policy applies
+        self.writer_drop_policy = "block" # One of recorder.DROP_POLICIES
+        self.preview_fps = 15 # Live preview rate; the recorder still receives every frame
+        self.segment_seconds = 0 # Start a new file after this many seconds (0 = one file)
+        self.segment_mb = 0 # Start a new file after this many MB (0 = no size limit)
+        self.checkpoint_seconds = 0 # Flush recordings to disk this often so recovery.py can repair them (0 = off)
+        self.video_codec = "xvid" # One of encoders.ENCODER_NAMES
+        self.metrics_port = 0 # Serve Prometheus metrics on 127.0.0.1 at this port (0 = off)
+        self.frame_timing = "measured" # One of recorder.FRAME_TIMINGS
+        self.target_fps = 0 # Constant rate for the "resample" frame timing (0 = the camera's nominal rate)
+        self.preroll_seconds = 0 # Seconds before Record is pressed that recordings include (0 = off)
+        self.preroll_max_mb = 256 # Memory the pre-roll of all cameras together may use
+        self.preroll_quality = 90 # JPEG quality of pre-roll frames the camera does not deliver as JPEG
+        self.settings = None # The loaded config_manager settings section
+        self.pending_session = None # CaptureSession whose sources are still being opened
+        self.metrics_server = None
+        self.stats_update_time = 0.0 # When the stats overlay was last refreshed
         self.recording_timer = None
-        self.start_time = 0 
+        self.closing = False # Set once on_close() runs, so nothing waits for the user any more
+        self.storage_message = "" # Storage warning shown in the status line while recording
 
         # Playback variables
         self.is_playing = False # Add this
-        self.playback_cap = None # Add this
-        self.playback_thread = None # Add this
-        self.playback_thread_running = False # Add this
+        self.playback = None # PlaybackEngine decoding the open video ahead on its own thread
+        self.playback_update_id = None
+        self.updating_seek_bar = False # True while the seek bar is moved from code rather than by the user
         self.current_video_path = None # Add this
+        self.library_window = None # Recording library browser, when open
+        self.scan_window = None # Camera scan results, when open
+        self.probe_timeout = 5.0 # Seconds a source gets to deliver its first frame when tested or scanned
+        self.scan_indices = 8 # USB device indices 0 to scan_indices - 1 are scanned
+        self.scan_urls = "" # Stream URLs to scan as well, separated by commas
+        self.postprocess_chain = "dedupe=4" # Steps the library's Post-process button applies
+        self.frame_bus_name = "" # Shared-memory name the live frames are published under for other processes ("" = off)
+        self.frame_bus_slots = 4 # Frames each stream's frame bus holds
+
+        # Startup: OpenCV and Pillow load on a worker thread while the window is shown
+        self.modules_loaded = False
+        self.startup_report = StartupReport() # Milestones for the startup benchmark, when it launched us
+        self.preview = None # PreviewRenderer, created once the modules are loaded
 
         # UI components
         self.create_left_panel()
@@ -66,16 +126,31 @@ class App(tk.Tk):
 
         # Callbacks
         self.test_connection_button.config(command=self.test_camera_connection)
+        self.scan_button.config(command=self.scan_for_cameras)
         self.start_stop_camera_button.config(command=self.toggle_camera)
         self.record_button.config(command=self.toggle_recording)
         self.open_video_button.config(command=self.browse_and_open_video)
+        self.library_button.config(command=self.open_library)
         self.playback_button.config(command=self.toggle_playback)
+        self.step_back_button.config(command=lambda: self.step_playback(-1))
+        self.step_forward_button.config(command=lambda: self.step_playback(1))
+        self.jump_button.config(command=self.jump_to_time)
+        self.speed_combobox.bind("<<ComboboxSelected>>", self.on_speed_selected)
         self.delete_video_button.config(command=self.delete_video)
 
         # Manage settings
-        self.settings_file = os.path.join(self.base_dir, "..", "config", "config.ini")
+        self.settings_file = config_manager.default_settings_file()
         self.load_settings()
 
+        # Everything that needs OpenCV stays disabled until it is loaded
+        self.loading_buttons = [self.test_connection_button, self.scan_button, self.start_stop_camera_button,
+                                self.open_video_button, self.library_button]
+        for button in self.loading_buttons:
+            button.config(state=tk.DISABLED)
+        self.connection_status_label.config(text="Status: Loading...")
+        self.bind("<Map>", self.on_window_mapped)
+        self.run_in_background(preload, self.on_modules_loaded, self.on_modules_failed)
+
         # Bind the window closing event to save settings
         self.protocol("WM_DELETE_WINDOW", self.on_close)
         # Version and company info
@@ -84,54 +159,136 @@ class App(tk.Tk):
         ttk.Label(self.main_frame, text="© 2024 Panache IoT (a division of Panache DigiLife LTD)", 
                 font=("Arial", 8)).grid(row=3, column=1, sticky=tk.SE, padx=5)
         
-        # Register signal handler for Ctrl-C
+        # Register signal handlers for Ctrl-C and service managers, so recordings are finished
         signal.signal(signal.SIGINT, self.handle_signal)
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        self.poll_signals()
+
+    def on_window_mapped(self, event):
+        # Child widgets report <Map> through the window's bindings too
+        if event.widget is self:
+            self.startup_report.mark("window")
+
+    def on_modules_loaded(self, seconds):
+        """Finishes the setup that needs OpenCV and Pillow, then enables the controls."""
+        from preview import PreviewRenderer
+
+        self.modules_loaded = True
+        self.preview = PreviewRenderer(self.video_label, target_fps=self.preview_fps)
+        for button in self.loading_buttons:
+            button.config(state=tk.NORMAL)
+        self.connection_status_label.config(text="Status: Disconnected")
+        self.start_metrics_server()
+        self.offer_recovery()
+
+        if self.startup_report.mark("ready"):
+            self.after_idle(self.on_close)
+        elif self.startup_report.source:
+            self.camera_source_entry.delete(0, tk.END)
+            self.camera_source_entry.insert(0, self.startup_report.source)
+            self.start_camera()
+
+    def on_modules_failed(self, error):
+        self.connection_status_label.config(text="Status: Error", foreground="red")
+        messagebox.showerror("Startup Error", f"Failed to load OpenCV or Pillow.\n\nDetails: {error}")
 
     def load_settings(self):
         """Loads settings from the config file and populates the UI."""
-        config = configparser.ConfigParser()
-
         # Create config directory and file if they don't exist
         os.makedirs(os.path.dirname(self.settings_file), exist_ok=True)
 
-        if os.path.exists(self.settings_file):
-            config.read(self.settings_file)
-
-            # Load from the file or use defaults
-            camera_source = config.get("Settings", "camera_source", fallback="0")
-            output_dir = config.get("Settings", "output_dir", fallback=os.path.join(os.getcwd(), "videos"))
+        # Load from the file or use defaults
+        settings = config_manager.load_settings(self.settings_file)
+        self.writer_queue_size = settings.getint("writer_queue_size")
+        self.writer_drop_policy = settings.get("writer_drop_policy")
+        self.preview_fps = settings.getint("preview_fps")
+        self.segment_seconds = settings.getfloat("segment_seconds")
+        self.segment_mb = settings.getfloat("segment_mb")
+        self.checkpoint_seconds = settings.getfloat("checkpoint_seconds")
+        self.video_codec = settings.get("video_codec")
+        self.metrics_port = settings.getint("metrics_port")
+        self.frame_timing = settings.get("frame_timing")
+        self.target_fps = settings.getfloat("target_fps")
+        self.preroll_seconds = settings.getfloat("preroll_seconds")
+        self.preroll_max_mb = settings.getfloat("preroll_max_mb")
+        self.preroll_quality = settings.getint("preroll_quality")
+        self.auto_record_var.set(settings.getboolean("auto_record"))
+        self.probe_timeout = settings.getfloat("probe_timeout_seconds")
+        self.scan_indices = settings.getint("scan_indices")
+        self.scan_urls = settings.get("scan_urls")
+        self.postprocess_chain = settings.get("postprocess_chain")
+        self.frame_bus_name = settings.get("frame_bus_name")
+        self.frame_bus_slots = settings.getint("frame_bus_slots")
+        self.settings = settings
 
+        if os.path.exists(self.settings_file):
             self.camera_source_entry.delete(0, tk.END)
-            self.camera_source_entry.insert(0, camera_source)
+            self.camera_source_entry.insert(0, settings.get("camera_source"))
 
             self.output_dir_entry.delete(0, tk.END)
-            self.output_dir_entry.insert(0, output_dir)
+            self.output_dir_entry.insert(0, settings.get("output_dir"))
         else:
             # If no file exists, create the default directory
-            default_dir = os.path.join(os.getcwd(), "videos")
+            default_dir = settings.get("output_dir")
             os.makedirs(default_dir, exist_ok=True)
             self.output_dir_entry.delete(0, tk.END)
             self.output_dir_entry.insert(0, default_dir)
 
     def save_settings(self):
         """Saves current settings from the UI to the config file."""
-        config = configparser.ConfigParser()
-        config['Settings'] = {
+        config_manager.save_settings(self.settings_file, {
             'camera_source': self.camera_source_entry.get(),
-            'output_dir': self.output_dir_entry.get()
-        }
-
-        # Ensure the directory exists before saving the file
-        os.makedirs(os.path.dirname(self.settings_file), exist_ok=True)
-
-        with open(self.settings_file, 'w') as configfile:
-            config.write(configfile)
+            'output_dir': self.output_dir_entry.get(),
+            'writer_queue_size': self.writer_queue_size,
+            'writer_drop_policy': self.writer_drop_policy,
+            'preview_fps': self.preview_fps,
+            'segment_seconds': self.segment_seconds,
+            'segment_mb': self.segment_mb,
+            'checkpoint_seconds': self.checkpoint_seconds,
+            'video_codec': self.video_codec,
+            'metrics_port': self.metrics_port,
+            'frame_timing': self.frame_timing,
+            'target_fps': self.target_fps,
+            'stream_buffer_size': self.settings.get("stream_buffer_size"),
+            'stream_low_latency': self.settings.get("stream_low_latency"),
+            'stream_grab_latest': self.settings.get("stream_grab_latest"),
+            'stream_timeout_ms': self.settings.get("stream_timeout_ms"),
+            'stream_reconnect_max_seconds': self.settings.get("stream_reconnect_max_seconds"),
+            'preroll_seconds': self.preroll_seconds,
+            'preroll_max_mb': self.preroll_max_mb,
+            'preroll_quality': self.preroll_quality,
+            'auto_record': "yes" if self.auto_record_var.get() else "no",
+            'trigger_mode': self.settings.get("trigger_mode"),
+            'motion_threshold': self.settings.get("motion_threshold"),
+            'scene_threshold': self.settings.get("scene_threshold"),
+            'trigger_hang_seconds': self.settings.get("trigger_hang_seconds"),
+            'trigger_fps': self.settings.get("trigger_fps"),
+            'probe_timeout_seconds': self.probe_timeout,
+            'scan_indices': self.scan_indices,
+            'scan_urls': self.scan_urls,
+            'postprocess_chain': self.postprocess_chain,
+            'frame_bus_name': self.frame_bus_name,
+            'frame_bus_slots': self.frame_bus_slots,
+            'storage_min_free_mb': self.settings.get("storage_min_free_mb"),
+            'storage_warn_minutes': self.settings.get("storage_warn_minutes"),
+            'secondary_output_dir': self.settings.get("secondary_output_dir"),
+            'storage_test_mb': self.settings.get("storage_test_mb"),
+            'write_behind_mb': self.settings.get("write_behind_mb"),
+            'write_behind_sync_mb': self.settings.get("write_behind_sync_mb")
+        })
 
     def on_close(self):
-        """Saves settings and then closes the application."""
-        self.save_settings()
+        """Saves settings, finishes any recording and then closes the application."""
+        if self.closing:
+            return
+        self.closing = True
+        # A benchmark run must not overwrite the user's settings with its camera source
+        if not self.startup_report.enabled:
+            self.save_settings()
         self.stop_camera()
-        self.stop_playback()
+        self.close_video()
+        if self.metrics_server:
+            self.metrics_server.stop()
         self.destroy()
 
     def create_left_panel(self):
@@ -163,6 +320,10 @@ class App(tk.Tk):
         self.video_label = ttk.Label(view_record_frame, text="Live Video Feed", relief="solid", background="black", foreground="white", anchor="center")
         self.video_label.grid(row=0, column=0, sticky=(tk.N, tk.S, tk.E, tk.W), padx=5, pady=5)
 
+        # Compact pipeline stats over the top-left corner of the video, shown while streaming
+        self.stats_overlay = tk.Label(self.video_label, justify=tk.LEFT, background="black", foreground="#7CFC00",
+                                      font=("Courier", 8))
+
         # Controls are now in a separate frame below the video frame
         control_frame = ttk.Frame(right_panel)
         control_frame.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=5)
@@ -179,6 +340,12 @@ class App(tk.Tk):
         self.record_duration_label = ttk.Label(control_frame, text="Duration: 00:00:00")
         self.record_duration_label.grid(row=0, column=2, padx=5, sticky=tk.E)
 
+        # Unattended collection: record while the trigger sees motion, one file per event
+        self.auto_record_var = tk.BooleanVar(value=False)
+        self.auto_record_check = ttk.Checkbutton(control_frame, text="Auto-record on motion",
+                                                 variable=self.auto_record_var, command=self.on_auto_record_toggled)
+        self.auto_record_check.grid(row=1, column=0, columnspan=2, padx=5, pady=(5, 0), sticky=tk.W)
+
     def create_setup_section(self, parent_frame):
         # Section Setup
         setup_frame = ttk.LabelFrame(parent_frame, text="1. Camera and Directory Setup", padding="10")
@@ -191,8 +358,12 @@ class App(tk.Tk):
         self.camera_source_entry.insert(0, "0")
 
         # Test Connection and Status
-        self.test_connection_button = ttk.Button(setup_frame, text="Test Connection")
-        self.test_connection_button.grid(row=1, column=0, padx=5, pady=5, sticky=tk.W)
+        test_frame = ttk.Frame(setup_frame)
+        test_frame.grid(row=1, column=0, padx=5, pady=5, sticky=tk.W)
+        self.test_connection_button = ttk.Button(test_frame, text="Test Connection")
+        self.test_connection_button.pack(side=tk.LEFT)
+        self.scan_button = ttk.Button(test_frame, text="Scan...")
+        self.scan_button.pack(side=tk.LEFT, padx=(5, 0))
         self.connection_status_label = ttk.Label(setup_frame, text="Status: Disconnected")
         self.connection_status_label.grid(row=1, column=1, sticky=tk.W, padx=5, pady=5)
 
@@ -248,6 +419,8 @@ class App(tk.Tk):
         open_video_frame.pack(fill=tk.X, pady=5)
         self.open_video_button = ttk.Button(open_video_frame, text="Open Video")
         self.open_video_button.pack(side=tk.LEFT, padx=5)
+        self.library_button = ttk.Button(open_video_frame, text="Library")
+        self.library_button.pack(side=tk.LEFT, padx=5)
 
         # Playback controls
         playback_frame = ttk.Frame(review_frame)
@@ -256,33 +429,94 @@ class App(tk.Tk):
         self.playback_button = ttk.Button(playback_frame, text="Play/Pause")
         self.playback_button.pack(side=tk.LEFT, padx=5)
 
+        self.step_back_button = ttk.Button(playback_frame, text="<", width=3)
+        self.step_back_button.pack(side=tk.LEFT, padx=2)
+
+        self.step_forward_button = ttk.Button(playback_frame, text=">", width=3)
+        self.step_forward_button.pack(side=tk.LEFT, padx=2)
+
+        self.speed_combobox = ttk.Combobox(playback_frame, values=["0.25x", "0.5x", "1x", "2x", "4x", "8x"],
+                                           width=6, state="readonly")
+        self.speed_combobox.set("1x")
+        self.speed_combobox.pack(side=tk.LEFT, padx=5)
+
         self.delete_video_button = ttk.Button(playback_frame, text="Delete Video")
         self.delete_video_button.pack(side=tk.LEFT, padx=5)
 
+        # Seek bar, positioned in frames
+        self.seek_bar = ttk.Scale(review_frame, from_=0, to=0, orient=tk.HORIZONTAL, command=self.on_seek_bar_moved)
+        self.seek_bar.pack(fill=tk.X, padx=5, pady=5)
+
+        # Jump to time
+        jump_frame = ttk.Frame(review_frame)
+        jump_frame.pack(fill=tk.X, pady=5)
+        ttk.Label(jump_frame, text="Go to (hh:mm:ss):").pack(side=tk.LEFT, padx=5)
+        self.jump_entry = ttk.Entry(jump_frame, width=10)
+        self.jump_entry.pack(side=tk.LEFT, padx=5)
+        self.jump_button = ttk.Button(jump_frame, text="Go", width=4)
+        self.jump_button.pack(side=tk.LEFT, padx=5)
+
         # Duration label
         self.playback_duration_label = ttk.Label(review_frame, text="Time: 00:00:00 / 00:00:00")
         self.playback_duration_label.pack(side=tk.LEFT, padx=5)
 
+    def probe_service(self):
+        from capture import stream_options_from_settings
+        from probe import ProbeService
+
+        return ProbeService(self.probe_timeout, stream_options_from_settings(self.settings))
+
     def test_camera_connection(self):
-        """Tests the connection to the camera source."""
-        source = self.camera_source_entry.get()
-        try:
-            # Check if source is a number (USB port) or a string (IP/Stream)
-            if source.isdigit():
-                source = int(source)
+        """Tests every camera source in parallel on worker threads, each with the probe timeout."""
+        from session import parse_sources
 
-            cap = cv2.VideoCapture(source)
-            if not cap.isOpened():
-                raise IOError("Cannot open camera source.")
+        # Each source is a number (USB port) or a string (IP/Stream)
+        sources = parse_sources(self.camera_source_entry.get())
+        if not sources:
+            messagebox.showerror("Connection Error", "No camera source specified.")
+            return
 
-            # Connection successful
-            self.connection_status_label.config(text="Status: Connected", foreground="green")
-            messagebox.showinfo("Connection Status", "Successfully connected to the camera.")
+        service = self.probe_service()
+        self.test_connection_button.config(state=tk.DISABLED)
+        self.connection_status_label.config(text="Status: Testing...", foreground="black")
+        self.run_in_background(lambda: service.probe_all(sources), self.on_connection_tested,
+                               self.on_connection_test_failed)
 
-            cap.release()
-        except Exception as e:
+    def on_connection_tested(self, results):
+        from probe import describe
+
+        self.test_connection_button.config(state=tk.NORMAL)
+        details = "\n".join(describe(result) for result in results)
+        if all(result.ok for result in results):
+            self.connection_status_label.config(text="Status: Connected", foreground="green")
+            messagebox.showinfo("Connection Status", f"Successfully connected to the camera.\n\n{details}")
+        else:
             self.connection_status_label.config(text="Status: Error", foreground="red")
-            messagebox.showerror("Connection Error", f"Failed to connect to camera.\n\nDetails: {e}")
+            messagebox.showerror("Connection Error", f"Failed to connect to camera.\n\n{details}")
+
+    def on_connection_test_failed(self, error):
+        self.test_connection_button.config(state=tk.NORMAL)
+        self.connection_status_label.config(text="Status: Error", foreground="red")
+        messagebox.showerror("Connection Error", f"Failed to connect to camera.\n\nDetails: {error}")
+
+    def scan_for_cameras(self):
+        """Lists which USB indices and configured stream URLs answer, with what they deliver."""
+        from scan_window import ScanWindow
+        from session import parse_sources
+
+        if self.scan_window is not None and self.scan_window.winfo_exists():
+            self.scan_window.lift()
+            return
+        urls = [source for source in parse_sources(self.scan_urls) if isinstance(source, str)]
+        self.scan_window = ScanWindow(self, self.probe_service(), self.scan_indices, urls, self.use_sources)
+
+    def use_sources(self, sources, append):
+        """Sets the camera source to the sources picked in the scan window, or adds them to it."""
+        current = self.camera_source_entry.get().strip()
+        if append and current:
+            sources = [current] + sources
+        self.camera_source_entry.delete(0, tk.END)
+        self.camera_source_entry.insert(0, ", ".join(sources))
 
     def toggle_camera(self):
         """Starts or stops the camera feed."""
@@ -292,19 +526,53 @@ class App(tk.Tk):
             self.start_camera()
 
     def start_camera(self):
-        """Starts the camera feed using the after() method."""
-        source = self.camera_source_entry.get()
+        """Opens the sources on a worker thread; on_camera_started() then begins the preview."""
+        from capture import stream_options_from_settings
+        from session import CaptureSession, parse_sources
+
         try:
-            if source.isdigit():
-                source = int(source)
+            sources = parse_sources(self.camera_source_entry.get())
+            if not sources:
+                raise IOError("No camera source specified.")
+
+            # MJPEG cameras are captured undecoded when recording with the mjpeg codec
+            session = CaptureSession(sources, width=1280, height=720,
+                                     mjpeg_passthrough=self.video_codec == "mjpeg",
+                                     stream_options=stream_options_from_settings(self.settings))
+        except Exception as e:
+            messagebox.showerror("Camera Error", f"Failed to start camera feed.\n\nDetails: {e}")
+            return
 
-            self.camera = cv2.VideoCapture(source)
+        # Opening a camera can take seconds, so the window stays responsive meanwhile
+        self.pending_session = session
+        self.start_stop_camera_button.config(state=tk.DISABLED)
+        self.connection_status_label.config(text="Status: Connecting...", foreground="black")
+        self.run_in_background(session.start, lambda result: self.on_camera_started(session),
+                               lambda error: self.on_camera_start_failed(session, error))
 
-            self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-            self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
+    def on_camera_started(self, session):
+        """Starts the after() preview loop once every source is open."""
+        from preview import MosaicComposer
 
-            if not self.camera.isOpened():
-                raise IOError("Cannot open camera source.")
+        if session is not self.pending_session:
+            # The camera was stopped while its sources were opening
+            session.stop()
+            return
+        self.pending_session = None
+        self.start_stop_camera_button.config(state=tk.NORMAL)
+
+        try:
+            self.session = session
+            self.preview_consumers = self.session.preview_consumers()
+            if self.preroll_seconds:
+                # Buffer the last seconds so a recording can start before Record was pressed
+                self.session.start_preroll(self.preroll_seconds, self.preroll_max_mb, self.preroll_quality)
+            if self.auto_record_var.get():
+                self.start_trigger()
+            if self.frame_bus_name:
+                self.start_frame_bus()
+            self.measure_storage()
+            self.mosaic = MosaicComposer(len(session.engines)) if len(session.engines) > 1 else None
 
             self.is_camera_on = True
             self.start_stop_camera_button.config(text="Stop Camera")
@@ -312,6 +580,7 @@ class App(tk.Tk):
 
             # Force the label to update its size before the update loop begins
             self.video_label.update()
+            self.stats_overlay.place(x=4, y=4)
 
             # Start the frame update loop
             self.update_video_feed()
@@ -320,12 +589,30 @@ class App(tk.Tk):
             messagebox.showerror("Camera Error", f"Failed to start camera feed.\n\nDetails: {e}")
             self.stop_camera()
 
+    def on_camera_start_failed(self, session, error):
+        if session is not self.pending_session:
+            return
+        self.pending_session = None
+        self.start_stop_camera_button.config(state=tk.NORMAL)
+        self.connection_status_label.config(text="Status: Error", foreground="red")
+        messagebox.showerror("Camera Error", f"Failed to start camera feed.\n\nDetails: {error}")
+
     def stop_camera(self):
-        """Stops the camera feed."""
-        if self.camera and self.camera.isOpened():
-            self.camera.release()
+        """Stops the camera feed, finishing any recording first."""
+        if self.pending_session:
+            # Still opening; on_camera_started() releases it
+            self.pending_session = None
+            self.start_stop_camera_button.config(state=tk.NORMAL)
+            self.connection_status_label.config(text="Status: Disconnected", foreground="black")
+
+        if self.is_recording:
+            self.stop_recording()
+
+        if self.session and self.session.is_running:
+            self.session.stop()
             self.is_camera_on = False
-            self.video_label.config(image='', text="Live Video Feed", background="black")
+            self.preview.clear(text="Live Video Feed", background="black")
+            self.stats_overlay.place_forget()
             self.start_stop_camera_button.config(text="Start Camera")
             self.connection_status_label.config(text="Status: Disconnected", foreground="black")
 
@@ -335,38 +622,35 @@ class App(tk.Tk):
             self.frame_update_id = None
 
     def update_video_feed(self):
-        """Reads frames from the camera, scales them to fit the display, and updates the label."""
-        if self.is_camera_on and self.camera:
-            ret, frame = self.camera.read()
-            if ret:
-                if self.is_recording and self.video_writer:
-                    self.video_writer.write(frame)
-
-                label_width = self.video_label.winfo_width()
-                label_height = self.video_label.winfo_height()
-
-                if label_width > 1 and label_height > 1:
-                    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    frame_height, frame_width, _ = rgb_frame.shape
-
-                    scale_w = label_width / frame_width
-                    scale_h = label_height / frame_height
-                    scale = min(scale_w, scale_h)
-
-                    new_w = int(frame_width * scale)
-                    new_h = int(frame_height * scale)
-                    resized_frame = cv2.resize(rgb_frame, (new_w, new_h), interpolation=cv2.INTER_AREA)
-
-                    bg = Image.new('RGB', (label_width, label_height), 'black')
-                    x_offset = (label_width - new_w) // 2
-                    y_offset = (label_height - new_h) // 2
-                    bg.paste(Image.fromarray(resized_frame), (x_offset, y_offset))
+        """Shows the newest captured frame(s) at the preview rate. Recording happens on its own threads."""
+        if self.is_camera_on and self.session:
+            updated = False
+            if self.mosaic is None:
+                captured = self.preview_consumers[0].read(timeout=0)
+                if captured is not None:
+                    self.display_frame(captured.image)
+                    updated = True
+            else:
+                for index, consumer in enumerate(self.preview_consumers):
+                    captured = consumer.read(timeout=0)
+                    if captured is not None:
+                        self.mosaic.update(index, captured.image)
+                        updated = True
+                if updated:
+                    self.display_frame(self.mosaic.mosaic)
+
+            if self.session.trigger:
+                self.follow_trigger()
+
+            if updated and self.startup_report.mark("first_frame"):
+                self.after_idle(self.on_close)
+                return
 
-                    imgtk = ImageTk.PhotoImage(image=bg)
-                    self.video_label.imgtk = imgtk
-                    self.video_label.config(image=imgtk)
+            if time.monotonic() - self.stats_update_time >= 1.0:
+                self.stats_overlay.config(text=format_stats(self.session.stream_metrics(), self.preview))
+                self.stats_update_time = time.monotonic()
 
-            self.frame_update_id = self.after(10, self.update_video_feed)
+            self.frame_update_id = self.after(self.preview.interval_ms, self.update_video_feed)
 
     def browse_output_directory(self):
         # We will implement the functionality for this button in the next step
@@ -384,52 +668,54 @@ class App(tk.Tk):
 
         if self.is_recording:
             # Stop recording
-            self.stop_recording()
-        else:
-            # Start recording
-            self.start_recording()
+            if self.recording_by_trigger:
+                # Otherwise the trigger would start the next recording right away
+                self.auto_record_var.set(False)
+                self.on_auto_record_toggled()
+            else:
+                self.stop_recording()
+        elif self.start_recording() and self.session.storage_check.problems:
+            # Someone pressed Record, so there is someone to tell before the disk lets them down
+            messagebox.showwarning("Storage", "\n\n".join(self.session.storage_check.problems))
 
     def start_recording(self):
-        """Initializes the video writer and starts the recording."""
+        """Initializes the video writer and starts the recording. Returns False if it could not start."""
+        from storage import storage_options_from_settings
+
         # Check for required fields
         output_dir = self.output_dir_entry.get()
         video_name = self.video_name_entry.get()
 
         if not output_dir or not video_name:
             messagebox.showerror("Recording Error", "Please specify an output directory and video name.")
-            return
-
-        # Ensure the output directory exists
-        os.makedirs(output_dir, exist_ok=True)
-
-        # Get frame properties from the camera
-        width = int(self.camera.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(self.camera.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = self.camera.get(cv2.CAP_PROP_FPS)
-        if fps == 0:
-            fps = 30 # Default to 30 FPS if camera returns 0
+            return False
 
-        # Create a unique filename with a timestamp and camelCase format
-        current_time = datetime.now().strftime("%Y%m%d%H%M%S")
-        final_filename = f"{video_name.replace(' ', '')}{current_time}.avi"
-        output_path = os.path.join(output_dir, final_filename)
-
-        # Define the codec and create a VideoWriter object
-        fourcc = cv2.VideoWriter_fourcc(*'XVID')
-        self.video_writer = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+        try:
+            # One file per source, sharing a timestamp; encoding runs on worker threads
+            # so a slow encoder never stalls capture or the UI
+            self.session.start_recording(output_dir, video_name, self.writer_queue_size, self.writer_drop_policy,
+                                         segment_seconds=self.segment_seconds, segment_mb=self.segment_mb,
+                                         codec=self.video_codec, frame_timing=self.frame_timing,
+                                         target_fps=self.target_fps, checkpoint_seconds=self.checkpoint_seconds,
+                                         storage=storage_options_from_settings(self.settings))
+        except ValueError as e:
+            messagebox.showerror("Recording Error", f"Invalid recording settings.\n\nDetails: {e}")
+            return False
+        except IOError as e:
+            messagebox.showerror("Recording Error", f"Could not create the video file.\n\nDetails: {e}")
+            return False
 
         self.is_recording = True
         self.record_button.config(text="Stop Recording")
 
         # Start the timer for recording duration
-        self.start_time = time.time()
         self.update_duration_label()
+        return True
 
     def stop_recording(self):
-        """Releases the video writer and stops the timer."""
-        if self.video_writer:
-            self.video_writer.release()
-            self.video_writer = None
+        """Flushes and releases the video writer and stops the timer."""
+        stats = self.session.stop_recording()
+        triggered, self.recording_by_trigger = self.recording_by_trigger, False
 
         self.is_recording = False
         self.record_button.config(text="Start Recording")
@@ -439,17 +725,97 @@ class App(tk.Tk):
             self.recording_timer = None
 
         self.record_duration_label.config(text="Duration: 00:00:00")
-        messagebox.showinfo("Recording Finished", "Video saved successfully!")
+        if self.storage_message:
+            self.storage_message = ""
+            self.connection_status_label.config(text="Status: Streaming", foreground="blue")
+        if triggered or self.closing:
+            # Unattended: report in the status line rather than wait for someone to click OK
+            self.connection_status_label.config(
+                text=f"Status: Event saved ({stats.frames_written} frames, {stats.frames_dropped} dropped)",
+                foreground="blue")
+            return
+        message = f"Video saved successfully!\n\nFrames written: {stats.frames_written}\nFrames dropped: {stats.frames_dropped}"
+        if self.session.unmeasured_streams:
+            message += "\n\nToo few frames to measure the frame rate: written at the camera's nominal rate."
+        messagebox.showinfo("Recording Finished", message)
+
+    def on_auto_record_toggled(self):
+        """Starts or stops watching for motion while the camera is on."""
+        if not self.is_camera_on:
+            return
+        if self.auto_record_var.get():
+            self.start_trigger()
+        else:
+            self.session.stop_trigger()
+            if self.recording_by_trigger:
+                self.stop_recording()
+            self.connection_status_label.config(text="Status: Streaming", foreground="blue")
+
+    def start_frame_bus(self):
+        """Shares the live frames with labeling and inference tools running alongside (framebus.py)."""
+        try:
+            self.session.start_frame_bus(self.frame_bus_name, self.frame_bus_slots)
+        except OSError as e:
+            messagebox.showwarning("Frame Bus", f"Could not share the frames as {self.frame_bus_name}.\n\nDetails: {e}")
+
+    def start_trigger(self):
+        from trigger import trigger_options_from_settings
+
+        try:
+            self.session.start_trigger(trigger_options_from_settings(self.settings))
+        except ValueError as e:
+            self.auto_record_var.set(False)
+            messagebox.showerror("Auto-record Error", f"Invalid trigger settings.\n\nDetails: {e}")
+            return
+        self.connection_status_label.config(text="Status: Waiting for motion", foreground="blue")
+
+    def follow_trigger(self):
+        """Starts a recording when the trigger becomes active and stops it once it is not."""
+        if self.is_recording:
+            if self.recording_by_trigger and not self.session.trigger.active:
+                self.stop_recording()
+        elif self.session.trigger.active:
+            if self.start_recording():
+                self.recording_by_trigger = True
+                self.connection_status_label.config(text="Status: Recording event", foreground="red")
+            else:
+                # The error was shown once; do not repeat it for every frame of the event
+                self.auto_record_var.set(False)
+                self.session.stop_trigger()
 
     def update_duration_label(self):
-        """Updates the duration label every second."""
+        """Updates the duration label every second with the media time actually recorded."""
         if self.is_recording:
-            elapsed_time = int(time.time() - self.start_time)
-            minutes, seconds = divmod(elapsed_time, 60)
-            hours, minutes = divmod(minutes, 60)
-            self.record_duration_label.config(text=f"Duration: {hours:02d}:{minutes:02d}:{seconds:02d}")
+            self.record_duration_label.config(text=f"Duration: {format_time(self.session.recorded_seconds)}")
+            self.show_storage_status()
             self.recording_timer = self.after(1000, self.update_duration_label)
 
+    def show_storage_status(self):
+        """Shows the storage guard's warning, if any, in the status line."""
+        status = self.session.storage_status
+        message = status.message if status else ""
+        if message == self.storage_message:
+            return
+        self.storage_message = message
+        if message:
+            self.connection_status_label.config(text=f"Status: {message}",
+                                                foreground="red" if status.level == "critical" else "orange")
+        else:
+            self.connection_status_label.config(
+                text="Status: Recording event" if self.recording_by_trigger else "Status: Streaming",
+                foreground="red" if self.recording_by_trigger else "blue")
+
+    def measure_storage(self):
+        """Measures the output directory's write speed in the background, for the checks before recording."""
+        from storage import cached_write_rate, measure_write_rate
+
+        output_dir = self.output_dir_entry.get()
+        test_mb = self.settings.getfloat("storage_test_mb")
+        if not output_dir or not test_mb or self.startup_report.enabled or cached_write_rate(output_dir) is not None:
+            return
+        # A disk that cannot be measured is only checked for space
+        self.run_in_background(lambda: measure_write_rate(output_dir, test_mb), lambda rate: None, lambda error: None)
+
     # Playback and delete related methods
     def browse_and_open_video(self):
         """Opens a file dialog for the user to select a video file."""
@@ -460,25 +826,63 @@ class App(tk.Tk):
         file_path = filedialog.askopenfilename(
             initialdir=self.output_dir_entry.get(),
             title="Select a video file",
-            filetypes=(("AVI files", "*.avi"), ("All files", "*.*"))
+            filetypes=(("Video files", "*.avi *.mkv *.mp4"), ("All files", "*.*"))
         )
         if file_path:
-            self.current_video_path = file_path
-            self.playback_button.config(text="Play")
-            self.playback_duration_label.config(text="Time: 00:00:00 / 00:00:00")
+            self.open_video(file_path)
 
-            # Display a placeholder image for the selected video
-            try:
-                temp_cap = cv2.VideoCapture(file_path)
-                ret, frame = temp_cap.read()
-                temp_cap.release()
+    def open_video(self, file_path):
+        """Loads a recording into the review section, replacing any open video."""
+        self.stop_camera()
+        self.close_video()
+        self.current_video_path = file_path
+        self.playback_button.config(text="Play")
+        self.playback_duration_label.config(text="Time: indexing...")
 
-                if ret:
-                    self.display_frame(frame)
+        from frame_index import FrameSeeker
 
-            except Exception as e:
-                messagebox.showerror("File Error", f"Could not load video file: {e}")
-                self.video_label.config(text="Live Video Feed")
+        # The frame index is built (or loaded from its cache) off the Tk thread
+        self.run_in_background(lambda: FrameSeeker(file_path),
+                               lambda seeker: self.on_video_opened(file_path, seeker),
+                               self.on_video_open_failed)
+
+    def open_library(self):
+        """Shows the recordings in the output directory with their thumbnails."""
+        from library_window import LibraryWindow
+
+        output_dir = self.output_dir_entry.get()
+        if not os.path.isdir(output_dir):
+            messagebox.showerror("Error", "Output directory does not exist.")
+            return
+        if self.library_window is not None and self.library_window.winfo_exists():
+            self.library_window.destroy()
+        self.library_window = LibraryWindow(self, output_dir, self.open_video, self.postprocess_chain, self.video_codec)
+
+    def on_video_opened(self, file_path, seeker):
+        """Shows the first frame of a newly opened video and sizes the seek bar."""
+        if file_path != self.current_video_path:
+            # Another video was opened while this one was indexing
+            seeker.release()
+            return
+
+        self.playback = PlaybackEngine(seeker)
+        self.playback.set_speed(float(self.speed_combobox.get().rstrip("x")))
+        self.seek_bar.config(to=max(seeker.frame_count - 1, 0))
+        self.show_playback_frame(0)
+
+    def on_video_open_failed(self, error):
+        messagebox.showerror("File Error", f"Could not load video file: {error}")
+        self.current_video_path = None
+        self.playback_duration_label.config(text="Time: 00:00:00 / 00:00:00")
+        self.preview.clear(text="Live Video Feed")
+
+    def close_video(self):
+        """Releases the open video, if any."""
+        self.stop_playback()
+        if self.playback:
+            self.playback.close()
+            self.playback = None
+        self.seek_bar.config(to=0)
 
     def toggle_playback(self):
         """Starts or pauses the video playback."""
@@ -492,83 +896,101 @@ class App(tk.Tk):
             self.start_playback()
 
     def start_playback(self):
-        """Starts the video playback."""
-        self.playback_cap = cv2.VideoCapture(self.current_video_path)
-        if not self.playback_cap.isOpened():
-            messagebox.showerror("Playback Error", "Could not open video file.")
-            self.stop_playback()
+        """Plays the video from the current position."""
+        if not self.playback:
+            # Still indexing
             return
 
+        # Start over when the end was reached
+        if self.playback.finished or self.playback.current_frame >= self.playback.index.frame_count - 1:
+            self.playback.seek(0)
+
         self.is_playing = True
         self.playback_button.config(text="Pause")
-
-        total_frames = int(self.playback_cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        self.fps = self.playback_cap.get(cv2.CAP_PROP_FPS)
-        self.total_duration_seconds = int(total_frames / self.fps)
-        
+        self.playback.play()
         self.update_playback_feed()
 
     def update_playback_feed(self):
-        """The loop that reads frames from the video and updates the UI."""
-        if self.is_playing and self.playback_cap.isOpened():
-            ret, frame = self.playback_cap.read()
-            if not ret:
+        """Shows whichever decoded frame is due now; decoding and pacing happen in the PlaybackEngine."""
+        if self.is_playing and self.playback:
+            if self.playback.finished:
                 self.stop_playback()
                 return
 
-            self.display_frame(frame)
+            decoded = self.playback.next_frame()
+            if decoded is not None:
+                self.display_frame(decoded.image)
+                self.update_playback_position(decoded.frame_number)
 
-            # Update playback duration label
-            current_frame = self.playback_cap.get(cv2.CAP_PROP_POS_FRAMES)
-            current_time_seconds = int(current_frame / self.fps)
-            
-            minutes, seconds = divmod(current_time_seconds, 60)
-            hours, minutes = divmod(minutes, 60)
-            
-            total_minutes, total_seconds = divmod(self.total_duration_seconds, 60)
-            total_hours, total_minutes = divmod(total_minutes, 60)
-
-            self.playback_duration_label.config(text=f"Time: {hours:02d}:{minutes:02d}:{seconds:02d} / {total_hours:02d}:{total_minutes:02d}:{total_seconds:02d}")
-
-            # Schedule the next frame update
-            self.after(int(1000 / self.fps), self.update_playback_feed)
-
-    def playback_loop(self):
-        """The loop that reads frames from the video and updates the UI."""
-        while self.playback_thread_running and self.playback_cap.isOpened():
-            ret, frame = self.playback_cap.read()
-            if not ret:
-                # End of video file, set the flag and break
-                self.playback_thread_running = False
-                self.after(10, self.stop_playback) # Schedule the cleanup on the main thread
-                break
+            # Poll at twice the presentation rate; late frames are skipped by the engine
+            frame_period_ms = 1000 / (self.playback.index.fps * self.playback.speed)
+            self.playback_update_id = self.after(max(5, int(frame_period_ms / 2)), self.update_playback_feed)
 
+    def show_playback_frame(self, frame_number):
+        """Displays exactly frame_number of the open video."""
+        frame = self.playback.frame_at(frame_number)
+        if frame is not None:
             self.display_frame(frame)
+            self.update_playback_position(self.playback.current_frame)
 
-            # Update playback duration label
-            current_frame = self.playback_cap.get(cv2.CAP_PROP_POS_FRAMES)
-            fps = self.playback_cap.get(cv2.CAP_PROP_FPS)
-            current_time_seconds = int(current_frame / fps)
+    def update_playback_position(self, frame_number):
+        """Updates the time label and seek bar for the frame on screen."""
+        index = self.playback.index
+        current = format_time(frame_number / index.fps)
+        total = format_time(index.duration)
+        self.playback_duration_label.config(text=f"Time: {current} / {total}")
 
-            minutes, seconds = divmod(current_time_seconds, 60)
-            hours, minutes = divmod(minutes, 60)
+        self.updating_seek_bar = True
+        self.seek_bar.set(frame_number)
+        self.updating_seek_bar = False
 
-            total_minutes, total_seconds = divmod(self.total_duration_seconds, 60)
-            total_hours, total_minutes = divmod(total_minutes, 60)
+    def go_to_frame(self, frame_number):
+        """Moves playback to frame_number, showing it right away when paused."""
+        if self.is_playing:
+            self.playback.seek(frame_number)
+        else:
+            self.show_playback_frame(frame_number)
 
-            self.playback_duration_label.config(text=f"Time: {hours:02d}:{minutes:02d}:{seconds:02d} / {total_hours:02d}:{total_minutes:02d}:{total_seconds:02d}")
+    def on_seek_bar_moved(self, value):
+        if self.updating_seek_bar or not self.playback:
+            return
+        self.go_to_frame(int(float(value)))
 
-            # Wait for a short duration to control playback speed
-            time.sleep(1 / fps)
+    def on_speed_selected(self, event=None):
+        if self.playback:
+            self.playback.set_speed(float(self.speed_combobox.get().rstrip("x")))
+
+    def step_playback(self, frames):
+        """Pauses and moves a number of frames forward or back."""
+        if not self.playback:
+            return
+        self.stop_playback()
+        self.show_playback_frame(self.playback.current_frame + frames)
+
+    def jump_to_time(self):
+        """Shows the frame at the time typed into the jump entry (hh:mm:ss, mm:ss or seconds)."""
+        if not self.playback:
+            return
+        try:
+            seconds = 0.0
+            for part in self.jump_entry.get().strip().split(":"):
+                seconds = seconds * 60 + float(part)
+        except ValueError:
+            messagebox.showerror("Playback Error", "Please enter a time as hh:mm:ss.")
+            return
+        self.go_to_frame(self.playback.index.frame_at_time(seconds))
 
     def stop_playback(self):
-        """Stops the video playback and releases the video capture object."""
+        """Pauses the video playback, keeping the current position."""
         self.is_playing = False
         self.playback_button.config(text="Play")
+        if self.playback:
+            self.playback.pause()
 
-        if self.playback_cap:
-            self.playback_cap.release()
-            self.playback_cap = None
+        # Cancel the scheduled update
+        if self.playback_update_id:
+            self.after_cancel(self.playback_update_id)
+            self.playback_update_id = None
 
     def delete_video(self):
         """Deletes the currently open video file."""
@@ -577,44 +999,97 @@ class App(tk.Tk):
             return
 
         if messagebox.askyesno("Delete Video", f"Are you sure you want to delete {os.path.basename(self.current_video_path)}?"):
-            self.stop_playback()
+            self.close_video()
             os.remove(self.current_video_path)
             self.current_video_path = None
-            self.video_label.config(image='', text="Live Video Feed")
+            self.preview.clear(text="Live Video Feed")
             self.playback_duration_label.config(text="Time: 00:00:00 / 00:00:00")
             messagebox.showinfo("Success", "Video file deleted.")
 
+    def run_in_background(self, work, on_done, on_error):
+        """Runs work() on a worker thread and hands its result (or exception) back on the Tk thread."""
+        result = {}
+
+        def worker():
+            try:
+                result["value"] = work()
+            except Exception as e:
+                result["error"] = e
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+
+        def poll():
+            if thread.is_alive():
+                self.after(50, poll)
+            elif "error" in result:
+                on_error(result["error"])
+            else:
+                on_done(result["value"])
+        poll()
+
+    def start_metrics_server(self):
+        """Serves pipeline metrics for Prometheus when metrics_port is set."""
+        from metrics import MetricsServer
+
+        if not self.metrics_port:
+            return
+        try:
+            self.metrics_server = MetricsServer(self.metrics_port, self.collect_metrics)
+            self.metrics_server.start()
+        except OSError as e:
+            messagebox.showwarning("Metrics", f"Could not serve metrics on port {self.metrics_port}.\n\nDetails: {e}")
+
+    def collect_metrics(self):
+        """Runs on the metrics server thread; only reads counters and histograms."""
+        from metrics import prometheus_text
+
+        session = self.session
+        series = session.metrics_series() if session and session.is_running else []
+        series.append(({}, {"render": self.preview.render_times}, {"preview_fps": self.preview.current_fps}))
+        return prometheus_text(series)
+
     def display_frame(self, frame):
         """Helper method to display a single frame in the video label."""
-        label_width = self.video_label.winfo_width()
-        label_height = self.video_label.winfo_height()
+        self.preview.render(frame)
 
-        if label_width > 1 and label_height > 1:
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            frame_height, frame_width, _ = rgb_frame.shape
+    def offer_recovery(self):
+        """Offers to repair the recordings a crash or power loss cut short in the output directory."""
+        import recovery
 
-            scale_w = label_width / frame_width
-            scale_h = label_height / frame_height
-            scale = min(scale_w, scale_h)
+        output_dir = self.output_dir_entry.get()
+        journals = recovery.find_interrupted(output_dir) if os.path.isdir(output_dir) else []
+        if not journals or self.startup_report.enabled:
+            return
+        if not messagebox.askyesno("Interrupted Recordings",
+                                   f"{len(journals)} recording(s) in {output_dir} were cut short and cannot be "
+                                   "played as they are.\n\nRepair them now?"):
+            return
+        self.connection_status_label.config(text="Status: Repairing recordings...")
+        self.run_in_background(lambda: [line for journal in journals
+                                        for line in recovery.describe(recovery.recover(journal))],
+                               self.on_recovered, self.on_recovery_failed)
 
-            new_w = int(frame_width * scale)
-            new_h = int(frame_height * scale)
-            resized_frame = cv2.resize(rgb_frame, (new_w, new_h), interpolation=cv2.INTER_AREA)
+    def on_recovered(self, lines):
+        self.connection_status_label.config(text="Status: Disconnected")
+        messagebox.showinfo("Interrupted Recordings", "\n".join(lines))
 
-            bg = Image.new('RGB', (label_width, label_height), 'black')
-            x_offset = (label_width - new_w) // 2
-            y_offset = (label_height - new_h) // 2
-            bg.paste(Image.fromarray(resized_frame), (x_offset, y_offset))
+    def on_recovery_failed(self, error):
+        self.connection_status_label.config(text="Status: Disconnected")
+        messagebox.showerror("Interrupted Recordings", f"Could not repair the recordings.\n\nDetails: {error}")
 
-            imgtk = ImageTk.PhotoImage(image=bg)
-            self.video_label.imgtk = imgtk
-            self.video_label.config(image=imgtk)
+    def poll_signals(self):
+        # Python only runs signal handlers between bytecodes, never while Tk waits for events
+        self.after(250, self.poll_signals)
 
     def handle_signal(self, signum, frame):
         """Handle signals like Ctrl-C to ensure a clean shutdown."""
-        print("\nCtrl-C detected. Shutting down gracefully...")
-        self.on_close()
+        print("\nSignal received. Shutting down gracefully...")
+        # Close from the event loop, not from inside whatever the handler interrupted
+        self.after_idle(self.on_close)
 
 if __name__ == "__main__":
+    # In a frozen build, the library's worker processes start this executable; let them work
+    freeze_support()
     app = App()
     app.mainloop()
\ No newline at end of file
@@ -0,0 +1,157 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# Upper bounds in seconds of the cumulative buckets exported to Prometheus
+DEFAULT_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.033, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+METRIC_PREFIX = "video_capture"
+
+
+class StageHistogram:
+    """Timings of one pipeline stage, e.g. camera reads or encoder writes.
+
+    Keeps cumulative bucket counts for export and the last `window` observations for
+    percentiles and the event rate, which for camera reads is the real capture fps.
+    observe() is a few microseconds, so it is safe to call on every frame.
+    """
+
+    def __init__(self, window=300, buckets=DEFAULT_BUCKETS):
+        self.window = window
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)  # The last bucket is +Inf
+        self.count = 0
+        self.total = 0.0
+
+        self._durations = np.zeros(window)
+        self._times = np.zeros(window)
+        self._lock = threading.Lock()
+
+    def observe(self, duration, now=None):
+        """Records one event that took `duration` seconds and finished at monotonic time `now`."""
+        now = time.monotonic() if now is None else now
+        bucket = bisect.bisect_left(self.buckets, duration)
+        with self._lock:
+            self.bucket_counts[bucket] += 1
+            slot = self.count % self.window
+            self._durations[slot] = duration
+            self._times[slot] = now
+            self.count += 1
+            self.total += duration
+
+    def snapshot(self):
+        """Summary of the rolling window: rate per second and timings in milliseconds."""
+        with self._lock:
+            n = min(self.count, self.window)
+            durations = self._durations[:n].copy()
+            times = self._times[:n].copy()
+            count = self.count
+        if n == 0:
+            return {"count": 0, "rate": 0.0, "mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+
+        span = times.max() - times.min()
+        p50, p95 = np.percentile(durations, (50, 95)) * 1000
+        return {
+            "count": count,
+            "rate": (n - 1) / span if span > 0 else 0.0,
+            "mean_ms": float(durations.mean() * 1000),
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "max_ms": float(durations.max() * 1000),
+        }
+
+    def cumulative_buckets(self):
+        """[(upper bound, events at or below it)], ending with +Inf, as Prometheus expects."""
+        with self._lock:
+            counts = list(self.bucket_counts)
+        running, result = 0, []
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            running += count
+            result.append((bound, running))
+        return result
+
+
+def prometheus_text(series):
+    """Renders metrics in the Prometheus text exposition format.
+
+    series is a list of (labels, histograms, values): labels a dict, histograms a dict of
+    stage name -> StageHistogram, and values a dict of metric name -> number.
+    """
+    lines = [f"# TYPE {METRIC_PREFIX}_stage_seconds histogram"]
+    values_seen = {}
+    for labels, histograms, values in series:
+        for stage, histogram in histograms.items():
+            stage_labels = _format_labels(dict(labels, stage=stage))
+            for bound, count in histogram.cumulative_buckets():
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                bucket_labels = _format_labels(dict(labels, stage=stage, le=le))
+                lines.append(f"{METRIC_PREFIX}_stage_seconds_bucket{bucket_labels} {count}")
+            lines.append(f"{METRIC_PREFIX}_stage_seconds_sum{stage_labels} {histogram.total:.6f}")
+            lines.append(f"{METRIC_PREFIX}_stage_seconds_count{stage_labels} {histogram.count}")
+        for name, value in values.items():
+            values_seen.setdefault(name, []).append(f"{METRIC_PREFIX}_{name}{_format_labels(labels)} {value:g}")
+
+    for name, samples in values_seen.items():
+        kind = "counter" if name.endswith("_total") else "gauge"
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.collect().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # A scrape every few seconds would flood the console
+        pass
+
+
+class MetricsServer:
+    """Serves prometheus_text() output on http://host:port/metrics from a daemon thread.
+
+    `collect` is called for every scrape and returns the text; it runs on the server
+    thread, so it must only read state that is safe to read from there.
+    """
+
+    def __init__(self, port, collect, host="127.0.0.1"):
+        self.server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.collect = collect
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
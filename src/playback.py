@@ -0,0 +1,189 @@
+import threading
+import time
+from collections import deque, namedtuple
+
+# A decoded frame ready to be shown: its number in the video and its pixels
+DecodedFrame = namedtuple("DecodedFrame", ["frame_number", "image"])
+
+
+class PlaybackEngine:
+    """Decodes a video ahead of time on a worker thread and paces it against the wall clock.
+
+    The Tk loop polls next_frame(), which returns the newest frame whose presentation time
+    has come and discards any older ones it skipped over. When decoding itself falls behind
+    (e.g. at 8x), the decoder skips frames that are already late instead of converting them.
+    """
+
+    MIN_SPEED = 0.25
+    MAX_SPEED = 8.0
+
+    def __init__(self, seeker, buffer_size=8):
+        self.seeker = seeker
+        self.index = seeker.index
+        self.buffer_size = buffer_size
+
+        self.speed = 1.0
+        self.is_playing = False
+        self.current_frame = 0  # Frame number last handed to the UI
+        self.dropped = 0        # Frames skipped because they were late
+
+        self._buffer = deque()
+        self._free = []          # Recycled frame arrays
+        self._shown = None       # Frame the UI is showing; recycled on the next call
+        self._at_end = False
+        self._closed = False
+        self._pending_seek = None
+        self._generation = 0     # Bumped on every seek so stale decoded frames are discarded
+        self._clock = (time.monotonic(), 0.0)  # (wall time, media time) pair playback is anchored to
+
+        self._cond = threading.Condition()
+        self._decode_lock = threading.Lock()  # Held while the seeker is in use
+        self._thread = threading.Thread(target=self._decode_loop, name="playback", daemon=True)
+        self._thread.start()
+
+    @property
+    def finished(self):
+        """True once every frame up to the end has been shown."""
+        with self._cond:
+            return self._at_end and not self._buffer and self._pending_seek is None
+
+    def play(self):
+        with self._cond:
+            start = self._buffer[0].frame_number if self._buffer else self.seeker.position
+            self._anchor(start)
+            self.is_playing = True
+            self._cond.notify_all()
+
+    def pause(self):
+        with self._cond:
+            self.is_playing = False
+
+    def set_speed(self, speed):
+        """Changes the playback rate, clamped to 0.25x-8x, without jumping."""
+        with self._cond:
+            self.speed = min(max(speed, self.MIN_SPEED), self.MAX_SPEED)
+            self._anchor(self.current_frame)
+
+    def seek(self, frame_number):
+        """Continues playback from frame_number; the decoder repositions asynchronously."""
+        frame_number = self._clamp(frame_number)
+        with self._cond:
+            self._flush()
+            self._pending_seek = frame_number
+            self._anchor(frame_number)
+            self._cond.notify_all()
+
+    def frame_at(self, frame_number):
+        """Decodes and returns one frame synchronously, e.g. to show it while paused."""
+        frame_number = self._clamp(frame_number)
+        with self._cond:
+            self._flush()
+            self._pending_seek = None
+        with self._decode_lock:
+            image = self.seeker.frame_at(frame_number)
+        with self._cond:
+            # The decoder may have taken the lock first and buffered a frame from the old
+            # position under the new generation; drop whatever it buffered meanwhile
+            self._flush()
+            self.current_frame = frame_number
+            self._anchor(frame_number)
+            self._cond.notify_all()
+        return image
+
+    def next_frame(self, now=None):
+        """Returns the DecodedFrame due at `now`, or None if the shown frame is still current."""
+        now = time.monotonic() if now is None else now
+        with self._cond:
+            if not self.is_playing:
+                return None
+
+            chosen = None
+            while self._buffer and self._due(self._buffer[0].frame_number) <= now:
+                if chosen is not None:
+                    self.dropped += 1
+                    self._free.append(chosen.image)
+                chosen = self._buffer.popleft()
+
+            if chosen is None:
+                return None
+            if self._shown is not None:
+                self._free.append(self._shown.image)
+            self._shown = chosen
+            self.current_frame = chosen.frame_number
+            self._cond.notify_all()
+            return chosen
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.seeker.release()
+
+    def _clamp(self, frame_number):
+        return int(min(max(frame_number, 0), max(self.index.frame_count - 1, 0)))
+
+    def _media_time(self, frame_number):
+        frame_number = min(frame_number, self.index.frame_count - 1)
+        return self.index.timestamps_ms[frame_number] / 1000.0 if frame_number >= 0 else 0.0
+
+    def _anchor(self, frame_number):
+        # Frame `frame_number` is due now; later frames follow at the playback speed
+        self._clock = (time.monotonic(), self._media_time(frame_number))
+
+    def _due(self, frame_number):
+        wall, media = self._clock
+        return wall + (self._media_time(frame_number) - media) / self.speed
+
+    def _flush(self):
+        self._generation += 1
+        while self._buffer:
+            self._free.append(self._buffer.popleft().image)
+        self._at_end = False
+
+    def _decode_loop(self):
+        frame_interval = 1.0 / self.index.fps
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed or self._pending_seek is not None
+                                    or (len(self._buffer) < self.buffer_size and not self._at_end))
+                if self._closed:
+                    return
+                generation = self._generation
+                seek_to, self._pending_seek = self._pending_seek, None
+                out = self._free.pop() if self._free else None
+
+            with self._decode_lock:
+                if seek_to is not None:
+                    self.seeker.seek(seek_to)
+                frame_number = self.seeker.position
+                image = None
+                if frame_number < self.index.frame_count:
+                    with self._cond:
+                        late = self.is_playing and self._due(frame_number) < time.monotonic() - frame_interval
+                    if late:
+                        ended = not self.seeker.skip()
+                    else:
+                        image = self.seeker.read(out)
+                        ended = image is None
+                else:
+                    ended = True
+
+            with self._cond:
+                if generation != self._generation:
+                    # A seek happened while decoding; this frame belongs to the old position
+                    if image is not None or out is not None:
+                        self._free.append(image if image is not None else out)
+                    continue
+                if ended:
+                    self._at_end = True
+                    if out is not None:
+                        self._free.append(out)
+                elif image is None:
+                    self.dropped += 1
+                    if out is not None:
+                        self._free.append(out)
+                else:
+                    self._buffer.append(DecodedFrame(frame_number, image))
+                    if out is not None and image is not out:
+                        self._free.append(out)
@@ -0,0 +1,385 @@
+"""Batch post-processing of recordings: trim, resize, drop near-duplicate frames and transcode.
+
+A job applies a chain of steps to every recording in a directory:
+
+    python src/postprocess.py videos --chain "trim=2:60, resize=640, dedupe=4, transcode=mjpeg"
+
+    trim=START:END   keep source seconds START to END (either may be left out, e.g. trim=5:)
+    resize=W[xH]     scale to W pixels wide, keeping the aspect ratio unless H is given
+    dedupe[=BITS]    drop frames whose perceptual hash is within BITS of the last kept frame
+    transcode=CODEC  encode with this video_codec backend instead of the default
+
+Resize and dedupe run per frame in chain order; trim and transcode apply to the whole file.
+Each recording is decoded, transformed and encoded one frame at a time in its own worker
+process, so memory use does not grow with its length. Outputs go to <dir>/processed, named
+after the recording (with its extension added, e.g. a_avi, when recordings of several formats
+share a name), with a <name>.frames.csv mapping every output frame to its source frame and time, and a manifest.json
+records each finished recording: an interrupted job resumes where it stopped, and running it
+again only processes new or changed recordings.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+import cv2
+import numpy as np
+
+from encoders import DEFAULT_ENCODER, ENCODER_NAMES, get_encoder, open_writer
+from frame_index import FrameSeeker
+
+# Folder inside the input directory that receives the outputs and the manifest
+PROCESSED_DIR = "processed"
+MANIFEST_NAME = "manifest.json"
+VIDEO_EXTENSIONS = (".avi", ".mp4", ".mkv", ".mov")
+
+STEP_NAMES = ("trim", "resize", "dedupe", "transcode")
+DEFAULT_DEDUPE_BITS = 4
+
+# One parsed step of a chain; value is (start, end) seconds for trim (either may be None),
+# (width, height) for resize (height None keeps the aspect ratio), Hamming bits for dedupe
+# and a codec name for transcode
+Step = namedtuple("Step", ["name", "value"])
+
+
+def parse_chain(spec):
+    """Parses a chain such as "trim=2:60, resize=640, dedupe=4" into a tuple of Steps."""
+    steps = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, argument = item.partition("=")
+        name, argument = name.strip().lower(), argument.strip()
+        try:
+            steps.append(Step(name, _parse_argument(name, argument)))
+        except ValueError as e:
+            raise ValueError(f"Invalid step '{item}': {e}") from None
+    for name in STEP_NAMES:
+        if sum(step.name == name for step in steps) > 1:
+            raise ValueError(f"The chain has more than one {name} step.")
+    return tuple(steps)
+
+
+def _parse_argument(name, argument):
+    if name == "trim":
+        start, separator, end = argument.partition(":")
+        if not separator:
+            raise ValueError("expected START:END seconds.")
+        start = float(start) if start.strip() else None
+        end = float(end) if end.strip() else None
+        if start is not None and end is not None and end <= start:
+            raise ValueError("END must be after START.")
+        return start, end
+    if name == "resize":
+        width, _, height = argument.lower().partition("x")
+        width, height = int(width), int(height) if height else None
+        if width <= 0 or (height is not None and height <= 0):
+            raise ValueError("sizes must be positive.")
+        return width, height
+    if name == "dedupe":
+        bits = int(argument) if argument else DEFAULT_DEDUPE_BITS
+        if not 0 <= bits < 64:
+            raise ValueError("BITS must be between 0 and 63.")
+        return bits
+    if name == "transcode":
+        return get_encoder(argument).name
+    raise ValueError(f"unknown step, expected one of {', '.join(STEP_NAMES)}.")
+
+
+def format_chain(chain):
+    """The canonical spec of a parsed chain, as stored in the manifest."""
+    parts = []
+    for name, value in chain:
+        if name == "trim":
+            start, end = value
+            value = f"{'' if start is None else f'{start:g}'}:{'' if end is None else f'{end:g}'}"
+        elif name == "resize":
+            width, height = value
+            value = f"{width}x{height}" if height else str(width)
+        parts.append(f"{name}={value}")
+    return ", ".join(parts)
+
+
+def phash(image):
+    """64-bit perceptual hash: the signs of the lowest 8x8 DCT frequencies of a 32x32 grayscale copy.
+
+    Unaffected by noise, compression and small lighting changes. The image is first sampled
+    onto a 256x256 grid: INTER_AREA straight from full size costs ~8 ms a 1080p frame and
+    this well under 1 ms, and the grid still averages 64 samples into each pixel of the 32x32 copy.
+    """
+    grid = cv2.resize(image, (256, 256), interpolation=cv2.INTER_LINEAR)
+    small = cv2.resize(grid, (32, 32), interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    low = cv2.dct(np.float32(small))[:8, :8]
+    # The DC term is the average brightness, so it is left out of the median
+    bits = low > np.median(low.flat[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class Resize:
+    def __init__(self, width, height=None):
+        self.width = width
+        self.height = height
+
+    def __call__(self, image):
+        height = self.height or max(1, round(image.shape[0] * self.width / image.shape[1]))
+        if (self.width, height) == (image.shape[1], image.shape[0]):
+            return image
+        shrinking = self.width < image.shape[1]
+        return cv2.resize(image, (self.width, height), interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR)
+
+
+class Dedupe:
+    """Drops frames that look like the last frame kept, so slow drift still gets through."""
+
+    def __init__(self, max_bits=DEFAULT_DEDUPE_BITS):
+        self.max_bits = max_bits
+        self._last = None
+
+    def __call__(self, image):
+        image_hash = phash(image)
+        if self._last is not None and hamming(image_hash, self._last) <= self.max_bits:
+            return None
+        self._last = image_hash
+        return image
+
+
+def build_transforms(chain):
+    """The per-frame steps of a chain as callables that return an image, or None to drop it."""
+    transforms = []
+    for name, value in chain:
+        if name == "resize":
+            transforms.append(Resize(*value))
+        elif name == "dedupe":
+            transforms.append(Dedupe(value))
+    return transforms
+
+
+def output_codec(chain, default_codec=DEFAULT_ENCODER):
+    return next((value for name, value in chain if name == "transcode"), default_codec)
+
+
+def process_video(video_path, out_dir, chain, default_codec=DEFAULT_ENCODER, name=None):
+    """Runs the chain over one recording. Returns its manifest entry (without size and mtime).
+
+    name is the outputs' file name without extension, the recording's by default.
+    """
+    # Each recording already gets its own process, so keep OpenCV to one thread per process
+    cv2.setNumThreads(1)
+
+    encoder = get_encoder(output_codec(chain, default_codec))
+    name = name or os.path.splitext(os.path.basename(video_path))[0]
+    output = os.path.join(out_dir, name + encoder.extension)
+    frames_path = os.path.join(out_dir, name + ".frames.csv")
+    # Written under temporary names and renamed once complete, so a file that exists is whole
+    partial = os.path.join(out_dir, f"{name}.partial{encoder.extension}")
+    partial_frames = frames_path + ".partial"
+
+    transforms = build_transforms(chain)
+    start, end = next((value for name, value in chain if name == "trim"), (None, None))
+
+    seeker = FrameSeeker(video_path)
+    index = seeker.index
+    first = index.frame_at_time(start) if start is not None and index.frame_count else 0
+    writer = None
+    frames_in = frames_out = 0
+    try:
+        with open(partial_frames, "w", newline="") as f:
+            frames_csv = csv.writer(f)
+            frames_csv.writerow(["frame", "source_frame", "source_time"])
+            seeker.seek(first)
+            for frame_number in range(first, index.frame_count):
+                timestamp = index.timestamps_ms[frame_number] / 1000.0
+                if end is not None and timestamp >= end:
+                    break
+                image = seeker.read()
+                if image is None:
+                    break
+                frames_in += 1
+                for transform in transforms:
+                    image = transform(image)
+                    if image is None:
+                        break
+                if image is None:
+                    continue
+
+                if writer is None:
+                    writer = open_writer(encoder, partial, seeker.fps, (image.shape[1], image.shape[0]))
+                writer.write(image)
+                frames_csv.writerow([frames_out, frame_number, f"{timestamp:.6f}"])
+                frames_out += 1
+    except BaseException:
+        _remove(partial, partial_frames)
+        raise
+    finally:
+        seeker.release()
+        if writer is not None:
+            writer.release()
+
+    if writer is None:
+        _remove(partial_frames)
+        raise ValueError("No frames left after the chain.")
+    os.replace(partial, output)
+    os.replace(partial_frames, frames_path)
+    return {"status": "done", "output": os.path.basename(output), "frames_in": frames_in, "frames_out": frames_out,
+            "bytes_in": os.path.getsize(video_path), "bytes_out": os.path.getsize(output), "error": None}
+
+
+def _remove(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class PostProcessJob:
+    """Runs a chain over every recording in input_dir, resumably.
+
+    The manifest in out_dir (input_dir/processed by default) remembers the chain and, per
+    recording, its size and mtime when processed and the result. Recordings already done
+    with the same chain are skipped; changing the chain or codec starts the job over.
+    """
+
+    def __init__(self, input_dir, chain, default_codec=DEFAULT_ENCODER, out_dir=None):
+        self.input_dir = input_dir
+        self.chain = parse_chain(chain) if isinstance(chain, str) else tuple(chain)
+        self.default_codec = get_encoder(default_codec).name
+        self.out_dir = out_dir or os.path.join(input_dir, PROCESSED_DIR)
+        self.manifest_path = os.path.join(self.out_dir, MANIFEST_NAME)
+        self.manifest = self._load_manifest()
+
+    def recordings(self):
+        """Recordings in input_dir with their (size, mtime), by name."""
+        on_disk = {}
+        with os.scandir(self.input_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(VIDEO_EXTENSIONS):
+                    stat = entry.stat()
+                    on_disk[entry.path] = (stat.st_size, stat.st_mtime)
+        return dict(sorted(on_disk.items()))
+
+    def output_names(self):
+        """The outputs' file name (without extension) of each recording, by path.
+
+        That is the recording's name, or {name}_{extension} when recordings of several
+        formats share the name, so a.avi and a.mkv do not write the same files.
+        """
+        paths = list(self.recordings())
+        stems = Counter(os.path.splitext(os.path.basename(path))[0] for path in paths)
+        names = {}
+        for path in paths:
+            stem, extension = os.path.splitext(os.path.basename(path))
+            names[path] = stem if stems[stem] == 1 else f"{stem}_{extension[1:]}"
+        return names
+
+    def pending(self):
+        """Paths of the recordings that are new, changed, failed or not yet processed."""
+        pending = []
+        for path, (size, mtime) in self.recordings().items():
+            entry = self.manifest["recordings"].get(os.path.basename(path))
+            if not (entry and entry["status"] == "done" and entry["size"] == size and entry["mtime"] == mtime):
+                pending.append(path)
+        return pending
+
+    def run(self, workers=None, paths=None):
+        """Processes `paths` (default: pending()) in parallel, one worker process per recording.
+
+        Yields (path, manifest entry) as each recording finishes; the manifest is saved after each.
+        """
+        paths = self.pending() if paths is None else paths
+        if not paths:
+            return
+        os.makedirs(self.out_dir, exist_ok=True)
+        signatures = {path: os.stat(path) for path in paths}
+        names = self.output_names()
+        # Workers are spawned, not forked: the GUI runs jobs from a process with capture and Tk threads
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+            futures = {pool.submit(process_video, path, self.out_dir, self.chain, self.default_codec, names.get(path)):
+                       path for path in paths}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    entry = {"status": "failed", "output": None, "error": str(e)}
+                entry.update(size=signatures[path].st_size, mtime=signatures[path].st_mtime)
+                self.manifest["recordings"][os.path.basename(path)] = entry
+                self._save_manifest()
+                yield path, entry
+
+    def _load_manifest(self):
+        fresh = {"chain": format_chain(self.chain), "codec": output_codec(self.chain, self.default_codec),
+                 "recordings": {}}
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return fresh
+        if (manifest.get("chain"), manifest.get("codec")) != (fresh["chain"], fresh["codec"]):
+            return fresh
+        return manifest
+
+    def _save_manifest(self):
+        # Replaced in one step so an interrupted job never leaves a truncated manifest
+        temporary = self.manifest_path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(temporary, self.manifest_path)
+
+
+def summarize(entries):
+    """One line for the totals of a job's manifest entries."""
+    done = [entry for entry in entries if entry["status"] == "done"]
+    frames_in = sum(entry["frames_in"] for entry in done)
+    frames_out = sum(entry["frames_out"] for entry in done)
+    mb_in = sum(entry["bytes_in"] for entry in done) / (1024 * 1024)
+    mb_out = sum(entry["bytes_out"] for entry in done) / (1024 * 1024)
+    failed = len(entries) - len(done)
+    return (f"{len(done)} processed{f', {failed} failed' if failed else ''}: "
+            f"{frames_in} -> {frames_out} frames, {mb_in:.1f} -> {mb_out:.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Trim, resize, dedupe and transcode the recordings in a directory.")
+    parser.add_argument("input_dir", help="Directory of recordings, e.g. the output directory.")
+    parser.add_argument("--chain", required=True, help='Steps to apply, e.g. "trim=2:60, resize=640, dedupe=4".')
+    parser.add_argument("--codec", choices=ENCODER_NAMES, default=DEFAULT_ENCODER,
+                        help="Output codec when the chain has no transcode step.")
+    parser.add_argument("--out", help=f"Output directory (default: <input_dir>/{PROCESSED_DIR}).")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: one per core).")
+    parser.add_argument("--restart", action="store_true", help="Process every recording again.")
+    args = parser.parse_args(argv)
+
+    try:
+        job = PostProcessJob(args.input_dir, args.chain, args.codec, args.out)
+    except ValueError as e:
+        parser.error(str(e))
+    paths = list(job.recordings()) if args.restart else job.pending()
+    if not paths:
+        print("Nothing to do: every recording is already processed.")
+        return 0
+
+    print(f"Processing {len(paths)} recordings with: {format_chain(job.chain)}")
+    entries = []
+    for done, (path, entry) in enumerate(job.run(args.workers, paths), start=1):
+        entries.append(entry)
+        if entry["status"] == "done":
+            print(f"[{done}/{len(paths)}] {path}: {entry['frames_in']} -> {entry['frames_out']} frames, "
+                  f"{entry['output']}")
+        else:
+            print(f"[{done}/{len(paths)}] {path}: failed: {entry['error']}", file=sys.stderr)
+    print(summarize(entries))
+    return 1 if any(entry["status"] != "done" for entry in entries) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import deque
+
+import cv2
+
+from capture import Frame
+from metrics import StageHistogram
+
+DEFAULT_QUALITY = 90
+
+
+class PreRollBuffer:
+    """Keeps the last `seconds` of a stream as JPEG so a recording can start before Record was pressed.
+
+    A thread reads every frame from an undecoding ring consumer: JPEG frames from a
+    passthrough source are kept as delivered, others are JPEG-encoded at `quality`, which
+    keeps a few seconds of 1080p within tens of MB. Frames older than `seconds` are
+    discarded, and so are the oldest ones whenever the buffer would exceed `max_mb`.
+
+    A Recorder given the buffer replays it with since() and keeps reading it until it has
+    caught up with the live stream, then continues from the ring at next_seq. The buffer
+    keeps filling meanwhile, so flushing it never holds up capture or overflows the ring.
+    """
+
+    def __init__(self, consumer, seconds, max_mb=256, quality=DEFAULT_QUALITY):
+        self.consumer = consumer
+        self.seconds = seconds
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+
+        self.frames = deque()  # Frames with JPEG images, oldest first
+        self.bytes = 0
+        self.next_seq = consumer.cursor  # Sequence number of the next frame the buffer will hold
+        self.evicted_for_memory = 0  # Frames discarded early to stay under max_mb
+        self.encode_times = StageHistogram()
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._buffer_loop, name="preroll", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            self.frames.clear()
+            self.bytes = 0
+
+    @property
+    def held_seconds(self):
+        """Capture time spanned by the buffered frames."""
+        with self._lock:
+            if len(self.frames) < 2:
+                return 0.0
+            return self.frames[-1].timestamp - self.frames[0].timestamp
+
+    def since(self, seq=None):
+        """Returns (buffered frames after `seq`, or all of them if None, and next_seq)."""
+        with self._lock:
+            frames = [frame for frame in self.frames if seq is None or frame.seq > seq]
+            return frames, self.next_seq
+
+    @staticmethod
+    def decode(frame):
+        """The frame with its JPEG image decoded to BGR, or None if it does not decode."""
+        image = cv2.imdecode(frame.image, cv2.IMREAD_COLOR)
+        return frame._replace(image=image) if image is not None else None
+
+    def _buffer_loop(self):
+        while not self._stop_event.is_set() and not self.consumer.ring.closed:
+            frame = self.consumer.read(timeout=0.1)
+            if frame is None:
+                continue
+            if self.consumer.ring.compressed:
+                # The consumer reuses its buffer, so keep a copy
+                jpeg = frame.image.copy()
+            else:
+                start = time.perf_counter()
+                ok, jpeg = cv2.imencode(".jpg", frame.image, self.encode_params)
+                self.encode_times.observe(time.perf_counter() - start)
+                if not ok:
+                    continue
+            self._add(Frame(frame.seq, frame.timestamp, jpeg, frame.gap))
+
+    def _add(self, frame):
+        with self._lock:
+            self.frames.append(frame)
+            self.bytes += frame.image.nbytes
+            self.next_seq = frame.seq + 1
+            while self.frames and frame.timestamp - self.frames[0].timestamp > self.seconds:
+                self.bytes -= self.frames.popleft().image.nbytes
+            while self.bytes > self.max_bytes and len(self.frames) > 1:
+                self.bytes -= self.frames.popleft().image.nbytes
+                self.evicted_for_memory += 1
@@ -0,0 +1,158 @@
+import math
+import time
+
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+
+from metrics import StageHistogram
+
+
+class PreviewRenderer:
+    """Letterboxes frames into a Tk label while reusing every buffer between frames.
+
+    The scale and offsets are only recomputed when the frame or label size changes. Each
+    frame is resized into a preallocated buffer, colour-converted straight into its slot
+    in a persistent RGBA canvas, and the canvas is pasted into a single PhotoImage.
+
+    The preview targets `target_fps` independently of the capture rate. If rendering takes
+    more than half of a frame interval, the rate is lowered until it fits and resizing falls
+    back to nearest-neighbour, leaving the CPU to the capture and recording threads.
+    """
+
+    # Lowest rate the preview is throttled down to
+    MIN_FPS = 2
+    # Fraction of each preview frame interval rendering may use
+    RENDER_BUDGET = 0.5
+
+    def __init__(self, label, target_fps=15, interpolation=cv2.INTER_LINEAR, photo_factory=ImageTk.PhotoImage):
+        self.label = label
+        self.photo_factory = photo_factory  # Builds the image the label shows; replaced to render offscreen
+        self.interpolation = interpolation
+        self.target_fps = target_fps
+        self.current_fps = target_fps
+        self.render_time = 0.0  # Moving average of seconds spent per render
+        self.render_times = StageHistogram()
+        self.fast_resize = False  # Nearest-neighbour resizing while rendering is over budget
+
+        self._plan_key = None  # (frame_w, frame_h, label_w, label_h) the buffers were built for
+        self._resized = None   # Resized BGR frame
+        self._target = None    # View of the canvas the resized frame is converted into
+        self._image = None     # PIL image sharing memory with the canvas
+        self._photo = None     # The PhotoImage shown by the label
+
+    def render(self, frame):
+        """Draws a BGR frame into the label. Returns False if the label has no size yet."""
+        label_width = self.label.winfo_width()
+        label_height = self.label.winfo_height()
+        if label_width <= 1 or label_height <= 1:
+            return False
+
+        frame_height, frame_width = frame.shape[:2]
+        plan_key = (frame_width, frame_height, label_width, label_height)
+        if plan_key != self._plan_key:
+            self._build_plan(*plan_key)
+
+        start = time.perf_counter()
+        new_h, new_w = self._resized.shape[:2]
+        cv2.resize(frame, (new_w, new_h), dst=self._resized, interpolation=self._current_interpolation())
+        cv2.cvtColor(self._resized, cv2.COLOR_BGR2RGBA, dst=self._target)
+        self._photo.paste(self._image)
+        elapsed = time.perf_counter() - start
+        self.render_times.observe(elapsed)
+        self._adapt(elapsed)
+        return True
+
+    @property
+    def interval_ms(self):
+        """Delay until the next preview frame at the current rate."""
+        return max(1, int(1000 / self.current_fps))
+
+    @property
+    def is_throttled(self):
+        return self.current_fps < self.target_fps
+
+    def _current_interpolation(self):
+        return cv2.INTER_NEAREST if self.fast_resize else self.interpolation
+
+    def _adapt(self, elapsed):
+        if self.render_time == 0.0:
+            self.render_time = elapsed
+        else:
+            self.render_time = 0.8 * self.render_time + 0.2 * elapsed
+
+        # Highest rate at which rendering stays within its share of the frame interval
+        affordable_fps = self.RENDER_BUDGET / self.render_time if self.render_time > 0 else self.target_fps
+        self.current_fps = max(self.MIN_FPS, min(self.target_fps, affordable_fps))
+
+        # Only go back to the nicer interpolation once there is plenty of headroom, so the
+        # preview does not flip between the two every few frames
+        if affordable_fps < self.target_fps:
+            self.fast_resize = True
+        elif affordable_fps > 2 * self.target_fps:
+            self.fast_resize = False
+
+    def clear(self, **label_options):
+        """Removes the image from the label; the next render re-attaches it."""
+        self.label.config(image='', **label_options)
+        self._plan_key = None
+
+    def _build_plan(self, frame_width, frame_height, label_width, label_height):
+        # Fit the whole frame inside the label, preserving the aspect ratio
+        scale = min(label_width / frame_width, label_height / frame_height)
+        new_w = max(1, int(frame_width * scale))
+        new_h = max(1, int(frame_height * scale))
+        x_offset = (label_width - new_w) // 2
+        y_offset = (label_height - new_h) // 2
+
+        # Opaque black canvas; the letterbox bars are never written again
+        canvas = np.zeros((label_height, label_width, 4), dtype=np.uint8)
+        canvas[..., 3] = 255
+
+        self._resized = np.empty((new_h, new_w, 3), dtype=np.uint8)
+        self._target = canvas[y_offset:y_offset + new_h, x_offset:x_offset + new_w]
+        # RGBA images built with frombuffer share memory with the array instead of copying it
+        self._image = Image.frombuffer('RGBA', (label_width, label_height), canvas, 'raw', 'RGBA', 0, 1)
+        self._photo = self.photo_factory(image=self._image)
+        self._plan_key = (frame_width, frame_height, label_width, label_height)
+
+        self.label.imgtk = self._photo
+        self.label.config(image=self._photo)
+
+
+class MosaicComposer:
+    """Tiles the newest frame of several streams into one reusable BGR frame for the preview.
+
+    Streams without a new frame keep their previous tile; each tile is letterboxed and its
+    geometry is cached per frame size like PreviewRenderer does for the whole label.
+    """
+
+    def __init__(self, count, tile_width=640, tile_height=360):
+        self.cols = math.ceil(math.sqrt(count))
+        self.rows = math.ceil(count / self.cols)
+        self.tile_size = (tile_width, tile_height)
+        self.mosaic = np.zeros((self.rows * tile_height, self.cols * tile_width, 3), dtype=np.uint8)
+        self._targets = [None] * count
+        self._shapes = [None] * count
+
+    def update(self, index, frame):
+        """Draws a stream's frame into its tile."""
+        if frame.shape != self._shapes[index]:
+            self._targets[index] = self._tile_target(index, frame.shape)
+            self._shapes[index] = frame.shape
+        target = self._targets[index]
+        cv2.resize(frame, (target.shape[1], target.shape[0]), dst=target, interpolation=cv2.INTER_LINEAR)
+
+    def _tile_target(self, index, frame_shape):
+        tile_width, tile_height = self.tile_size
+        row, col = divmod(index, self.cols)
+        tile = self.mosaic[row * tile_height:(row + 1) * tile_height, col * tile_width:(col + 1) * tile_width]
+        tile[:] = 0
+
+        frame_height, frame_width = frame_shape[:2]
+        scale = min(tile_width / frame_width, tile_height / frame_height)
+        new_w = max(1, int(frame_width * scale))
+        new_h = max(1, int(frame_height * scale))
+        x_offset = (tile_width - new_w) // 2
+        y_offset = (tile_height - new_h) // 2
+        return tile[y_offset:y_offset + new_h, x_offset:x_offset + new_w]
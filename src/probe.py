@@ -0,0 +1,198 @@
+"""Probing camera sources: is a source reachable, and what does it deliver?
+
+Each probe opens the source on its own daemon thread and reads one frame. A probe that
+has not answered within the timeout is reported as failed and abandoned, so a bad RTSP
+URL or a hung USB driver never holds up the caller, or the process on exit.
+
+Running this module probes sources, or scans for them, from the command line:
+
+    python src/probe.py 0 rtsp://camera3/stream
+    python src/probe.py --scan 8 --timeout 3
+"""
+import argparse
+import json
+import socket
+import sys
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+import cv2
+
+from capture import StreamOptions, is_network_source, open_capture
+
+# What a probe found; width, height, fps, backend and first_frame_ms are None when ok is False
+ProbeResult = namedtuple("ProbeResult", ["source", "ok", "width", "height", "fps", "backend", "first_frame_ms",
+                                         "error"])
+
+DEFAULT_TIMEOUT = 5.0
+DEFAULT_SCAN_INDICES = 8
+
+# Ports assumed for stream URLs that do not name one; UDP-based schemes cannot be checked
+DEFAULT_PORTS = {"rtsp": 554, "rtsps": 322, "rtmp": 1935, "http": 80, "https": 443, "tcp": None}
+
+
+def probe(source, stream_options=None):
+    """Opens `source`, reads one frame and returns a ProbeResult. Blocks for as long as the backend does."""
+    start = time.perf_counter()
+    options = stream_options or StreamOptions()
+    if is_network_source(source):
+        # OpenCV opens FFmpeg sources one at a time, so a dead host is ruled out
+        # with a plain connection first rather than holding up the other probes
+        error = check_reachable(source, options.timeout_ms / 1000)
+        if error:
+            return failed(source, error)
+    cap = open_capture(source, options)
+    try:
+        if not cap.isOpened():
+            return failed(source, "Cannot open camera source.")
+        ret, frame = cap.read()
+        if not ret or frame is None:
+            return failed(source, "Opened, but no frame was delivered.")
+        first_frame_ms = (time.perf_counter() - start) * 1000
+        try:
+            backend = cap.getBackendName()
+        except cv2.error:
+            backend = "unknown"
+        height, width = frame.shape[:2]
+        return ProbeResult(source, True, width, height, cap.get(cv2.CAP_PROP_FPS), backend, first_frame_ms, None)
+    finally:
+        cap.release()
+
+
+def check_reachable(url, timeout):
+    """Connects to a stream URL's host and port. Returns an error message, or None if it accepts connections."""
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS:
+        return None
+    try:
+        port = parts.port or DEFAULT_PORTS[scheme]
+    except ValueError:
+        return f"Invalid port in {url}."
+    if not parts.hostname or not port:
+        return None
+    try:
+        socket.create_connection((parts.hostname, port), timeout).close()
+    except OSError as e:
+        return f"Cannot connect to {parts.hostname}:{port} ({e.strerror or e})."
+    return None
+
+
+def failed(source, error):
+    return ProbeResult(source, False, None, None, None, None, None, error)
+
+
+def describe(result):
+    """One line for a dialog or the console, e.g. "0: 1280x720 at 30.0 fps (V4L2), first frame 412 ms"."""
+    if not result.ok:
+        return f"{result.source}: {result.error}"
+    return (f"{result.source}: {result.width}x{result.height} at {result.fps:.1f} fps ({result.backend}), "
+            f"first frame {result.first_frame_ms:.0f} ms")
+
+
+class ProbeService:
+    """Probes sources in parallel, giving each one `timeout` seconds to deliver a frame.
+
+    Network streams also get FFmpeg open/read timeouts no longer than `timeout`, so their
+    threads end soon after being abandoned. Only a driver that hangs outright keeps one.
+    USB cameras are opened truly in parallel, but OpenCV opens FFmpeg sources (streams and
+    files) one at a time: a stream that accepts the connection and then never answers can
+    use up the timeout of the FFmpeg sources queued behind it.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, stream_options=None):
+        self.timeout = timeout
+        options = stream_options or StreamOptions()
+        self.stream_options = options._replace(timeout_ms=min(options.timeout_ms, int(timeout * 1000)))
+        self._threads = []
+
+    def probe_all(self, sources, on_result=None):
+        """Probes every source at once. Returns their ProbeResults in source order.
+
+        Returns as soon as every source has answered, and at the latest after `timeout`.
+        on_result, if given, is called with each result as it arrives, from the probing threads.
+        """
+        results = {}
+        answered = threading.Condition()
+
+        def run(index, source):
+            try:
+                result = probe(source, self.stream_options)
+            except Exception as e:
+                result = failed(source, str(e))
+            with answered:
+                if index in results:
+                    # Already reported as timed out
+                    return
+                results[index] = result
+                answered.notify_all()
+            if on_result:
+                on_result(result)
+
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        for index, source in enumerate(sources):
+            thread = threading.Thread(target=run, args=(index, source), name="probe", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        with answered:
+            answered.wait_for(lambda: len(results) == len(sources), timeout=self.timeout)
+            timed_out = []
+            for index, source in enumerate(sources):
+                if index not in results:
+                    results[index] = failed(source, f"No frame within {self.timeout:g} s.")
+                    timed_out.append(results[index])
+        if on_result:
+            for result in timed_out:
+                on_result(result)
+        return [results[index] for index in range(len(sources))]
+
+    def scan(self, indices=DEFAULT_SCAN_INDICES, urls=(), on_result=None):
+        """Probes USB device indices 0 to indices - 1 and the given stream URLs in parallel."""
+        return self.probe_all(list(range(indices)) + list(urls), on_result)
+
+    def join(self, timeout=None):
+        """Waits up to `timeout` seconds for abandoned probes to give up.
+
+        The process should not exit while one is still inside OpenCV or FFmpeg.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+
+def main(argv=None):
+    # Imported here: session pulls in the whole capture and recording stack
+    from session import parse_sources
+
+    parser = argparse.ArgumentParser(description="Probe camera sources: resolution, fps, backend, time to first frame.")
+    parser.add_argument("sources", nargs="*", help="Sources to probe: USB indices or stream URLs.")
+    parser.add_argument("--scan", type=int, metavar="N", help="Also probe USB indices 0 to N-1.")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="Seconds each source gets.")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args(argv)
+
+    sources = parse_sources(",".join(args.sources))
+    if not sources and not args.scan:
+        parser.error("give sources to probe or --scan N")
+
+    service = ProbeService(args.timeout)
+    if args.scan:
+        results = service.scan(args.scan, sources)
+    else:
+        results = service.probe_all(sources)
+
+    if args.json:
+        print(json.dumps([result._asdict() for result in results], indent=2))
+    else:
+        for result in results:
+            print(describe(result))
+    sys.stdout.flush()
+    service.join(args.timeout)
+    return 0 if any(result.ok for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
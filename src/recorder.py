@@ -0,0 +1,464 @@
+import csv
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+from encoders import fit_frame
+from metrics import StageHistogram
+
+# What AsyncVideoWriter does with a new frame when its queue is full
+DROP_POLICIES = ("block", "drop-oldest", "drop-newest")
+
+# How a recording's frame rate is chosen: the rate frames really arrive at, the rate the
+# source reports, or a constant rate the frames are resampled to
+FRAME_TIMINGS = ("measured", "nominal", "resample")
+
+
+class AsyncVideoWriter:
+    """Encodes frames with a cv2.VideoWriter on a worker thread fed by a bounded queue.
+
+    When the encoder falls behind, `policy` decides what happens to a frame submitted to a
+    full queue: "block" waits for room, "drop-oldest" discards the oldest queued frame and
+    "drop-newest" discards the incoming one. Frame buffers are recycled through a pool so
+    steady-state recording does not allocate. Each frame can carry a tag that is handed to
+    `on_written` on the encoder thread right after the frame is written.
+    """
+
+    def __init__(self, writer, queue_size=64, policy="block", on_written=None):
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy '{policy}', expected one of {', '.join(DROP_POLICIES)}.")
+
+        self.writer = writer
+        self.queue_size = queue_size
+        self.policy = policy
+        self.on_written = on_written
+
+        # Counters
+        self.queued = 0   # Frames accepted into the queue
+        self.encoded = 0  # Frames handed to the encoder
+        self.dropped = 0  # Frames discarded because the queue was full
+        self.encode_times = StageHistogram()  # Time spent in each writer.write()
+
+        self._queue = deque()
+        self._free = []
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._encode_loop, name="encoder", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self):
+        """Number of frames waiting to be encoded."""
+        return len(self._queue)
+
+    def acquire(self, like):
+        """Returns a pooled buffer with the shape and dtype of `like`, to be filled and submitted."""
+        with self._cond:
+            while self._free:
+                buf = self._free.pop()
+                if buf.shape == like.shape and buf.dtype == like.dtype:
+                    return buf
+        return np.empty_like(like)
+
+    def recycle(self, buf):
+        """Returns an unused buffer from acquire() to the pool."""
+        with self._cond:
+            self._free.append(buf)
+
+    def submit(self, buf, tag=None):
+        """Queues a filled buffer for encoding. Ownership passes to the writer.
+
+        Returns False if the frame was dropped by the "drop-newest" policy.
+        """
+        with self._cond:
+            if len(self._queue) >= self.queue_size:
+                if self.policy == "block":
+                    self._cond.wait_for(lambda: len(self._queue) < self.queue_size or self._closed)
+                elif self.policy == "drop-newest":
+                    self.dropped += 1
+                    self._free.append(buf)
+                    return False
+                else:
+                    self._free.append(self._queue.popleft()[0])
+                    self.dropped += 1
+
+            self._queue.append((buf, tag))
+            self.queued += 1
+            self._cond.notify_all()
+            return True
+
+    def write(self, image, tag=None):
+        """Copies `image` into a pooled buffer and queues it, mirroring cv2.VideoWriter.write."""
+        buf = self.acquire(image)
+        np.copyto(buf, image)
+        return self.submit(buf, tag)
+
+    def release(self):
+        """Encodes everything still queued, then releases the underlying writer."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.writer.release()
+
+    def _encode_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._closed)
+                if not self._queue:
+                    # Closed and fully drained
+                    return
+                buf, tag = self._queue.popleft()
+                self._cond.notify_all()
+
+            start = time.perf_counter()
+            self.writer.write(buf)
+            self.encode_times.observe(time.perf_counter() - start)
+            if self.on_written:
+                self.on_written(tag)
+
+            with self._cond:
+                self.encoded += 1
+                self._free.append(buf)
+
+
+class SegmentedWriter:
+    """A cv2.VideoWriter stand-in that rolls over to a new file by duration or size.
+
+    The next segment's writer is always opened ahead of time on a helper thread, and the
+    finished one is released there too, so switching files between two frames costs no
+    more than a normal write and no frame is lost at the boundary. Without a duration or
+    size limit it writes a single file, like a plain cv2.VideoWriter.
+
+    max_seconds is file time: a segment holds max_seconds * fps frames, which play for
+    max_seconds at the file's rate `fps`. When that is not the rate frames arrive at (the
+    "nominal" frame timing), the segments take more or less wall-clock time to record.
+
+    With settle_fps, `fps` is provisional: settle_fps() is called on the first write and
+    may wait, e.g. until the source's rate has been measured, while the frames queue up in
+    front of this writer. If it returns another rate, the first file is opened again at it
+    before any frame is written.
+
+    redirect() moves the recording to new files, e.g. on another disk, from the next frame on.
+    With frame_size (width, height), the size the writers were opened with, frames of any
+    other size, as from a stream that reconnected at another resolution, are scaled to it.
+    """
+
+    def __init__(self, path_for, open_writer, fps, max_seconds=0, max_mb=0, frame_size=None, settle_fps=None):
+        self.path_for = path_for        # Segment index -> output path
+        self.open_writer = open_writer  # (path, fps) -> opened cv2.VideoWriter
+        self.frame_size = frame_size
+        self.max_seconds = max_seconds
+        self.max_bytes = int(max_mb * 1024 * 1024) if max_mb else 0
+        self._set_fps(fps)
+        self._settle_fps = settle_fps
+
+        self.paths = []  # Paths of the segments written so far
+        self.segment_index = 0
+        self.segment_frames = 0
+        self.frames_resized = 0  # Frames that arrived at another size than frame_size
+        self.redirect_error = None  # Why the last redirect() could not be carried out
+
+        self._redirect_to = None
+
+        self._helper = None
+        self._next = None
+        self._writer = self.open_writer(self.path_for(0), self.fps)
+        self.paths.append(self.path_for(0))
+        if self.max_frames or self.max_bytes:
+            self._helper = ThreadPoolExecutor(max_workers=1, thread_name_prefix="segments")
+            self._next = self._helper.submit(self.open_writer, self.path_for(1), self.fps)
+
+    def write(self, image):
+        if self._settle_fps is not None:
+            settle_fps, self._settle_fps = self._settle_fps, None
+            fps = settle_fps()
+            if fps and fps != self.fps:
+                self._reopen(fps)
+        if self._redirect_to is not None:
+            self._switch_to(self._redirect_to)
+        elif self._segment_full():
+            self._rollover()
+        if self.frame_size:
+            fitted = fit_frame(image, self.frame_size)
+            if fitted is not image:
+                self.frames_resized += 1
+                image = fitted
+        self._writer.write(image)
+        self.segment_frames += 1
+
+    def redirect(self, path_for):
+        """Continues in path_for(segment index) from the next frame, in a new segment.
+
+        Safe to call from any thread; the switch happens on the writing thread, between two
+        frames. If the new file cannot be opened, writing goes on where it was and the
+        error is kept in redirect_error.
+        """
+        self._redirect_to = path_for
+
+    def flush(self):
+        """Hands the current segment's frames to the operating system, for writers that buffer them."""
+        flush = getattr(self._writer, "flush", None)
+        if flush:
+            flush()
+
+    def release(self):
+        """Releases the current segment and discards the unused pre-opened one."""
+        self._writer.release()
+        if self._helper:
+            self._helper.submit(self._discard, self._next, self.path_for(self.segment_index + 1))
+            self._helper.shutdown(wait=True)
+
+    def _set_fps(self, fps):
+        self.fps = fps
+        self.max_frames = int(self.max_seconds * fps) if self.max_seconds else 0  # Frames of file time per segment
+        # Checking the file size is a syscall, so only do it about once a second
+        self.size_check_interval = max(1, int(fps))
+
+    def _reopen(self, fps):
+        # Nothing has been written yet: open the first file, and the next one, again at `fps`
+        self._set_fps(fps)
+        self._writer.release()
+        self._writer = self.open_writer(self.paths[-1], fps)
+        if self._helper:
+            self._helper.submit(self._discard, self._next, self.path_for(self.segment_index + 1))
+            self._next = self._helper.submit(self.open_writer, self.path_for(self.segment_index + 1), fps)
+
+    def _segment_full(self):
+        if self.segment_frames == 0:
+            return False
+        if self.max_frames and self.segment_frames >= self.max_frames:
+            return True
+        if self.max_bytes:
+            # Writers that buffer their file know its size, cheaply; on disk it lags behind
+            tell = getattr(self._writer, "tell", None)
+            if tell:
+                return tell() >= self.max_bytes
+            if self.segment_frames % self.size_check_interval == 0:
+                return os.path.getsize(self.paths[-1]) >= self.max_bytes
+        return False
+
+    def _rollover(self):
+        finished = self._writer
+        self._writer = self._next.result()
+        self._helper.submit(finished.release)
+
+        self.segment_index += 1
+        self.segment_frames = 0
+        self.paths.append(self.path_for(self.segment_index))
+        self._next = self._helper.submit(self.open_writer, self.path_for(self.segment_index + 1), self.fps)
+
+    def _switch_to(self, path_for):
+        self._redirect_to = None
+        try:
+            writer = self.open_writer(path_for(self.segment_index + 1), self.fps)
+        except IOError as e:
+            self.redirect_error = e
+            return
+        if self._helper is None:
+            self._helper = ThreadPoolExecutor(max_workers=1, thread_name_prefix="segments")
+        else:
+            # The segment opened ahead of time in the old location is not needed any more
+            self._helper.submit(self._discard, self._next, self.path_for(self.segment_index + 1))
+        self.path_for = path_for
+        self._next = Future()
+        self._next.set_result(writer)
+        self._rollover()
+
+    @staticmethod
+    def _discard(future, path):
+        future.result().release()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class TimestampLog:
+    """Writes a CSV row for every frame written to a (segmented) recording.
+
+    Each row names the file and frame number within it, the source frame's sequence number,
+    its capture time in seconds since the recording's first frame and, as a gap marker, the
+    seconds of missing signal before it (0 unless the source reconnected). add() is meant to be
+    an AsyncVideoWriter's on_written callback, so rows follow the order frames hit the files.
+    """
+
+    FIELDS = ["file", "frame", "seq", "capture_time", "gap_before"]
+
+    def __init__(self, path, file_writer):
+        self.path = path
+        self.file_writer = file_writer
+        self._file = open(path, "w", newline="")
+        self._csv = csv.writer(self._file)
+        self._csv.writerow(self.FIELDS)
+
+    def add(self, tag):
+        seq, capture_time, gap = tag
+        self._csv.writerow([os.path.basename(self.file_writer.paths[-1]), self.file_writer.segment_frames - 1,
+                            seq, f"{capture_time:.6f}", f"{gap:.3f}"])
+
+    def flush(self):
+        """Pushes the rows written so far to the disk, e.g. for a recovery checkpoint."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class Recorder:
+    """Moves every frame from a ring consumer into an AsyncVideoWriter on its own thread.
+
+    With `max_frames` set, the recorder stops taking frames once it has that many.
+    With `resample_fps` set, the output is resampled to that constant rate instead: output
+    frame n is the captured frame closest to n / resample_fps seconds into the recording,
+    so frames are duplicated when the source is slower and skipped when it is faster.
+    Each written frame is tagged with (seq, capture time since the first frame, gap before it).
+
+    With a `preroll` (preroll.PreRollBuffer), the buffered frames are written first and the
+    recorder reads the buffer until it has caught up with the live stream, then moves the
+    consumer to the buffer's next_seq and carries on from the ring.
+    """
+
+    def __init__(self, consumer, writer, max_frames=None, resample_fps=None, preroll=None):
+        self.consumer = consumer
+        self.writer = writer
+        self.max_frames = max_frames
+        self.resample_fps = resample_fps
+        self.preroll = preroll
+        self.preroll_frames = 0  # Frames taken from the pre-roll buffer
+        self.frames_taken = 0  # Frames handed to the writer
+        self.first_frame = None  # (seq, timestamp) of the first and last frames taken,
+        self.last_frame = None   # which tell how many frames the source delivered meanwhile
+        self.frames_duplicated = 0  # Extra copies written while resampling
+        self.frames_skipped = 0     # Captured frames left out while resampling
+        self.gaps = []  # (capture time since the first frame, seconds missing) of each source outage
+
+        self._held = None        # Resampling: the previous captured frame, a candidate for the next slot
+        self._held_written = 0   # Times the held frame has been written
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._record_loop, name="recorder", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Hands over any frames still waiting in the ring, then flushes and releases the writer."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self._held is not None:
+            self._retire_held()
+        self.writer.release()
+
+    @property
+    def is_finished(self):
+        """True once max_frames frames have been taken."""
+        return self.max_frames is not None and self.frames_taken >= self.max_frames
+
+    @property
+    def frames_written(self):
+        return self.writer.encoded
+
+    @property
+    def dropped(self):
+        """Frames lost in the capture ring, to corrupt JPEG data or in the writer queue."""
+        return self.consumer.dropped + self.consumer.undecodable + self.writer.dropped
+
+    def _transfer(self, timeout):
+        if self.is_finished:
+            return False
+
+        # Copy straight from the ring into a pooled writer buffer
+        buf = self.writer.acquire(self.consumer.ring.buffers[0])
+        frame = self.consumer.read(timeout=timeout, out=buf)
+        if frame is None:
+            self.writer.recycle(buf)
+            return False
+        self._take(frame)
+        return True
+
+    def _take(self, frame):
+        if self.first_frame is None:
+            self.first_frame = (frame.seq, frame.timestamp)
+        self.last_frame = (frame.seq, frame.timestamp)
+        if frame.gap:
+            self.gaps.append((frame.timestamp - self.first_frame[1], frame.gap))
+
+        if self.resample_fps:
+            self._resample(frame)
+        else:
+            self.writer.submit(frame.image, self._tag(frame))
+            self.frames_taken += 1
+
+    def _replay_preroll(self):
+        # The buffer keeps filling while it is replayed, so read it until nothing newer is left
+        last_seq = None
+        while not self.is_finished:
+            frames, next_seq = self.preroll.since(last_seq)
+            if not frames or self._stop_event.is_set():
+                break
+            for frame in frames:
+                last_seq = frame.seq
+                if self.is_finished:
+                    break
+                # The writer takes the JPEG as is when the consumer does not decode either
+                if self.consumer.decode:
+                    frame = self.preroll.decode(frame)
+                    if frame is None:
+                        continue
+                self._take(frame)
+                self.preroll_frames += 1
+        self.consumer.seek(next_seq if last_seq is None else last_seq + 1)
+
+    def _resample(self, frame):
+        # Fill every output slot due by this frame's capture time with whichever of the
+        # held frame and this one was captured closer to the slot
+        while not self.is_finished:
+            slot_time = self.first_frame[1] + self.frames_taken / self.resample_fps
+            if slot_time > frame.timestamp:
+                break
+            if self._held is None or slot_time - self._held.timestamp > frame.timestamp - slot_time:
+                self._hold(frame)
+            # Only the first copy of a frame carries its gap marker
+            self.writer.write(self._held.image, self._tag(self._held, with_gap=self._held_written == 0))
+            self._held_written += 1
+            if self._held_written > 1:
+                self.frames_duplicated += 1
+            self.frames_taken += 1
+
+        # Later slots are all closer to this frame than to the held one
+        if self._held is not frame:
+            self._hold(frame)
+
+    def _hold(self, frame):
+        if self._held is not None:
+            self._retire_held()
+        self._held = frame
+        self._held_written = 0
+
+    def _retire_held(self):
+        if self._held_written == 0:
+            self.frames_skipped += 1
+        self.writer.recycle(self._held.image)
+        self._held = None
+
+    def _tag(self, frame, with_gap=True):
+        return frame.seq, frame.timestamp - self.first_frame[1], frame.gap if with_gap else 0.0
+
+    def _record_loop(self):
+        if self.preroll:
+            self._replay_preroll()
+        while not self._stop_event.is_set() and not self.consumer.ring.closed and not self.is_finished:
+            self._transfer(0.1)
+
+        # Drain the frames captured before stop was requested, and only those: a source
+        # faster than the encoder would otherwise keep the recorder from ever stopping
+        end_seq = self.consumer.ring.next_seq
+        while self.consumer.cursor < end_seq and self._transfer(0):
+            pass
@@ -0,0 +1,538 @@
+"""Crash-safe recording: a journal written while recording, and repair of interrupted recordings.
+
+While a recording runs with checkpoint_seconds set, every stream keeps a
+{videoName}{timestamp}[_cam{N}].journal next to its files. Every checkpoint flushes the
+video file and the timestamps file to disk and notes the files written so far; a clean
+stop deletes the journal. A journal that is still there means the recording was cut
+short (killed, crashed, power lost) and its last file lacks the index that players need.
+
+    python src/recovery.py videos              # repair every interrupted recording in videos/
+    python src/recovery.py videos --list       # only list them
+    python src/recovery.py videos/take20240101120000.avi   # repair one file, journal or not
+
+AVI files get their index rebuilt from the frames on disk without re-encoding; everything
+up to the last frame that reached the disk is kept. Matroska files (ffv1/png, both
+lossless) are decoded and written again so they get their index; the muxer holds up to
+about 5 seconds in memory, and those are lost. MP4 files cannot be
+repaired once cut short, so crash-safe MP4 recordings are split into short segments
+instead, and only the segment being written is lost. The damaged originals are kept as
+<file>.damaged until the repaired files have been checked.
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import re
+import struct
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import cv2
+
+from encoders import ENCODERS, open_writer
+
+JOURNAL_EXTENSION = ".journal"
+DAMAGED_SUFFIX = ".damaged"
+
+# Containers whose cut-short files can be repaired; the rest are segmented when crash-safe
+REPAIRABLE_EXTENSIONS = (".avi", ".mkv")
+# Longest segment of a crash-safe recording in a container that cannot be repaired
+UNREPAIRABLE_SEGMENT_SECONDS = 60
+# Largest crash-safe AVI file: repaired files are AVI 1.0, which many readers cap at 2 GB
+AVI_MAX_MB = 2000
+
+# What became of one file of an interrupted recording; frames is None when it failed
+RecoveredFile = namedtuple("RecoveredFile", ["path", "frames", "error"])
+
+
+def checkpoint_limits(encoder, segment_seconds, segment_mb):
+    """The segment limits a crash-safe recording with `encoder` needs, given the requested ones."""
+    if encoder.extension not in REPAIRABLE_EXTENSIONS:
+        segment_seconds = min(segment_seconds or UNREPAIRABLE_SEGMENT_SECONDS, UNREPAIRABLE_SEGMENT_SECONDS)
+    elif encoder.extension == ".avi":
+        segment_mb = min(segment_mb or AVI_MAX_MB, AVI_MAX_MB)
+    return segment_seconds, segment_mb
+
+
+def relative_name(path, directory):
+    """How a file is listed in a journal or sidecar in `directory`: by name when it is in that
+    directory, else by full path (a recording that moved to the secondary directory)."""
+    if os.path.dirname(os.path.abspath(path)) == os.path.abspath(directory):
+        return os.path.basename(path)
+    return os.path.abspath(path)
+
+
+def sync_file(path):
+    """Forces what has been written to `path`, by any file handle, onto the disk."""
+    try:
+        fd = os.open(path, os.O_RDWR)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class RecordingJournal:
+    """Checkpoints one stream's recording so it can be repaired if the process dies.
+
+    on_written() takes the place of the TimestampLog's as the AsyncVideoWriter callback, so
+    checkpoints run on the encoder thread between frames; the writer queue absorbs the
+    fsync. A checkpoint is also made as soon as the recording rolls over to a new segment.
+    """
+
+    def __init__(self, path, file_writer, timestamp_log, interval, info):
+        self.path = path
+        self.file_writer = file_writer
+        self.timestamp_log = timestamp_log
+        self.interval = interval
+        self.frames = 0
+        self.checkpoints = 0
+
+        self._file = open(path, "w")
+        self._append(dict(info, event="start", started=datetime.now().isoformat(timespec="seconds")))
+        self._last_checkpoint = time.monotonic()
+        self._segments = len(file_writer.paths)
+
+    def on_written(self, tag):
+        self.timestamp_log.add(tag)
+        self.frames += 1
+        if len(self.file_writer.paths) != self._segments or time.monotonic() - self._last_checkpoint >= self.interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        self.timestamp_log.flush()
+        # Frames still queued in a write-behind buffer would not be covered by the fsync
+        self.file_writer.flush()
+        sync_file(self.file_writer.paths[-1])
+        directory = os.path.dirname(self.path)
+        self._append({"event": "checkpoint", "time": time.time(), "frames": self.frames, "fps": self.file_writer.fps,
+                      "files": [relative_name(path, directory) for path in self.file_writer.paths],
+                      "next": relative_name(self.file_writer.path_for(self.file_writer.segment_index + 1), directory)})
+        self._last_checkpoint = time.monotonic()
+        self._segments = len(self.file_writer.paths)
+        self.checkpoints += 1
+
+    def finish(self):
+        """The recording was stopped cleanly and its files are complete: the journal goes."""
+        self._file.close()
+        os.remove(self.path)
+
+    def _append(self, entry):
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+
+def read_journal(path):
+    """(start entry, last checkpoint or None) of a journal. A line cut short by the crash is ignored."""
+    start, last = None, None
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            if entry.get("event") == "start":
+                start = entry
+            elif entry.get("event") == "checkpoint":
+                last = entry
+    if start is None:
+        raise ValueError(f"{path} is not a recording journal.")
+    return start, last
+
+
+def find_interrupted(directory):
+    """Journals of the interrupted recordings in `directory`, oldest first."""
+    return sorted(glob.glob(os.path.join(glob.escape(directory), "*" + JOURNAL_EXTENSION)))
+
+
+def recover(journal_path):
+    """Repairs the files of one interrupted recording. Returns a RecoveredFile per file.
+
+    Frames the timestamps file lists beyond what was recovered are dropped from it, a
+    .stats.json sidecar marked "recovered" is written, and the journal is removed once
+    every file was repaired.
+    """
+    start, last = read_journal(journal_path)
+    directory = os.path.dirname(journal_path)
+    names = last["files"] if last else start["files"]
+    results = []
+    for name in names:
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            # Already found empty by an earlier run
+            damaged = os.path.exists(path + DAMAGED_SUFFIX)
+            results.append(RecoveredFile(path, 0 if damaged else None, None if damaged else "missing"))
+            continue
+        try:
+            frames = count_frames(path)
+            if frames is None:
+                frames = repair_file(path)
+            results.append(RecoveredFile(path, frames, None))
+        except (OSError, ValueError) as e:
+            results.append(RecoveredFile(path, None, str(e)))
+
+    # The segment opened ahead of time holds no footage, unless the process died just
+    # after rolling over to it and before the next checkpoint
+    upcoming = os.path.join(directory, last["next"] if last else start["next"])
+    if upcoming not in (os.path.join(directory, name) for name in names) and os.path.exists(upcoming):
+        try:
+            frames = repair_file(upcoming)
+        except (OSError, ValueError):
+            frames = 0
+        if frames:
+            results.append(RecoveredFile(upcoming, frames, None))
+        else:
+            for path in (upcoming, upcoming + DAMAGED_SUFFIX):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    # Rows of files that could not be repaired stay, as the frames may still be there
+    recovered = {os.path.basename(result.path): float("inf") if result.frames is None else result.frames
+                 for result in results}
+    timestamps_path = os.path.join(directory, start["timestamps"])
+    if os.path.exists(timestamps_path):
+        _trim_timestamps(timestamps_path, recovered)
+    _write_stats(os.path.join(directory, start["stats"]), start, last, results)
+
+    if all(result.error is None for result in results):
+        os.remove(journal_path)
+    return results
+
+
+def count_frames(path):
+    """The frame count of a complete, indexed video file; None when it needs repairing."""
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            return None
+        frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if frames <= 0:
+            return None
+        # A file cut short may claim any count: the last frame it claims must be there
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frames - 1)
+        return frames if cap.grab() else None
+    finally:
+        cap.release()
+
+
+def repair_file(path):
+    """Repairs one cut-short recording in place. Returns its frame count.
+
+    The original is kept as <path>.damaged, also when not a single complete frame was
+    found in it, in which case nothing takes its place.
+    """
+    stem, extension = os.path.splitext(path)
+    extension = extension.lower()
+    if extension not in REPAIRABLE_EXTENSIONS:
+        raise ValueError(f"{os.path.basename(path)} cannot be repaired: only {', '.join(REPAIRABLE_EXTENSIONS)} "
+                         "files can be.")
+
+    repaired = f"{stem}.repairing{extension}"
+    try:
+        frames = repair_avi(path, repaired) if extension == ".avi" else rewrite_video(path, repaired)
+    except BaseException:
+        if os.path.exists(repaired):
+            os.remove(repaired)
+        raise
+    os.replace(path, path + DAMAGED_SUFFIX)
+    if not frames:
+        if os.path.exists(repaired):
+            os.remove(repaired)
+        return 0
+    os.replace(repaired, path)
+    return frames
+
+
+# Video data chunks of stream 00 ("00dc" compressed, "00db" uncompressed)
+_VIDEO_CHUNK = re.compile(rb"^00d[bc]$")
+_AVIF_HASINDEX = 0x10
+_AVIIF_KEYFRAME = 0x10
+# RIFF sizes a writer that was cut short leaves behind: still unset, or "unknown"
+_UNSET_SIZES = (0, 0xFFFFFFFF)
+
+
+def repair_avi(path, out_path):
+    """Writes the frames of a cut-short AVI into a new, indexed AVI 1.0 file without re-encoding them.
+
+    Reads the headers and then every video chunk in order, in the first RIFF and any
+    OpenDML AVIX extensions, up to the first chunk that does not fit in the file. Returns
+    the number of frames written.
+    """
+    with open(path, "rb") as src:
+        file_size = os.fstat(src.fileno()).st_size
+        if src.read(4) != b"RIFF":
+            raise ValueError(f"{os.path.basename(path)} is not an AVI file.")
+        src.seek(0)
+        hdrl = handler = None
+        index = []  # (offset from the movi FourCC, size, flags) of every frame written
+
+        with open(out_path, "wb") as out:
+            movi_start = None
+            for fourcc, form, start, end in _top_level_lists(src, file_size):
+                if form == b"hdrl" and hdrl is None:
+                    src.seek(start)
+                    hdrl = bytearray(src.read(end - start))
+                    handler = _neutralize_odml_index(hdrl)
+                    # Headers now, with the counts patched in at the end
+                    out.write(b"RIFF" + struct.pack("<I", 0) + b"AVI ")
+                    out.write(b"LIST" + struct.pack("<I", len(hdrl) + 4) + b"hdrl" + hdrl)
+                    out.write(b"LIST" + struct.pack("<I", 0) + b"movi")
+                    movi_start = out.tell() - 4
+                elif form == b"movi" and hdrl is not None:
+                    if not _copy_frames(src, start, end, file_size, out, movi_start, index, handler):
+                        break
+
+            if hdrl is None:
+                raise ValueError(f"{os.path.basename(path)} has no AVI headers.")
+            movi_end = out.tell()
+            if movi_end > 0xFFFFFFFF - 16 * len(index) - 8:
+                raise ValueError(f"{os.path.basename(path)} holds more than 4 GB of frames, too much for one AVI file.")
+            out.write(b"idx1" + struct.pack("<I", 16 * len(index)))
+            out.write(b"".join(struct.pack("<4sIII", b"00dc", flags, offset, size) for offset, size, flags in index))
+            file_end = out.tell()
+
+            _patch_counts(hdrl, len(index))
+            out.seek(4)
+            out.write(struct.pack("<I", file_end - 8))
+            out.seek(24)
+            out.write(hdrl)
+            out.seek(movi_start - 4)
+            out.write(struct.pack("<I", movi_end - movi_start))
+    return len(index)
+
+
+def _top_level_lists(src, file_size):
+    """Yields (fourcc, form, data start, data end) of each LIST in each RIFF of an AVI file."""
+    riff_start = 0
+    while riff_start + 12 <= file_size:
+        src.seek(riff_start)
+        fourcc, size, form = struct.unpack("<4sI4s", src.read(12))
+        if fourcc != b"RIFF" or form not in (b"AVI ", b"AVIX"):
+            return
+        riff_end = _chunk_end(riff_start, size, file_size)
+        position = riff_start + 12
+        while position + 8 <= riff_end:
+            src.seek(position)
+            fourcc, size = struct.unpack("<4sI", src.read(8))
+            end = _chunk_end(position, size, file_size)
+            if fourcc == b"LIST" and end >= position + 12:
+                form = src.read(4)
+                if form == b"movi" and size <= 4:
+                    # Writers that patch the size in on release start with an empty list
+                    end = file_size
+                yield fourcc, form, position + 12, end
+            position = end + (end & 1)
+        riff_start = riff_end + (riff_end & 1)
+
+
+def _chunk_end(position, size, file_size):
+    # A size left unset by the writer, or pointing past the end, runs to the end of the file
+    end = position + 8 + size
+    return file_size if size in _UNSET_SIZES or end > file_size else end
+
+
+def _copy_frames(src, start, end, file_size, out, movi_start, index, handler):
+    """Copies the video chunks of one movi list. Returns False at the first incomplete chunk."""
+    position = start
+    while position + 8 <= end:
+        src.seek(position)
+        fourcc, size = struct.unpack("<4sI", src.read(8))
+        if position + 8 + size > file_size:
+            return False
+        if _VIDEO_CHUNK.match(fourcc):
+            data = src.read(size)
+            flags = _AVIIF_KEYFRAME if _is_keyframe(handler, data) else 0
+            index.append((out.tell() - movi_start, size, flags))
+            out.write(fourcc + struct.pack("<I", size) + data)
+            if size & 1:
+                out.write(b"\0")
+        elif not fourcc.isalnum() and fourcc not in (b"JUNK", b"LIST"):
+            # Not a chunk header: the rest of the file is not trustworthy
+            return False
+        position += 8 + size + (size & 1)
+    return True
+
+
+def _is_keyframe(handler, data):
+    """Whether a frame can be decoded on its own; seeking in the repaired file starts at these."""
+    if handler in (b"XVID", b"xvid", b"DIVX", b"divx", b"FMP4", b"mp4v", b"DX50"):
+        # MPEG-4 Part 2: the first VOP start code, then the 2-bit coding type (0 = intra)
+        vop = data.find(b"\x00\x00\x01\xb6")
+        return vop >= 0 and vop + 4 < len(data) and data[vop + 4] >> 6 == 0
+    # MJPEG and anything unknown: every frame stands on its own
+    return True
+
+
+def _subchunks(data, start, end):
+    """Yields (fourcc, data start, size) of the chunks inside data[start:end], descending into lists."""
+    position = start
+    while position + 8 <= end:
+        fourcc, size = struct.unpack_from("<4sI", data, position)
+        if fourcc == b"LIST":
+            yield from _subchunks(data, position + 12, min(position + 8 + size, end))
+        else:
+            yield fourcc, position + 8, size
+        position += 8 + size + (size & 1)
+
+
+def _neutralize_odml_index(hdrl):
+    """Turns OpenDML super indexes into JUNK, as they point at the damaged file. Returns the video FourCC."""
+    handler = None
+    for fourcc, start, size in _subchunks(hdrl, 0, len(hdrl)):
+        if fourcc == b"indx":
+            hdrl[start - 8:start - 4] = b"JUNK"
+        elif fourcc == b"strh" and handler is None and hdrl[start:start + 4] == b"vids":
+            handler = bytes(hdrl[start + 4:start + 8])
+    return handler
+
+
+def _patch_counts(hdrl, frames):
+    for fourcc, start, size in _subchunks(hdrl, 0, len(hdrl)):
+        if fourcc == b"avih":
+            flags, = struct.unpack_from("<I", hdrl, start + 12)
+            struct.pack_into("<II", hdrl, start + 12, flags | _AVIF_HASINDEX, frames)
+        elif fourcc == b"strh" and hdrl[start:start + 4] == b"vids":
+            struct.pack_into("<I", hdrl, start + 32, frames)
+        elif fourcc == b"dmlh":
+            struct.pack_into("<I", hdrl, start, frames)
+
+
+def rewrite_video(path, out_path):
+    """Decodes a cut-short file up to where it breaks off and encodes it again with the same
+    (lossless) codec, so the new file has its index. Returns the number of frames written."""
+    encoder = next((encoder for encoder in ENCODERS.values()
+                    if encoder.lossless and path.lower().endswith(encoder.extension)), None)
+    if encoder is None:
+        raise ValueError(f"No lossless codec writes {os.path.splitext(path)[1]} files.")
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        # Cut short before the muxer wrote out its first cluster of frames
+        return 0
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    writer = None
+    frames = 0
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if writer is None:
+                writer = open_writer(encoder, out_path, fps, (frame.shape[1], frame.shape[0]))
+            writer.write(frame)
+            frames += 1
+    finally:
+        cap.release()
+        if writer is not None:
+            writer.release()
+    return frames
+
+
+def _trim_timestamps(path, recovered):
+    # Rows of frames that never reached the disk would not line up with the repaired files
+    with open(path, newline="") as f:
+        rows = list(csv.reader(f))
+    if not rows:
+        return
+    header, body = rows[0], rows[1:]
+    kept = [row for row in body if len(row) == len(header) and int(row[1]) < recovered.get(row[0], 0)]
+    if len(kept) == len(body):
+        return
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(kept)
+
+
+def _write_stats(path, start, last, results):
+    stats = {
+        "source": start.get("source"),
+        "codec": start.get("codec"),
+        "files": [relative_name(result.path, os.path.dirname(path)) for result in results if result.frames],
+        "timestamps": start.get("timestamps"),
+        "width": start.get("width"),
+        "height": start.get("height"),
+        # The rate may have been settled after the journal started
+        "file_fps": (last or start).get("fps", start.get("fps")),
+        "frames_written": sum(result.frames or 0 for result in results),
+        "complete": False,
+        "recovered": True,
+        "started": start.get("started"),
+        "last_checkpoint": datetime.fromtimestamp(last["time"]).isoformat(timespec="seconds") if last else None,
+        "errors": {os.path.basename(result.path): result.error for result in results if result.error},
+    }
+    try:
+        with open(path, "w") as f:
+            json.dump(stats, f, indent=2)
+    except OSError:
+        pass
+
+
+def describe(results):
+    """One line per file, e.g. "take20240101120000.avi: 107890 frames recovered"."""
+    lines = []
+    for result in results:
+        name = os.path.basename(result.path)
+        if result.error:
+            lines.append(f"{name}: {result.error}")
+        elif result.frames:
+            lines.append(f"{name}: {result.frames} frames recovered")
+        else:
+            lines.append(f"{name}: no complete frames, kept as {name}{DAMAGED_SUFFIX}")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Repair recordings that were cut short by a crash or power loss.")
+    parser.add_argument("paths", nargs="+", help="Output directories, journals, or single .avi/.mkv files.")
+    parser.add_argument("--list", action="store_true", help="Only list the interrupted recordings.")
+    args = parser.parse_args(argv)
+
+    journals, files = [], []
+    for path in args.paths:
+        if os.path.isdir(path):
+            journals.extend(find_interrupted(path))
+        elif path.endswith(JOURNAL_EXTENSION):
+            journals.append(path)
+        else:
+            files.append(path)
+
+    if args.list:
+        for journal in journals:
+            start, last = read_journal(journal)
+            files_written = last["files"] if last else start["files"]
+            frames = last["frames"] if last else 0
+            print(f"{journal}: started {start['started']}, {frames} frames in {', '.join(files_written)} "
+                  "at the last checkpoint")
+        return 0
+    if not journals and not files:
+        print("No interrupted recordings found.")
+        return 0
+
+    failures = 0
+    for journal in journals:
+        print(f"{journal}:")
+        results = recover(journal)
+        failures += sum(result.error is not None for result in results)
+        for line in describe(results):
+            print(f"  {line}")
+    for path in files:
+        try:
+            frames = repair_file(path)
+            print(f"{path}: {frames} frames recovered" if frames
+                  else f"{path}: no complete frames, kept as {path}{DAMAGED_SUFFIX}")
+        except (OSError, ValueError) as e:
+            failures += 1
+            print(f"{path}: {e}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+import tkinter as tk
+from tkinter import ttk
+
+
+class ScanWindow(tk.Toplevel):
+    """Probes USB device indices and the configured stream URLs in parallel and lists what answered.
+
+    Results appear as each probe finishes. "Use" replaces the camera source with the selected
+    sources and "Add" appends them, so a multi-camera setup can be assembled from the list.
+    """
+
+    COLUMNS = (("source", "Source", 200), ("status", "Status", 190), ("resolution", "Resolution", 90),
+               ("fps", "FPS", 50), ("backend", "Backend", 80), ("first_frame", "First frame", 80))
+
+    def __init__(self, app, service, indices, urls, on_use):
+        super().__init__(app)
+        self.app = app
+        self.service = service
+        self.indices = indices
+        self.urls = urls
+        self.on_use = on_use
+        self.items = {}  # Source -> tree item id
+        self.arrived = []  # ProbeResults appended by the probe threads, drained by the Tk loop
+        self.scanning = False
+
+        self.title("Scan for Cameras")
+        self.geometry("720x320")
+
+        self.tree = ttk.Treeview(self, columns=[name for name, _, _ in self.COLUMNS], show="headings", height=10)
+        for name, heading, width in self.COLUMNS:
+            self.tree.heading(name, text=heading)
+            self.tree.column(name, width=width, anchor=tk.W)
+        self.tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=(10, 5))
+        self.tree.bind("<Double-1>", lambda event: self.use_selected(append=False))
+
+        button_frame = ttk.Frame(self)
+        button_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        ttk.Button(button_frame, text="Use", command=lambda: self.use_selected(append=False)).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Add", command=lambda: self.use_selected(append=True)).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Rescan", command=self.scan).pack(side=tk.LEFT, padx=5)
+        self.status_label = ttk.Label(button_frame, text="")
+        self.status_label.pack(side=tk.LEFT, padx=10)
+
+        self.scan()
+
+    def scan(self):
+        """Probes every index and URL in the background; rows fill in as probes answer."""
+        if self.scanning:
+            return
+        self.scanning = True
+        self.tree.delete(*self.tree.get_children())
+        self.items = {}
+        for source in list(range(self.indices)) + list(self.urls):
+            self.items[source] = self.tree.insert("", tk.END, values=(source, "Probing...", "", "", "", ""))
+        self.status_label.config(text=f"Probing {len(self.items)} sources...")
+
+        self.app.run_in_background(lambda: self.service.scan(self.indices, self.urls, self.arrived.append),
+                                   self.on_scanned, self.on_scan_failed)
+        self.show_arrived()
+
+    def show_arrived(self):
+        while self.arrived:
+            result = self.arrived.pop(0)
+            if result.ok:
+                values = (result.source, "OK", f"{result.width}x{result.height}", f"{result.fps:.1f}",
+                          result.backend, f"{result.first_frame_ms:.0f} ms")
+            else:
+                values = (result.source, result.error, "", "", "", "")
+            self.tree.item(self.items[result.source], values=values)
+        if self.scanning and self.winfo_exists():
+            self.after(100, self.show_arrived)
+
+    def on_scanned(self, results):
+        self.scanning = False
+        if not self.winfo_exists():
+            return
+        self.show_arrived()
+        found = sum(result.ok for result in results)
+        self.status_label.config(text=f"{found} of {len(results)} sources answered")
+        # Sources that answered first, in their original order
+        for position, result in enumerate(sorted(results, key=lambda result: not result.ok)):
+            self.tree.move(self.items[result.source], "", position)
+
+    def on_scan_failed(self, error):
+        self.scanning = False
+        if self.winfo_exists():
+            self.status_label.config(text=f"Scan failed: {error}")
+
+    def use_selected(self, append):
+        sources = [self.tree.set(item, "source") for item in self.tree.selection()]
+        if sources:
+            self.on_use(sources, append)
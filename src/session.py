@@ -0,0 +1,576 @@
+import json
+import os
+import re
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from capture import CaptureEngine
+from dataset_export import LiveExporter
+from encoders import DEFAULT_ENCODER, get_encoder, open_writer
+from framebus import DEFAULT_SLOTS, FrameBusPublisher, stream_bus_name
+from preroll import PreRollBuffer
+from recorder import DROP_POLICIES, FRAME_TIMINGS, AsyncVideoWriter, Recorder, SegmentedWriter, TimestampLog
+from recovery import JOURNAL_EXTENSION, RecordingJournal, checkpoint_limits, relative_name
+from storage import StorageGuard, check_storage, estimate_rate
+from trigger import RecordTrigger
+
+# Totals for one recording across all streams; frames_per_stream is the shortest stream's frame count
+RecordingStats = namedtuple("RecordingStats", ["frames_written", "frames_dropped", "frames_per_stream"])
+
+# How a recording's file frame rate was chosen, as its stats sidecar's fps_source says
+FPS_MEASURED = "measured"
+FPS_NOMINAL = "nominal"
+FPS_TARGET = "target"
+FPS_TOO_FEW_READS = "nominal (too few reads)"
+# Reads a measured frame rate is taken over, and how long the first write waits for them
+MEASURE_MIN_READS = 15
+MEASURE_TIMEOUT = 3.0
+
+
+def parse_source(source):
+    """Converts a camera source string to what cv2.VideoCapture expects: an int for USB ports, else the URL."""
+    source = source.strip()
+    return int(source) if source.isdigit() else source
+
+
+def parse_sources(text):
+    """Splits a comma-separated list of camera sources, e.g. "0, 1, rtsp://cam3/stream"."""
+    return [parse_source(part) for part in text.split(",") if part.strip()]
+
+
+def build_output_path(output_dir, video_name, timestamp, camera_index=None, segment_index=None, extension=".avi"):
+    """Builds the recording path: {videoName}{timestamp}.avi, with _cam{N} when recording several
+    cameras and _seg{NNN} when the recording is split into segments. The extension follows the codec."""
+    final_filename = f"{video_name.replace(' ', '')}{timestamp}"
+    if camera_index is not None:
+        final_filename += f"_cam{camera_index}"
+    if segment_index is not None:
+        final_filename += f"_seg{segment_index:03d}"
+    return os.path.join(output_dir, final_filename + extension)
+
+
+# Matches the names build_output_path produces
+OUTPUT_NAME_PATTERN = re.compile(r"^(?P<label>.*?)(?P<timestamp>\d{14})(?:_cam(?P<camera>\d+))?(?:_seg(?P<segment>\d+))?\.(?:avi|mkv|mp4)$")
+
+
+def parse_output_name(filename):
+    """Splits a recording's file name back into (label, datetime, camera_index, segment_index).
+
+    Returns None for files that were not named by this tool; missing parts are None.
+    """
+    match = OUTPUT_NAME_PATTERN.match(os.path.basename(filename))
+    if not match:
+        return None
+    try:
+        recorded_at = datetime.strptime(match["timestamp"], "%Y%m%d%H%M%S")
+    except ValueError:
+        return None
+    camera = int(match["camera"]) if match["camera"] else None
+    segment = int(match["segment"]) if match["segment"] else None
+    return match["label"], recorded_at, camera, segment
+
+
+class CaptureSession:
+    """Captures from several sources at once, each with its own capture and encoder threads.
+
+    OpenCV releases the GIL while grabbing, decoding and encoding, so the per-stream
+    threads spread across cores. All files of one recording share a session timestamp.
+    With mjpeg_passthrough, MJPEG sources are captured undecoded so the "mjpeg" codec
+    can store their frames without re-encoding them. stream_options (capture.StreamOptions)
+    applies to network sources, which reconnect on their own without ending a recording.
+    """
+
+    def __init__(self, sources, width=1280, height=720, mjpeg_passthrough=False, stream_options=None):
+        self.engines = [CaptureEngine(source, width, height, passthrough=mjpeg_passthrough, stream_options=stream_options)
+                        for source in sources]
+        self.recorders = []
+        self.file_writers = []         # The SegmentedWriter behind each recorder
+        self.timestamp_logs = []       # Per-frame capture times of each recording
+        self.journals = []             # RecordingJournal of each recording when it is crash-safe
+        self.fps_sources = []          # FPS_* saying how each stream's file frame rate was chosen
+        self.exporters = []            # LiveExporters writing sampled frames as a dataset
+        self.prerolls = []             # PreRollBuffer of each stream while pre-roll is on
+        self.trigger = None            # RecordTrigger watching every stream while triggered recording is on
+        self.frame_buses = []          # FrameBusPublisher of each stream while the frame bus is on
+        self.session_timestamp = None  # Shared {timestamp} of the current recording's files
+        self.record_start = 0.0        # Monotonic time the current recording started
+        self.stats_paths = []          # JSON stats sidecar of each stream, written when recording stops
+        self.storage_check = None      # storage.StorageCheck of the current recording's output directory
+        self.storage_guard = None      # StorageGuard watching the disk while recording, if storage options were given
+        self._codec = None
+        self._frame_timing = None
+        self._recording_name = None  # (video_name, timestamp, extension) for the files a fail-over opens
+
+    @property
+    def is_running(self):
+        return any(engine.is_running for engine in self.engines)
+
+    @property
+    def is_recording(self):
+        return bool(self.recorders)
+
+    @property
+    def is_finished(self):
+        """True once every stream of a frame-limited recording has all its frames."""
+        return bool(self.recorders) and all(recorder.is_finished for recorder in self.recorders)
+
+    def start(self):
+        """Opens every source in parallel and starts capturing. Nothing stays open if any source fails."""
+        with ThreadPoolExecutor(max_workers=len(self.engines)) as pool:
+            results = list(pool.map(self._try_start, self.engines))
+        errors = [error for error in results if error is not None]
+        if errors:
+            self.stop()
+            raise errors[0]
+
+    def stop(self):
+        """Stops any recording or export in progress and releases every source."""
+        self.stop_recording()
+        self.stop_export()
+        self.stop_trigger()
+        self.stop_preroll()
+        self.stop_frame_bus()
+        for engine in self.engines:
+            engine.stop()
+
+    def start_preroll(self, seconds, max_mb=256, quality=None):
+        """Keeps the last `seconds` of every stream so recordings start that far back.
+
+        max_mb caps the memory of all streams together; quality is the JPEG quality of
+        frames that have to be encoded (passthrough JPEG frames are kept as delivered).
+        """
+        self.stop_preroll()
+        options = {"quality": quality} if quality else {}
+        for engine in self.engines:
+            preroll = PreRollBuffer(engine.consumer(decode=False), seconds, max_mb / len(self.engines), **options)
+            preroll.start()
+            self.prerolls.append(preroll)
+
+    def stop_preroll(self):
+        for preroll in self.prerolls:
+            preroll.stop()
+        self.prerolls = []
+
+    def start_trigger(self, options):
+        """Starts watching every stream for motion or scene changes (trigger.TriggerOptions).
+
+        The session does not act on it: poll trigger.active and start or stop recordings.
+        """
+        self.stop_trigger()
+        # Newest-frame consumers that leave JPEG frames to the detector's reduced decode
+        self.trigger = RecordTrigger([engine.consumer(latest_only=True, decode=False) for engine in self.engines],
+                                     options)
+        self.trigger.start()
+
+    def stop_trigger(self):
+        if self.trigger:
+            self.trigger.stop()
+            self.trigger = None
+
+    def start_frame_bus(self, name, slots=DEFAULT_SLOTS):
+        """Publishes every stream's newest frames to other processes in shared memory (framebus.py).
+
+        Each stream gets a block named `name`, with _cam{N} when there are several streams.
+        Raises OSError (e.g. FileExistsError on Windows) when a block cannot be created.
+        """
+        self.stop_frame_bus()
+        multi = len(self.engines) > 1
+        try:
+            for index, engine in enumerate(self.engines):
+                publisher = FrameBusPublisher(engine.consumer(latest_only=True),
+                                              stream_bus_name(name, index if multi else None),
+                                              (engine.height, engine.width, 3), engine.fps, slots)
+                publisher.start()
+                self.frame_buses.append(publisher)
+        except OSError:
+            self.stop_frame_bus()
+            raise
+
+    def stop_frame_bus(self):
+        for publisher in self.frame_buses:
+            publisher.stop()
+        self.frame_buses = []
+
+    def preview_consumers(self):
+        """One newest-frame consumer per stream, in source order."""
+        return [engine.consumer(latest_only=True) for engine in self.engines]
+
+    @property
+    def output_paths(self):
+        """Files written by the current recording so far, in source and segment order."""
+        paths = []
+        for file_writer in self.file_writers:
+            paths.extend(file_writer.paths)
+        return paths
+
+    def start_recording(self, output_dir, video_name, queue_size=64, drop_policy="block", max_frames=None,
+                        segment_seconds=0, segment_mb=0, codec=DEFAULT_ENCODER, frame_timing="measured",
+                        target_fps=0, checkpoint_seconds=0, storage=None, planned_seconds=0):
+        """Starts one recording per stream. Returns the first output path of each stream.
+
+        max_frames limits the frames recorded per stream. With segment_seconds or segment_mb
+        set, each stream rolls over to a new _seg{NNN} file at that duration or size.
+        codec is one of encoders.ENCODER_NAMES.
+
+        frame_timing decides the files' frame rate: "measured" uses the rate frames actually
+        arrive at, "nominal" the rate the source reports, and "resample" duplicates or skips
+        frames to hold target_fps (or the nominal rate). Right after the camera started there
+        are too few reads to measure yet: then each file is opened again at the measured rate
+        on its first write, up to MEASURE_TIMEOUT seconds later, while the frames wait in the
+        writer queue. fps_sources says how each rate was chosen; FPS_TOO_FEW_READS means the
+        nominal rate was used after all. Either way every written frame's
+        capture time goes into a {videoName}{timestamp}[_cam{N}].timestamps.csv sidecar.
+
+        While pre-roll is on (start_preroll), each file begins with the buffered seconds
+        before this call.
+
+        With checkpoint_seconds set, the recording is crash-safe: every stream keeps a
+        {videoName}{timestamp}[_cam{N}].journal and is flushed to disk that often, so
+        recovery.py can repair it if the process dies before stop_recording.
+
+        With storage options (storage.StorageOptions), the output directory's free space
+        and write speed are checked first: the problems found are in storage_check, and a
+        directory without min_free_mb to spare is replaced by the secondary one or, if that
+        has no room either, raises IOError. A StorageGuard then watches the disk and moves
+        the recording to the secondary directory if the output directory fills up.
+        planned_seconds is the intended length, if known, for the free space check.
+        """
+        # Validate the writer settings before any file is created
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy '{drop_policy}', expected one of {', '.join(DROP_POLICIES)}.")
+        if frame_timing not in FRAME_TIMINGS:
+            raise ValueError(f"Unknown frame timing '{frame_timing}', expected one of {', '.join(FRAME_TIMINGS)}.")
+        encoder = get_encoder(codec)
+        if encoder.max_mb:
+            # Containers with 32-bit offsets must roll over before they overflow
+            segment_mb = min(segment_mb or encoder.max_mb, encoder.max_mb)
+        if checkpoint_seconds:
+            segment_seconds, segment_mb = checkpoint_limits(encoder, segment_seconds, segment_mb)
+
+        self.storage_check = None
+        if storage:
+            required_rate = sum(estimate_rate(codec, engine.width, engine.height,
+                                              target_fps if frame_timing == "resample" and target_fps else engine.fps)
+                                for engine in self.engines)
+            check = check_storage(output_dir, required_rate, storage, planned_seconds)
+            if not check.usable and storage.secondary_dir:
+                secondary = check_storage(storage.secondary_dir, required_rate, storage, planned_seconds)
+                if secondary.usable:
+                    check = secondary._replace(problems=check.problems + secondary.problems)
+                    output_dir = storage.secondary_dir
+            if not check.usable:
+                raise IOError(" ".join(check.problems))
+            self.storage_check = check
+
+        os.makedirs(output_dir, exist_ok=True)
+        self.session_timestamp = timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        multi = len(self.engines) > 1
+        self._codec = codec
+        self._frame_timing = frame_timing
+        self._recording_name = (video_name, timestamp, encoder.extension)
+        self.stats_paths = [build_output_path(output_dir, video_name, timestamp, index if multi else None,
+                                              extension=".stats.json") for index in range(len(self.engines))]
+
+        # Rates that can be chosen now are, before subscribing, so no consumer falls behind the ring meanwhile
+        stream_fps = [self._recording_fps(engine, frame_timing, target_fps) for engine in self.engines]
+        self.fps_sources = [source for _, source in stream_fps]
+        # Subscribe every stream before starting any thread so the files begin together
+        # Streams captured as JPEG are stored as is when the codec accepts JPEG
+        consumers = [engine.consumer(decode=not encoder.accepts_jpeg) for engine in self.engines]
+        self.record_start = time.monotonic()
+
+        segmented = bool(segment_seconds or segment_mb)
+        first_paths = []
+        prerolls = self.prerolls or [None] * len(self.engines)
+        for index, (engine, consumer, preroll, (fps, fps_source)) in enumerate(zip(self.engines, consumers, prerolls,
+                                                                                   stream_fps)):
+            camera_index = index if multi else None
+            write_behind = (storage.write_behind_mb, storage.sync_mb) if storage else (0, 0)
+            open_segment = self._writer_factory(encoder, (engine.width, engine.height), *write_behind)
+            settle_fps = None
+            if fps_source is None:
+                def settle_fps(index=index, engine=engine):
+                    return self._settle_fps(index, engine)
+
+            def path_for(segment_index, camera_index=camera_index):
+                return build_output_path(output_dir, video_name, timestamp, camera_index,
+                                         segment_index if segmented else None, encoder.extension)
+            try:
+                file_writer = SegmentedWriter(path_for, open_segment, fps, segment_seconds, segment_mb,
+                                              (engine.width, engine.height), settle_fps)
+            except IOError:
+                # Do not leave the streams that did open recording on their own
+                self.stop_recording()
+                raise
+
+            timestamp_log = TimestampLog(build_output_path(output_dir, video_name, timestamp, camera_index,
+                                                           extension=".timestamps.csv"), file_writer)
+            on_written = timestamp_log.add
+            if checkpoint_seconds:
+                journal = RecordingJournal(
+                    build_output_path(output_dir, video_name, timestamp, camera_index, extension=JOURNAL_EXTENSION),
+                    file_writer, timestamp_log, checkpoint_seconds,
+                    {"source": str(engine.source), "codec": codec, "fps": fps, "width": engine.width,
+                     "height": engine.height, "files": [os.path.basename(file_writer.paths[0])],
+                     "next": os.path.basename(path_for(1)), "timestamps": os.path.basename(timestamp_log.path),
+                     "stats": os.path.basename(self.stats_paths[index])})
+                self.journals.append(journal)
+                on_written = journal.on_written
+            writer = AsyncVideoWriter(file_writer, queue_size, drop_policy, on_written=on_written)
+            recorder = Recorder(consumer, writer, max_frames, resample_fps=fps if frame_timing == "resample" else None,
+                                preroll=preroll)
+            recorder.start()
+            self.recorders.append(recorder)
+            self.file_writers.append(file_writer)
+            self.timestamp_logs.append(timestamp_log)
+            first_paths.append(file_writer.paths[0])
+
+        if storage:
+            self.storage_guard = StorageGuard(output_dir, storage, self._writer_backlog, self._fail_over)
+            self.storage_guard.start()
+        return first_paths
+
+    def stop_recording(self):
+        """Flushes every recording and writes its stats sidecars. Returns its RecordingStats."""
+        frames_written, frames_dropped = 0, 0
+        # The recording ends now for every stream, however long each one takes to drain
+        duration = time.monotonic() - self.record_start
+        if self.storage_guard:
+            self.storage_guard.stop()
+        streams = zip(self.engines, self.recorders, self.file_writers, self.timestamp_logs, self.stats_paths)
+        for index, (engine, recorder, file_writer, timestamp_log, stats_path) in enumerate(streams):
+            recorder.stop()
+            timestamp_log.close()
+            frames_written += recorder.frames_written
+            frames_dropped += recorder.dropped
+            # A recording stopped before its first frame was written never measured its rate
+            self.fps_sources[index] = self.fps_sources[index] or FPS_TOO_FEW_READS
+            self._write_stats(stats_path, engine, recorder, file_writer, timestamp_log, self.fps_sources[index],
+                              duration)
+        # Only now are the files complete
+        for journal in self.journals:
+            journal.finish()
+        frames_per_stream = min((recorder.frames_taken for recorder in self.recorders), default=0)
+        self.recorders = []
+        self.file_writers = []
+        self.timestamp_logs = []
+        self.journals = []
+        self.storage_guard = None
+        return RecordingStats(frames_written, frames_dropped, frames_per_stream)
+
+    def stream_metrics(self):
+        """Live figures for each stream, in source order, e.g. for a stats overlay.
+
+        Timings are the StageHistogram.snapshot() of camera reads and, while recording,
+        of encoder writes; their "rate" is the measured fps of that stage.
+        """
+        recorders, prerolls, trigger = self.recorders, self.prerolls, self.trigger
+        metrics = []
+        for index, engine in enumerate(self.engines):
+            recorder = recorders[index] if index < len(recorders) else None
+            preroll = prerolls[index] if index < len(prerolls) else None
+            monitor = trigger.monitors[index] if trigger else None
+            metrics.append({
+                "connected": engine.connected,
+                "reconnects": engine.reconnects,
+                "nominal_fps": engine.fps,
+                "read": engine.read_times.snapshot(),
+                "encode": recorder.writer.encode_times.snapshot() if recorder else None,
+                "writer_queue": recorder.writer.pending if recorder else 0,
+                "frames_written": recorder.frames_written if recorder else 0,
+                "frames_dropped": recorder.dropped if recorder else 0,
+                "preroll_seconds": preroll.held_seconds if preroll else None,
+                "preroll_bytes": preroll.bytes if preroll else 0,
+                "trigger_score": monitor.score if monitor else None,
+                "trigger_threshold": monitor.threshold if monitor else None,
+            })
+        return metrics
+
+    def metrics_series(self):
+        """Per-stream histograms and values in the form metrics.prometheus_text() takes."""
+        recorders, prerolls, trigger, buses = self.recorders, self.prerolls, self.trigger, self.frame_buses
+        series = []
+        for index, engine in enumerate(self.engines):
+            recorder = recorders[index] if index < len(recorders) else None
+            preroll = prerolls[index] if index < len(prerolls) else None
+            monitor = trigger.monitors[index] if trigger else None
+            bus = buses[index] if index < len(buses) else None
+            histograms = {"read": engine.read_times}
+            values = {
+                "nominal_fps": engine.fps,
+                "capture_fps": engine.read_times.snapshot()["rate"],
+                "frames_captured_total": engine.read_times.count,
+                "read_failures_total": engine.read_failures,
+                "connected": 1 if engine.connected else 0,
+                "reconnects_total": engine.reconnects,
+                "stale_frames_skipped_total": engine.stale_skipped,
+                "recording": 1 if recorder else 0,
+            }
+            if recorder:
+                histograms["encode"] = recorder.writer.encode_times
+                values.update(writer_queue_frames=recorder.writer.pending,
+                              recording_frames_written=recorder.frames_written,
+                              recording_frames_dropped=recorder.dropped)
+            if preroll:
+                histograms["preroll_encode"] = preroll.encode_times
+                values.update(preroll_seconds=preroll.held_seconds, preroll_bytes=preroll.bytes,
+                              preroll_evicted_for_memory_total=preroll.evicted_for_memory)
+            if monitor:
+                histograms["trigger_analyse"] = monitor.analyse_times
+                values.update(trigger_score=monitor.score, trigger_active=1 if trigger.active else 0)
+            if bus:
+                histograms["bus_publish"] = bus.publish_times
+                values.update(bus_frames_published_total=bus.published, bus_frames_oversized_total=bus.oversized)
+            series.append(({"stream": index}, histograms, values))
+        return series
+
+    def start_export(self, export_dir, video_name, **options):
+        """Starts exporting sampled frames of every stream as a dataset, alongside any recording.
+
+        Each stream gets export_dir/{videoName}{timestamp}[_cam{N}]/ with shards and an index;
+        options are passed to LiveExporter (every_n, target_fps, fmt, shard_size, jpeg_quality).
+        """
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        multi = len(self.engines) > 1
+        for index, engine in enumerate(self.engines):
+            name = os.path.splitext(os.path.basename(
+                build_output_path(export_dir, video_name, timestamp, index if multi else None)))[0]
+            exporter = LiveExporter(engine.consumer(), os.path.join(export_dir, name), source=str(engine.source), **options)
+            exporter.start()
+            self.exporters.append(exporter)
+
+    def stop_export(self):
+        """Finishes every export. Returns the total number of frames exported."""
+        exported = 0
+        for exporter in self.exporters:
+            exporter.stop()
+            exported += exporter.exported
+        self.exporters = []
+        return exported
+
+    @property
+    def storage_status(self):
+        """The StorageGuard's latest storage.StorageStatus while recording, else None."""
+        guard = self.storage_guard
+        return guard.status if guard else None
+
+    def _writer_backlog(self):
+        # How full the fullest encoder queue is, 0 to 1
+        return max((recorder.writer.pending / recorder.writer.queue_size for recorder in self.recorders), default=0.0)
+
+    def _fail_over(self, directory):
+        # Runs on the StorageGuard's thread; each stream switches files between two frames
+        video_name, timestamp, extension = self._recording_name
+        multi = len(self.engines) > 1
+        for index, file_writer in enumerate(self.file_writers):
+            def path_for(segment_index, camera_index=index if multi else None):
+                return build_output_path(directory, video_name, timestamp, camera_index, segment_index, extension)
+            file_writer.redirect(path_for)
+
+    @property
+    def recorded_seconds(self):
+        """Media time recorded so far: the shortest stream's written frames at its file frame rate."""
+        return min((recorder.frames_written / file_writer.fps
+                    for recorder, file_writer in zip(self.recorders, self.file_writers)), default=0.0)
+
+    @property
+    def unmeasured_streams(self):
+        """Indexes of the streams of the current or last recording whose "measured" frame
+        rate fell back to the nominal one."""
+        return [index for index, source in enumerate(self.fps_sources) if source == FPS_TOO_FEW_READS]
+
+    def _recording_fps(self, engine, frame_timing, target_fps):
+        # (frame rate, FPS_* source); the source is None while the rate is still to be measured
+        nominal = engine.fps or 30  # Default to 30 FPS if camera returns 0
+        if frame_timing == "resample":
+            return (target_fps, FPS_TARGET) if target_fps else (nominal, FPS_NOMINAL)
+        if frame_timing == "measured":
+            if engine.read_times.count < MEASURE_MIN_READS:
+                return nominal, None
+            return self._measured_fps(engine)
+        return nominal, FPS_NOMINAL
+
+    @staticmethod
+    def _measured_fps(engine):
+        measured = round(engine.read_times.snapshot()["rate"], 2)
+        # Arriving faster than the nominal rate means the source is read faster than
+        # real time (e.g. a file), where the nominal rate is the right one
+        if measured and not (engine.fps and measured > engine.fps * 1.05):
+            return measured, FPS_MEASURED
+        return engine.fps or 30, FPS_NOMINAL
+
+    def _settle_fps(self, index, engine):
+        # Runs on the stream's encoder thread before its first frame is written; the frames
+        # arriving meanwhile wait in the writer queue
+        deadline = time.monotonic() + MEASURE_TIMEOUT
+        while engine.read_times.count < MEASURE_MIN_READS and engine.is_running and time.monotonic() < deadline:
+            time.sleep(0.02)
+        if engine.read_times.count < MEASURE_MIN_READS:
+            fps, self.fps_sources[index] = engine.fps or 30, FPS_TOO_FEW_READS
+        else:
+            fps, self.fps_sources[index] = self._measured_fps(engine)
+        return fps
+
+    def _write_stats(self, stats_path, engine, recorder, file_writer, timestamp_log, fps_source, duration):
+        frames_delivered, measured_fps, preroll_seconds = 0, 0.0, 0.0
+        if recorder.first_frame:
+            (first_seq, first_time), (last_seq, last_time) = recorder.first_frame, recorder.last_frame
+            frames_delivered = last_seq - first_seq + 1
+            if last_time > first_time:
+                measured_fps = (last_seq - first_seq) / (last_time - first_time)
+            if recorder.preroll_frames:
+                preroll_seconds = max(0.0, self.record_start - first_time)
+
+        stats = {
+            "source": str(engine.source),
+            "codec": self._codec,
+            "files": [relative_name(path, os.path.dirname(stats_path)) for path in file_writer.paths],
+            "timestamps": os.path.basename(timestamp_log.path),
+            "duration_seconds": round(duration, 3),
+            "width": file_writer.frame_size[0],
+            "height": file_writer.frame_size[1],
+            "nominal_fps": engine.fps,
+            "measured_fps": round(measured_fps, 3),
+            "frame_timing": self._frame_timing,
+            "file_fps": file_writer.fps,
+            "fps_source": fps_source,
+            "frames_delivered": frames_delivered,
+            "frames_written": recorder.frames_written,
+            "frames_dropped_capture": recorder.consumer.dropped,
+            "frames_undecodable": recorder.consumer.undecodable,
+            "frames_dropped_writer": recorder.writer.dropped,
+            "frames_duplicated": recorder.frames_duplicated,
+            "frames_skipped": recorder.frames_skipped,
+            "frames_resized": file_writer.frames_resized,
+            "preroll_frames": recorder.preroll_frames,
+            "preroll_seconds": round(preroll_seconds, 3),
+            # Complete means no frame the source delivered was lost; resampling skips are deliberate
+            "complete": recorder.dropped == 0 and recorder.frames_written == recorder.frames_taken,
+            "gaps": [{"at_seconds": round(at, 3), "missing_seconds": round(missing, 3)} for at, missing in recorder.gaps],
+            "reconnects": engine.reconnects,
+            "stale_frames_skipped": engine.stale_skipped,
+            "read": engine.read_times.snapshot(),
+            "encode": recorder.writer.encode_times.snapshot(),
+        }
+        try:
+            with open(stats_path, "w") as f:
+                json.dump(stats, f, indent=2)
+        except OSError:
+            # Losing the sidecar must not lose the recording
+            pass
+
+    @staticmethod
+    def _writer_factory(encoder, frame_size, write_behind_mb=0, sync_mb=0):
+        def open_segment(path, fps):
+            return open_writer(encoder, path, fps, frame_size, write_behind_mb, sync_mb)
+        return open_segment
+
+    @staticmethod
+    def _try_start(engine):
+        try:
+            engine.start()
+        except Exception as e:
+            return e
+        return None
@@ -0,0 +1,160 @@
+"""Stand-ins for a camera, usable anywhere a camera source is, for benchmarks and demos without hardware.
+
+    synthetic://1280x720@30     generated frames at that size and rate (@0: as fast as they are read)
+    replay://videos/take.avi    a recording played back at its own frame rate, looping
+
+open_capture() hands these to the capture engine in place of a cv2.VideoCapture.
+"""
+import re
+import time
+
+import cv2
+import numpy as np
+
+from encoders import synthetic_frames
+
+SYNTHETIC_SCHEME = "synthetic"
+REPLAY_SCHEME = "replay"
+
+SYNTHETIC_PATTERN = re.compile(r"^(?P<width>\d+)x(?P<height>\d+)(?:@(?P<fps>\d+(?:\.\d+)?))?$")
+
+# Distinct frames a synthetic source cycles through. Generating one costs far more than a
+# camera read, and they stay in memory: about 50 MB per stream at 1920x1080.
+SYNTHETIC_FRAMES = 8
+
+
+def is_virtual_source(source):
+    return isinstance(source, str) and source.split("://", 1)[0].lower() in (SYNTHETIC_SCHEME, REPLAY_SCHEME) \
+        and "://" in source
+
+
+def synthetic_source(width, height, fps=30):
+    """The source string for a synthetic camera, e.g. "synthetic://1280x720@30"."""
+    return f"{SYNTHETIC_SCHEME}://{width}x{height}@{fps:g}"
+
+
+def open_virtual_capture(source):
+    """Opens a synthetic:// or replay:// source. Returns an object with the cv2.VideoCapture read interface."""
+    scheme, location = source.split("://", 1)
+    if scheme.lower() == REPLAY_SCHEME:
+        return ReplayCapture(location)
+    match = SYNTHETIC_PATTERN.match(location.strip())
+    if not match:
+        raise ValueError(f"Invalid synthetic source '{source}', expected e.g. synthetic://1280x720@30.")
+    return SyntheticCapture(int(match["width"]), int(match["height"]), float(match["fps"] or 30))
+
+
+class _Pacer:
+    """Spaces calls to wait() 1/fps seconds apart, like a camera delivering frames. fps 0 never waits."""
+
+    def __init__(self, fps):
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self._next_time = None
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self._next_time is None or now - self._next_time > self.interval:
+            # Start over rather than deliver a burst after falling behind
+            self._next_time = now
+        elif self._next_time > now:
+            time.sleep(self._next_time - now)
+        self._next_time += self.interval
+
+
+class SyntheticCapture:
+    """Delivers moving gradients with noise (encoders.synthetic_frames) at a fixed size and rate.
+
+    A short cycle of frames is generated up front, so a read costs one copy and the source
+    never limits the throughput being measured. The requested size is ignored.
+    """
+
+    def __init__(self, width, height, fps=30.0):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.frames = list(synthetic_frames(SYNTHETIC_FRAMES, width, height))
+        self.position = 0
+        self._pacer = _Pacer(fps)
+        self._opened = True
+
+    def isOpened(self):
+        return self._opened
+
+    def grab(self):
+        if not self._opened:
+            return False
+        self._pacer.wait()
+        self.position += 1
+        return True
+
+    def retrieve(self, image=None):
+        if not self._opened:
+            return False, None
+        frame = self.frames[(self.position - 1) % len(self.frames)]
+        if image is None or image.shape != frame.shape:
+            return True, frame.copy()
+        np.copyto(image, frame)
+        return True, image
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def get(self, prop):
+        return {cv2.CAP_PROP_FPS: self.fps, cv2.CAP_PROP_FRAME_WIDTH: self.width,
+                cv2.CAP_PROP_FRAME_HEIGHT: self.height, cv2.CAP_PROP_POS_FRAMES: self.position}.get(prop, 0.0)
+
+    def set(self, prop, value):
+        return False
+
+    def getBackendName(self):
+        return SYNTHETIC_SCHEME
+
+    def release(self):
+        self._opened = False
+        self.frames = []
+
+
+class ReplayCapture:
+    """Plays a video file back at its nominal frame rate, starting over at the end, like a live camera."""
+
+    def __init__(self, path):
+        self.path = path
+        self.cap = cv2.VideoCapture(path)
+        self.fps = (self.cap.get(cv2.CAP_PROP_FPS) or 30) if self.cap.isOpened() else 0.0
+        self._pacer = _Pacer(self.fps)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def grab(self):
+        self._pacer.wait()
+        if self.cap.grab():
+            return True
+        # Loop: rewind and try once more, so an empty file still ends the stream
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        return self.cap.grab()
+
+    def retrieve(self, image=None):
+        return self.cap.retrieve(image) if image is not None else self.cap.retrieve()
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def get(self, prop):
+        return self.fps if prop == cv2.CAP_PROP_FPS else self.cap.get(prop)
+
+    def set(self, prop, value):
+        # The file's size and rate are what they are
+        return False
+
+    def getBackendName(self):
+        return REPLAY_SCHEME
+
+    def release(self):
+        self.cap.release()
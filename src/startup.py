@@ -0,0 +1,146 @@
+"""Fast startup: heavy modules are imported on a background thread while the window is shown.
+
+Running this module measures how long the application takes to show its window, to
+finish loading and, with --source, to display the first camera frame:
+
+    python src/startup.py --runs 5 --source 0
+    python src/startup.py --exe dist/video_capture_tool --runs 5 --json startup.json
+
+Each run launches a fresh process (the source tree by default, or a PyInstaller build
+with --exe). The application writes its milestones to the file named by STARTUP_REPORT_ENV
+and closes itself once the last one is reached, without saving its settings.
+"""
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Imported in this order by preload(); everything that pulls in OpenCV, NumPy or Pillow
+HEAVY_MODULES = ("numpy", "cv2", "PIL.Image", "PIL.ImageTk", "metrics", "preview", "capture", "session",
+                 "frame_index", "library_window", "probe", "scan_window")
+
+# Set by the benchmark for the application it launches
+STARTUP_REPORT_ENV = "VIDEO_CAPTURE_STARTUP_REPORT"
+STARTUP_SOURCE_ENV = "VIDEO_CAPTURE_STARTUP_SOURCE"
+
+# Milestones in the order the application reaches them
+MILESTONES = ("window", "ready", "first_frame")
+
+
+def preload(modules=HEAVY_MODULES):
+    """Imports `modules` and returns the seconds it took.
+
+    Meant to run on a worker thread: the import lock makes a later import of the same
+    module on the Tk thread wait for this one rather than load it twice.
+    """
+    start = time.perf_counter()
+    for name in modules:
+        importlib.import_module(name)
+    return time.perf_counter() - start
+
+
+class StartupReport:
+    """Appends the application's startup milestones to the file the benchmark asked for.
+
+    Disabled (every call a no-op) unless STARTUP_REPORT_ENV is set. `source` is the camera
+    source to open once loaded, from STARTUP_SOURCE_ENV, or None to stop at "ready".
+    """
+
+    def __init__(self, environ=os.environ):
+        self.path = environ.get(STARTUP_REPORT_ENV)
+        self.source = environ.get(STARTUP_SOURCE_ENV) or None
+        self.reached = set()
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    @property
+    def last_milestone(self):
+        return "first_frame" if self.source else "ready"
+
+    def mark(self, milestone):
+        """Records `milestone` the first time it is reached. Returns True when it is the last one."""
+        if not self.enabled or milestone in self.reached:
+            return False
+        self.reached.add(milestone)
+        with open(self.path, "a") as f:
+            f.write(json.dumps({"event": milestone, "time": time.time()}) + "\n")
+        return milestone == self.last_milestone
+
+
+def measure(command, source=None, timeout=60.0):
+    """Launches `command` once and returns {milestone: seconds since launch} for the milestones it reached."""
+    fd, report_path = tempfile.mkstemp(suffix=".jsonl", prefix="startup_")
+    os.close(fd)
+    env = dict(os.environ, **{STARTUP_REPORT_ENV: report_path})
+    if source is not None:
+        env[STARTUP_SOURCE_ENV] = source
+    try:
+        # Wall-clock time, as the milestones are stamped by another process
+        launched = time.time()
+        process = subprocess.Popen(command, env=env)
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        with open(report_path) as f:
+            events = [json.loads(line) for line in f if line.strip()]
+    finally:
+        os.remove(report_path)
+    return {event["event"]: event["time"] - launched for event in events}
+
+
+def summarize(runs):
+    """{milestone: {"median", "min", "max"} in seconds} over the runs that reached it."""
+    summary = {}
+    for milestone in MILESTONES:
+        times = [run[milestone] for run in runs if milestone in run]
+        if times:
+            summary[milestone] = {"median": statistics.median(times), "min": min(times), "max": max(times),
+                                  "runs": len(times)}
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure time to first window and first frame of the application.")
+    parser.add_argument("--exe", help="Frozen build to launch (default: src/main.py with this interpreter).")
+    parser.add_argument("--source", help="Camera source to open, to also measure time to first frame.")
+    parser.add_argument("--runs", type=int, default=5, help="Launches to average over.")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds before a launch is given up on.")
+    parser.add_argument("--json", help="Also write the runs and summary to this file.")
+    args = parser.parse_args(argv)
+
+    if args.exe:
+        command, build = [os.path.abspath(args.exe)], "frozen"
+    else:
+        command, build = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")], "source"
+
+    runs = []
+    for run in range(1, args.runs + 1):
+        result = measure(command, args.source, args.timeout)
+        runs.append(result)
+        reached = "  ".join(f"{milestone} {result[milestone]:.2f}s" for milestone in MILESTONES if milestone in result)
+        print(f"run {run}: {reached or 'no milestones reached'}")
+
+    summary = summarize(runs)
+    print(f"\n{build} build, {len(runs)} runs")
+    print(f"{'milestone':<12} {'median':>8} {'min':>8} {'max':>8}")
+    for milestone, times in summary.items():
+        print(f"{milestone:<12} {times['median']:>7.2f}s {times['min']:>7.2f}s {times['max']:>7.2f}s")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"build": build, "command": command, "source": args.source, "runs": runs,
+                       "summary": summary}, f, indent=2)
+    return 0 if summary.get("window") else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
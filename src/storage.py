@@ -0,0 +1,319 @@
+"""Keeps recordings from running into a full or too slow disk.
+
+Before a recording starts, check_storage() compares the output directory's free space and
+measured write speed with the data rate the recording needs. While it runs, a
+StorageGuard watches how fast the free space goes, warns when less than `warn_minutes`
+are left or the encoders' queues back up, and, with a secondary directory configured,
+moves the recording there once less than `min_free_mb` is left. WriteBehindFile takes
+the writes of the containers written here (MJPEG AVI) off the encoder thread.
+"""
+import os
+import shutil
+import threading
+import time
+from collections import deque, namedtuple
+
+# Storage settings: space that must stay free, minutes of headroom below which to warn,
+# where recordings continue when the output directory fills up, MB written to measure the
+# disk's speed (0 = do not measure), MB of encoded data that may wait to be written, and MB
+# written between two fsyncs (0 = only at checkpoints and on close)
+StorageOptions = namedtuple("StorageOptions", ["min_free_mb", "warn_minutes", "secondary_dir", "test_mb",
+                                               "write_behind_mb", "sync_mb"], defaults=(1024, 30.0, "", 16, 64, 32))
+
+# Rough encoded bytes per pixel and frame, from `python src/encoders.py` at 1280x720. Its
+# noisy synthetic frames compress worse than most camera footage, so estimates err high.
+BYTES_PER_PIXEL = {"xvid": 0.1, "mjpeg": 0.16, "ffv1": 1.6, "png": 2.4, "mp4": 0.1}
+
+# How long a measured write speed is trusted before the disk is measured again
+WRITE_RATE_MAX_AGE = 600
+# Size of the writes used to measure a disk, and the most WriteBehindFile joins into one
+CHUNK_BYTES = 4 * 1024 * 1024
+
+# Levels of a StorageStatus, from harmless to a recording about to fail
+LEVELS = ("ok", "low", "slow", "critical")
+
+# Outcome of check_storage(): rates in bytes per second, write_rate None when not measured,
+# seconds_left None when nothing is being written; usable is False below min_free_mb
+StorageCheck = namedtuple("StorageCheck", ["directory", "free_bytes", "write_rate", "required_rate", "seconds_left",
+                                           "problems", "usable"])
+
+# What a StorageGuard last saw; message is empty at level "ok"
+StorageStatus = namedtuple("StorageStatus", ["directory", "free_bytes", "write_rate", "seconds_left", "level",
+                                             "message"], defaults=(0.0, None, "ok", ""))
+
+# directory -> (monotonic time, bytes per second) of the last measurement
+_write_rates = {}
+
+
+def storage_options_from_settings(settings):
+    """Builds StorageOptions from the storage keys of a config_manager settings section."""
+    return StorageOptions(settings.getfloat("storage_min_free_mb"), settings.getfloat("storage_warn_minutes"),
+                          settings.get("secondary_output_dir").strip(), settings.getfloat("storage_test_mb"),
+                          settings.getfloat("write_behind_mb"), settings.getfloat("write_behind_sync_mb"))
+
+
+def estimate_rate(codec, width, height, fps):
+    """Bytes per second a stream of that size and rate takes with `codec`, roughly."""
+    return BYTES_PER_PIXEL.get(codec, 1.0) * width * height * (fps or 30)
+
+
+def format_rate(rate):
+    return f"{rate / (1024 * 1024):.1f} MB/s"
+
+
+def format_duration(seconds):
+    if seconds >= 3600:
+        return f"{seconds / 3600:.1f} h"
+    return f"{seconds / 60:.0f} min"
+
+
+def measure_write_rate(directory, test_mb=16):
+    """Writes `test_mb` to a temporary file in `directory` in large chunks, fsyncs it and
+    returns the bytes per second that took. The result is kept for cached_write_rate()."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f".storage_test_{os.getpid()}.tmp")
+    chunk = os.urandom(min(CHUNK_BYTES, int(test_mb * 1024 * 1024)))
+    total = max(1, int(test_mb * 1024 * 1024) // len(chunk)) * len(chunk)
+    start = time.perf_counter()
+    try:
+        with open(path, "wb", buffering=0) as f:
+            for _ in range(total // len(chunk)):
+                f.write(chunk)
+            os.fsync(f.fileno())
+        rate = total / max(time.perf_counter() - start, 1e-6)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    _write_rates[os.path.abspath(directory)] = (time.monotonic(), rate)
+    return rate
+
+
+def cached_write_rate(directory):
+    """The write speed measure_write_rate() found for `directory` recently, or None."""
+    measured = _write_rates.get(os.path.abspath(directory))
+    if measured is None or time.monotonic() - measured[0] > WRITE_RATE_MAX_AGE:
+        return None
+    return measured[1]
+
+
+def check_storage(directory, required_rate, options, planned_seconds=0):
+    """Checks that `directory` has room and speed for a recording of `required_rate` bytes per second.
+
+    Uses the write speed measured by measure_write_rate() if there is a recent one; problems
+    lists what falls short, in words. planned_seconds is the intended length, if known.
+    """
+    os.makedirs(directory, exist_ok=True)
+    free = shutil.disk_usage(directory).free
+    spare = free - options.min_free_mb * 1024 * 1024
+    write_rate = cached_write_rate(directory)
+    seconds_left = max(0.0, spare / required_rate) if required_rate else None
+
+    problems = []
+    if spare <= 0:
+        problems.append(f"Only {free / (1024 * 1024):.0f} MB free in {directory}, "
+                        f"less than the {options.min_free_mb:.0f} MB that must stay free.")
+    elif seconds_left is not None and seconds_left < max(options.warn_minutes * 60, planned_seconds):
+        problems.append(f"{directory} has room for about {format_duration(seconds_left)} of recording.")
+    if write_rate is not None and required_rate and write_rate < 1.5 * required_rate:
+        problems.append(f"{directory} writes {format_rate(write_rate)}; recording needs about "
+                        f"{format_rate(required_rate)} and frames may be dropped.")
+    return StorageCheck(directory, free, write_rate, required_rate, seconds_left, problems, spare > 0)
+
+
+class WriteBehindFile:
+    """A binary file whose writes are queued and written out on a thread of their own.
+
+    write() copies the data and returns at once, unless more than max_bytes are already
+    waiting: then it waits, and the time spent waiting adds to `stalled_seconds`. The
+    thread joins queued data into writes of up to CHUNK_BYTES, so a slow disk or network
+    share sees few large sequential writes, and fsyncs after every sync_bytes (0 = only on
+    close), so the operating system never holds much unwritten data either. seek() and
+    flush() wait for the queue to empty first; a failed write is raised from the next call.
+    """
+
+    def __init__(self, path, max_bytes, sync_bytes=0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.sync_bytes = sync_bytes
+        self.stalled_seconds = 0.0
+
+        self._file = open(path, "wb")
+        self._position = 0
+        self._queue = deque()
+        self._queued_bytes = 0
+        self._unsynced = 0
+        self._error = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._write_loop, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def write(self, data):
+        data = bytes(data)
+        with self._cond:
+            self._raise_error()
+            if self._queued_bytes + len(data) > self.max_bytes and self._queue:
+                start = time.perf_counter()
+                self._cond.wait_for(lambda: self._queued_bytes + len(data) <= self.max_bytes or not self._queue
+                                    or self._error)
+                self.stalled_seconds += time.perf_counter() - start
+                self._raise_error()
+            self._queue.append(data)
+            self._queued_bytes += len(data)
+            self._cond.notify_all()
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def seek(self, position):
+        self.flush()
+        self._file.seek(position)
+        self._position = position
+
+    def flush(self):
+        with self._cond:
+            self._cond.wait_for(lambda: not self._queue or self._error)
+            self._raise_error()
+        self._file.flush()
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def close(self):
+        try:
+            self.flush()
+            os.fsync(self._file.fileno())
+        finally:
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+            self._thread.join()
+            self._file.close()
+
+    def _raise_error(self):
+        if self._error:
+            raise self._error
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._closed)
+                if not self._queue:
+                    return
+                # Take what is queued, up to one large write, but leave it counted until written
+                parts, size = [], 0
+                for part in self._queue:
+                    if parts and size + len(part) > CHUNK_BYTES:
+                        break
+                    parts.append(part)
+                    size += len(part)
+            try:
+                self._file.write(b"".join(parts))
+                self._unsynced += size
+                if self.sync_bytes and self._unsynced >= self.sync_bytes:
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                    self._unsynced = 0
+            except OSError as e:
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                for _ in parts:
+                    self._queue.popleft()
+                self._queued_bytes -= size
+                self._cond.notify_all()
+
+
+class StorageGuard:
+    """Watches the disk a recording writes to, once every `interval` seconds on its own thread.
+
+    `backlog` returns how full the encoders' queues are (0 to 1); a backlog over half means
+    the disk, or the encoder, cannot keep up. When less than min_free_mb is left and the
+    secondary directory has room, on_failover(directory) is called once to move the
+    recording there. The latest StorageStatus is in `status`.
+    """
+
+    def __init__(self, directory, options, backlog=None, on_failover=None, interval=1.0):
+        self.directory = directory
+        self.options = options
+        self.backlog = backlog
+        self.on_failover = on_failover
+        self.interval = interval
+        self.failed_over = False
+        self.status = StorageStatus(directory, shutil.disk_usage(directory).free)
+
+        self._last_sample = None  # (monotonic time, free bytes)
+        self._rate = 0.0          # Smoothed bytes per second the free space shrinks by
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._guard_loop, name="storage", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def check(self):
+        """Samples the disk, updates `status` and fails over if needed. Returns the status."""
+        min_free = self.options.min_free_mb * 1024 * 1024
+        try:
+            free = shutil.disk_usage(self.directory).free
+        except OSError as e:
+            # A network share that went away
+            self.status = StorageStatus(self.directory, 0, self._rate, 0.0, "critical",
+                                        f"Cannot reach {self.directory}: {e}")
+            free = 0
+        else:
+            now = time.monotonic()
+            if self._last_sample is not None and now > self._last_sample[0]:
+                rate = max(0.0, (self._last_sample[1] - free) / (now - self._last_sample[0]))
+                self._rate = rate if not self._rate else 0.7 * self._rate + 0.3 * rate
+            self._last_sample = (now, free)
+            seconds_left = max(0.0, (free - min_free) / self._rate) if self._rate else None
+            backlog = self.backlog() if self.backlog else 0.0
+
+            level, message = "ok", ""
+            if free < min_free:
+                level, message = "critical", f"Less than {self.options.min_free_mb:.0f} MB free in {self.directory}."
+            elif backlog > 0.5:
+                level, message = "slow", f"The disk is not keeping up: encoder queues {backlog:.0%} full."
+            elif seconds_left is not None and seconds_left < self.options.warn_minutes * 60:
+                level, message = "low", f"About {format_duration(seconds_left)} of disk space left."
+            self.status = StorageStatus(self.directory, free, self._rate, seconds_left, level, message)
+
+        if free < min_free and not self.failed_over:
+            self._fail_over()
+        return self.status
+
+    def _fail_over(self):
+        secondary = self.options.secondary_dir
+        if not secondary or os.path.abspath(secondary) == os.path.abspath(self.directory):
+            return
+        try:
+            os.makedirs(secondary, exist_ok=True)
+            room = shutil.disk_usage(secondary).free >= self.options.min_free_mb * 1024 * 1024
+        except OSError:
+            room = False
+        if not room:
+            self.status = self.status._replace(message=f"{self.status.message} {secondary} has no room either.")
+            return
+        self.failed_over = True
+        previous, self.directory = self.directory, secondary
+        self._last_sample = None
+        self._rate = 0.0
+        if self.on_failover:
+            self.on_failover(secondary)
+        self.status = StorageStatus(secondary, shutil.disk_usage(secondary).free, 0.0, None, "low",
+                                    f"{previous} was full; recording continues in {secondary}.")
+
+    def _guard_loop(self):
+        while not self._stop_event.wait(self.interval):
+            self.check()
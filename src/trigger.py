@@ -0,0 +1,157 @@
+import threading
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from encoders import is_jpeg
+from metrics import StageHistogram
+
+# "off", or what the detector measures: pixels that differ from a running-average
+# background ("motion") or the mean change from the previous analysed frame ("scene")
+TRIGGER_MODES = ("off", "motion", "scene")
+
+# Trigger settings. threshold is a fraction of pixels for "motion" and grey levels (0-255)
+# for "scene"; hang_seconds is how long recording continues after the last trigger; fps
+# is how often each stream is analysed; width is the analysed image width; pixel_threshold
+# is how many grey levels a pixel must differ from the background by to count as moving.
+TriggerOptions = namedtuple("TriggerOptions", ["mode", "threshold", "hang_seconds", "fps", "width", "pixel_threshold"],
+                            defaults=("motion", 0.01, 5.0, 10.0, 160, 25))
+
+
+def trigger_options_from_settings(settings):
+    """Builds TriggerOptions from the trigger_* keys of a config_manager settings section."""
+    mode = settings.get("trigger_mode")
+    threshold = settings.getfloat("scene_threshold" if mode == "scene" else "motion_threshold")
+    return TriggerOptions(mode, threshold, settings.getfloat("trigger_hang_seconds"), settings.getfloat("trigger_fps"))
+
+
+class MotionDetector:
+    """Scores how much a stream changes, on a small blurred grayscale copy of each frame.
+
+    "motion" scores the fraction of pixels more than `pixel_threshold` grey levels away from
+    a running-average background, which absorbs slow lighting changes. "scene" scores the
+    mean absolute difference from the previous frame in grey levels, for cuts and camera
+    moves. JPEG frames are decoded straight to a reduced-size grayscale image, so at the
+    default width a frame costs well under a millisecond whatever the capture resolution.
+    """
+
+    # Share of the background replaced by each analysed frame
+    LEARNING_RATE = 0.05
+
+    def __init__(self, mode="motion", width=160, pixel_threshold=25):
+        if mode not in TRIGGER_MODES[1:]:
+            raise ValueError(f"Unknown trigger mode '{mode}', expected one of {', '.join(TRIGGER_MODES[1:])}.")
+        self.mode = mode
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self._background = None  # float32 running average ("motion")
+        self._previous = None    # Previous small frame ("scene")
+
+    def score(self, image):
+        """Scores one BGR image or JPEG buffer against the frames before it (0 for the first)."""
+        small = self._small_gray(image)
+        if small is None:
+            return 0.0
+        if self.mode == "scene":
+            previous, self._previous = self._previous, small
+            if previous is None or previous.shape != small.shape:
+                return 0.0
+            return float(cv2.absdiff(small, previous).mean())
+
+        if self._background is None or self._background.shape != small.shape:
+            self._background = small.astype(np.float32)
+            return 0.0
+        diff = cv2.absdiff(small, cv2.convertScaleAbs(self._background))
+        cv2.accumulateWeighted(small, self._background, self.LEARNING_RATE)
+        return np.count_nonzero(diff > self.pixel_threshold) / diff.size
+
+    def _small_gray(self, image):
+        if is_jpeg(image):
+            # Let the JPEG decoder skip most of the work
+            gray = cv2.imdecode(image, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+            if gray is None:
+                return None
+        else:
+            gray = image
+        height = max(1, round(gray.shape[0] * self.width / gray.shape[1]))
+        small = cv2.resize(gray, (self.width, height), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        # Sensor noise would otherwise count as motion
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+
+class MotionMonitor:
+    """Scores the newest frame of one stream `fps` times a second on its own thread."""
+
+    def __init__(self, consumer, detector, threshold, fps=10.0):
+        self.consumer = consumer
+        self.detector = detector
+        self.threshold = threshold
+        self.interval = 1.0 / fps
+        self.score = 0.0
+        self.last_triggered = None  # Capture time of the last frame that reached the threshold
+        self.analyse_times = StageHistogram()
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor_loop, name="trigger", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _monitor_loop(self):
+        next_time = time.monotonic()
+        while not self._stop_event.is_set() and not self.consumer.ring.closed:
+            frame = self.consumer.read(timeout=self.interval)
+            if frame is None:
+                continue
+            start = time.perf_counter()
+            self.score = self.detector.score(frame.image)
+            self.analyse_times.observe(time.perf_counter() - start)
+            if self.score >= self.threshold:
+                self.last_triggered = frame.timestamp
+
+            # Only the newest frame matters, so sleep rather than analyse every frame
+            next_time = max(next_time + self.interval, time.monotonic())
+            self._stop_event.wait(next_time - time.monotonic())
+
+
+class RecordTrigger:
+    """Decides when a session should be recording, from a MotionMonitor per stream.
+
+    It is active from the moment any stream's score reaches the threshold until
+    `hang_seconds` after the last time one did. It only reports: whoever owns the
+    recording polls `active` and starts or stops it on its own thread.
+    """
+
+    def __init__(self, consumers, options):
+        self.options = options
+        self.monitors = [MotionMonitor(consumer, MotionDetector(options.mode, options.width, options.pixel_threshold),
+                                       options.threshold, options.fps) for consumer in consumers]
+
+    def start(self):
+        for monitor in self.monitors:
+            monitor.start()
+
+    def stop(self):
+        for monitor in self.monitors:
+            monitor.stop()
+
+    @property
+    def active(self):
+        last = max((monitor.last_triggered for monitor in self.monitors if monitor.last_triggered is not None),
+                   default=None)
+        return last is not None and time.monotonic() - last <= self.options.hang_seconds
+
+    @property
+    def scores(self):
+        return [monitor.score for monitor in self.monitors]